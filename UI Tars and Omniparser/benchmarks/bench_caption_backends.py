@@ -0,0 +1,92 @@
+'''
+python benchmarks/bench_caption_backends.py --model_path weights/icon_caption_florence --onnx_path weights/icon_caption_florence_onnx
+
+Caption throughput (captions/sec) of the cpu caption backends against fp32 Florence-2 on a fixed icon set, and
+how often their captions agree with the fp32 ones: exact match and mean character-level similarity.
+The icon set is every element of a few synthetic screenshots (same seeds every run), or the images in --icon_dir.
+'''
+
+import os
+import sys
+import time
+import json
+import argparse
+import difflib
+import numpy as np
+import torch
+from PIL import Image
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.utils import get_caption_model_processor, get_parsed_content_icon
+from util.synthetic import make_screenshot
+
+
+def icon_set(args):
+    """ [(HWC uint8 frame, normalized xyxy boxes)] """
+    if args.icon_dir:
+        frames = []
+        for name in sorted(os.listdir(args.icon_dir)):
+            if name.lower().endswith(('.png', '.jpg', '.jpeg')):
+                frames.append((np.asarray(Image.open(os.path.join(args.icon_dir, name)).convert('RGB')), torch.tensor([[0.0, 0.0, 1.0, 1.0]])))
+        return frames
+    frames = []
+    for seed in range(args.frames):
+        image, elements = make_screenshot(1920, 1080, n_icons=60, n_text=40, seed=seed)
+        frames.append((np.asarray(image), torch.tensor([e['bbox'] for e in elements], dtype=torch.float32)))
+    return frames
+
+
+def caption_all(caption_model_processor, frames, batch_size):
+    captions = []
+    start = time.perf_counter()
+    for image, boxes in frames:
+        captions.extend(get_parsed_content_icon(boxes, 0, image, caption_model_processor, batch_size=batch_size))
+    return captions, time.perf_counter() - start
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='CPU caption backend throughput / agreement benchmark')
+    parser.add_argument('--model_path', type=str, default='weights/icon_caption_florence', help='fp32 Florence-2 weights, also used by florence2_int8')
+    parser.add_argument('--onnx_path', type=str, default='weights/icon_caption_florence_onnx', help='Output of python -m util.caption_backends')
+    parser.add_argument('--backends', type=str, nargs='+', default=['florence2_int8', 'florence2_onnx'], choices=['florence2_int8', 'florence2_onnx'])
+    parser.add_argument('--frames', type=int, default=3, help='Synthetic screenshots in the icon set')
+    parser.add_argument('--icon_dir', type=str, default=None, help='Use a folder of icon images instead of synthetic screenshots')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=None, help='torch.set_num_threads for every backend')
+    parser.add_argument('--json', type=str, default=None, help='Also write the results to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    frames = icon_set(args)
+    n = sum(len(boxes) for _, boxes in frames)
+    print(f'{n} icons, batch size {args.batch_size}, {torch.get_num_threads()} torch threads')
+
+    results = {}
+    reference = None
+    for name in ['florence2', *args.backends]:
+        path = args.onnx_path if name == 'florence2_onnx' else args.model_path
+        caption_model_processor = get_caption_model_processor(name, path, device='cpu')
+        caption_all(caption_model_processor, frames[:1], args.batch_size)  # warm up
+        captions, seconds = caption_all(caption_model_processor, frames, args.batch_size)
+        if reference is None:
+            reference = captions
+        exact = float(np.mean([a == b for a, b in zip(reference, captions)]))
+        similarity = float(np.mean([difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(reference, captions)]))
+        results[name] = {'captions_per_sec': len(captions) / seconds, 'seconds': seconds, 'exact_match': exact, 'similarity': similarity}
+        del caption_model_processor
+
+    base = results['florence2']['captions_per_sec']
+    print(f"{'backend':>15} {'captions/s':>11} {'speedup':>8} {'exact':>7} {'similarity':>11}")
+    for name, r in results.items():
+        print(f"{name:>15} {r['captions_per_sec']:>11.1f} {r['captions_per_sec'] / base:>7.2f}x {r['exact_match']:>7.3f} {r['similarity']:>11.3f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'icons': n, 'batch_size': args.batch_size, 'threads': torch.get_num_threads(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+python benchmarks/bench_caption_preprocess.py --caption_model_name florence2 --num_boxes 50 200 500
+
+Per-parse icon preprocessing time (crop + resize + processor normalization, no generate) of the
+per-crop cv2/PIL path (the default) against the batched roi_align path (caption_preprocess='tensor').
+The two are not pixel-identical: roi_align samples across the crop edges and torch bicubic is not PIL's.
+With --caption_model_path the icons of synthetic screenshots are also captioned through both paths
+(crop_icons + caption_icons, no cache, no dedup) and the share of identical captions is reported, the
+number to check before switching a deployment to 'tensor'.
+'''
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+import cv2
+from torchvision.transforms import ToPILImage
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.utils import crop_icons_tensor, preprocess_icons_tensor, crop_icons, caption_icons, get_caption_model_processor
+from util.synthetic import make_screenshot
+
+PROCESSORS = {
+    'florence2': ('microsoft/Florence-2-base', '<CAPTION>'),
+    'blip2': ('Salesforce/blip2-opt-2.7b', 'The image shows'),
+}
+
+
+def load_processor(model_name, path):
+    if model_name == 'blip2':
+        from transformers import Blip2Processor
+        return Blip2Processor.from_pretrained(path)
+    from transformers import AutoProcessor
+    return AutoProcessor.from_pretrained(path, trust_remote_code=True)
+
+
+def pil_path(image_source, boxes, processor, prompt):
+    to_pil = ToPILImage()
+    croped_pil_image = []
+    for coord in boxes:
+        xmin, xmax = int(coord[0]*image_source.shape[1]), int(coord[2]*image_source.shape[1])
+        ymin, ymax = int(coord[1]*image_source.shape[0]), int(coord[3]*image_source.shape[0])
+        croped_pil_image.append(to_pil(cv2.resize(image_source[ymin:ymax, xmin:xmax, :], (64, 64))))
+    return processor(images=croped_pil_image, text=[prompt]*len(croped_pil_image), return_tensors="pt")
+
+
+def tensor_path(image_source, boxes, processor, prompt):
+    crops, _ = crop_icons_tensor(image_source, boxes, size=64)
+    return preprocess_icons_tensor(crops, processor, prompt)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Icon caption preprocessing benchmark')
+    parser.add_argument('--caption_model_name', type=str, default='florence2', choices=list(PROCESSORS))
+    parser.add_argument('--processor_path', type=str, default=None, help='Local processor directory, defaults to the hub name used by get_caption_model_processor')
+    parser.add_argument('--num_boxes', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--caption_model_path', type=str, default=None, help='Caption model weights, enables the caption parity check')
+    parser.add_argument('--parity_frames', type=int, default=3, help='Synthetic screenshots captioned by the parity check')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    hub_name, prompt = PROCESSORS[args.caption_model_name]
+    processor = load_processor(args.caption_model_name, args.processor_path or hub_name)
+    rng = np.random.default_rng(0)
+    image_source = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+
+    print(f"{'boxes':>6} {'pil ms':>10} {'tensor ms':>10} {'speedup':>8} {'max |diff|':>11}")
+    for n in args.num_boxes:
+        xy = rng.random((n, 2)) * 0.95
+        boxes = torch.tensor(np.concatenate([xy, xy + rng.uniform(0.01, 0.05, (n, 2))], axis=1), dtype=torch.float32)
+        timings = {}
+        for name, fn in (('pil', pil_path), ('tensor', tensor_path)):
+            best = float('inf')
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                inputs = fn(image_source, boxes, processor, prompt)
+                best = min(best, time.perf_counter() - start)
+            timings[name] = (best, inputs['pixel_values'])
+        diff = (timings['pil'][1] - timings['tensor'][1]).abs().max().item()
+        print(f"{n:>6} {timings['pil'][0]*1e3:>10.1f} {timings['tensor'][0]*1e3:>10.1f} {timings['pil'][0]/timings['tensor'][0]:>7.1f}x {diff:>11.4f}")
+    if args.caption_model_path:
+        caption_parity(args)
+
+
+def caption_parity(args):
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    caption_model_processor = get_caption_model_processor(args.caption_model_name, args.caption_model_path, device=device)
+    same, total = 0, 0
+    for seed in range(args.parity_frames):
+        image, elements = make_screenshot(args.width, args.height, seed=seed)
+        image_source = np.asarray(image)
+        boxes = torch.tensor([e['bbox'] for e in elements if e['type'] == 'icon'], dtype=torch.float32)
+        captions = {}
+        for preprocess in ('pil', 'tensor'):
+            crops, croped_images = crop_icons(image_source, boxes, preprocess=preprocess, device=device)
+            captions[preprocess] = caption_icons(croped_images, crops, caption_model_processor, preprocess=preprocess, dedup=None)
+        same += sum(a == b for a, b in zip(captions['pil'], captions['tensor']))
+        total += len(captions['pil'])
+    print(f'caption parity: {same}/{total} icons ({same / max(total, 1):.1%}) get the same caption from both paths')
+
+
+if __name__ == '__main__':
+    main()
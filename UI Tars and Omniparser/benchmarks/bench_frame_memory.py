@@ -0,0 +1,142 @@
+'''
+python benchmarks/bench_frame_memory.py --resolution 4k
+python benchmarks/bench_frame_memory.py --resolution 4k --scenarios parse --som_model_path weights/icon_detect/model.pt --caption_model_path weights/icon_caption_florence
+
+Peak RSS of one parse request, each scenario in a fresh interpreter, over the memory the process held before it:
+  legacy  - the image conversions a parse used to make: PIL decode, .convert('RGB') for yolo (flipped to BGR by
+            ultralytics), np.array for ocr, .convert('RGB') + np.asarray in get_som_labeled_img, the annotate copy
+            and Image.fromarray for the encoder
+  frame   - the same consumers fed from util.frame.Frame: one RGB decode, read-only views for ocr / cropping, the
+            lazy BGR buffer for yolo, the annotate copy and Image.fromarray for the encoder
+  parse   - Omniparser.parse end to end (needs the model weights), after a warm-up parse
+The peak is read from VmHWM, reset through /proc/self/clear_refs before the measured part (linux); elsewhere
+ru_maxrss is used, which cannot be reset and includes the set-up.
+'''
+
+import os
+import sys
+import io
+import json
+import base64
+import argparse
+import tempfile
+import subprocess
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.synthetic import RESOLUTIONS, make_screenshot
+
+SETUP = {
+    'legacy': "import io, base64, numpy as np; from PIL import Image",
+    'frame': "import numpy as np; from PIL import Image; from util.frame import Frame",
+    'parse': "from util.omniparser import Omniparser; omniparser = Omniparser({config!r}); omniparser.parse(image_base64)",
+}
+
+SCENARIOS = {
+    'legacy': '''
+image = Image.open(io.BytesIO(base64.b64decode(image_base64))); image.load()
+yolo_image = image.convert('RGB')
+yolo_bgr = np.ascontiguousarray(np.asarray(yolo_image)[:, :, ::-1])
+ocr_np = np.array(image)
+som_image = image.convert('RGB'); som_np = np.asarray(som_image)
+annotated = som_np.copy()
+encoder_image = Image.fromarray(annotated)
+''',
+    'frame': '''
+frame = Frame.from_base64(image_base64)
+yolo_bgr = frame.bgr
+ocr_np = frame.array
+som_np = frame.array
+annotated = som_np.copy()
+encoder_image = Image.fromarray(annotated)
+''',
+    'parse': "omniparser.parse(image_base64)",
+}
+
+CHILD = '''
+import json, sys
+sys.path.append({root_dir!r})
+image_base64 = open({path!r}).read()
+{setup}
+
+def peak_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024, True
+    except OSError:
+        pass
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 if sys.platform != 'darwin' else 1024 * 1024), False
+
+def current_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+try:
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+except OSError:
+    pass
+before = current_mb()
+{stmt}
+peak, resettable = peak_mb()
+print(json.dumps({{'before_mb': before, 'peak_mb': peak, 'resettable': resettable}}))
+'''
+
+
+def run(scenario, path, config):
+    child = CHILD.format(root_dir=root_dir, path=path, setup=SETUP[scenario].format(config=config), stmt=SCENARIOS[scenario])
+    out = subprocess.run([sys.executable, '-c', child], cwd=root_dir, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f'{scenario} failed:\n{out.stderr[-2000:]}')
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Peak RSS of the image handling of one parse')
+    parser.add_argument('--resolution', type=str, default='4k', choices=list(RESOLUTIONS))
+    parser.add_argument('--scenarios', type=str, nargs='+', default=['legacy', 'frame'], choices=list(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=3, help='Fresh interpreters per scenario, the lowest peak is reported')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--json', type=str, default=None, help='Also write the results to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    width, height = RESOLUTIONS[args.resolution]
+    image, _ = make_screenshot(width, height, seed=0)
+    buffered = io.BytesIO()
+    image.save(buffered, format='PNG')
+    config = {'som_model_path': args.som_model_path, 'caption_model_name': args.caption_model_name,
+              'caption_model_path': args.caption_model_path, 'caption_cache_size': 0}
+    results = {}
+    with tempfile.NamedTemporaryFile('w', suffix='.b64', delete=False) as f:
+        f.write(base64.b64encode(buffered.getvalue()).decode('ascii'))
+        path = f.name
+    try:
+        print(f"{args.resolution} ({width}x{height}, one RGB frame = {width * height * 3 / 2**20:.1f} MB)")
+        print(f"{'scenario':>8} {'peak over before MB':>20} {'peak MB':>8}")
+        for name in args.scenarios:
+            runs = [run(name, path, config) for _ in range(args.repeat)]
+            best = min(runs, key=lambda r: r['peak_mb'] - (r['before_mb'] or 0))
+            results[name] = {'peak_mb': best['peak_mb'], 'peak_over_before_mb': best['peak_mb'] - (best['before_mb'] or 0), 'resettable': best['resettable']}
+            print(f"{name:>8} {results[name]['peak_over_before_mb']:>20.1f} {best['peak_mb']:>8.1f}{'' if best['resettable'] else ' (not reset, includes set-up)'}")
+    finally:
+        os.remove(path)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'resolution': args.resolution, 'width': width, 'height': height, 'scenarios': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+'''
+python benchmarks/bench_micro_batch.py --som_model_path weights/icon_detect/model.pt --caption_model_path weights/icon_caption_florence --clients 4 --windows 0 5 10 20
+
+Latency of concurrent Omniparser.parse calls (--clients threads, each parsing its own synthetic screenshots back to
+back, like agents sharing one server) for several caption micro-batch windows (caption_batch_window_ms, 0 = every
+request captions alone). Reports p50 / p99 request latency, throughput and the micro-batcher stats, to pick the
+window against the latency budget. The caption cache is off so every request has caption work.
+'''
+
+import os
+import sys
+import time
+import json
+import base64
+import io
+import argparse
+import threading
+import numpy as np
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.omniparser import Omniparser
+from util.synthetic import RESOLUTIONS, make_screenshot
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Micro-batching latency benchmark')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--resolution', type=str, default='1080p', choices=list(RESOLUTIONS))
+    parser.add_argument('--clients', type=int, default=4, help='Concurrent callers')
+    parser.add_argument('--requests', type=int, default=5, help='Parses per client and window')
+    parser.add_argument('--windows', type=float, nargs='+', default=[0, 5, 10, 20], help='caption_batch_window_ms values')
+    parser.add_argument('--yolo', action='store_true', help='Micro-batch the icon detection with the same window')
+    parser.add_argument('--json', type=str, default=None, help='Also write the table to this file')
+    return parser.parse_args()
+
+
+def run_clients(omniparser, screenshots, clients, requests):
+    latencies, lock = [], threading.Lock()
+
+    def client(c):
+        for r in range(requests):
+            start = time.perf_counter()
+            omniparser.parse(screenshots[(c * requests + r) % len(screenshots)])
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return np.array(latencies), time.perf_counter() - start
+
+
+def main():
+    args = parse_arguments()
+    screenshots = []
+    for seed in range(args.clients * args.requests):
+        image, _ = make_screenshot(*RESOLUTIONS[args.resolution], seed=seed)
+        buffered = io.BytesIO()
+        image.save(buffered, format='PNG')
+        screenshots.append(base64.b64encode(buffered.getvalue()).decode('ascii'))
+
+    rows = {}
+    print(f"{'window ms':>9} {'p50 s':>7} {'p99 s':>7} {'parses/s':>9} {'calls':>6} {'requests/call':>20}")
+    for window in args.windows:
+        omniparser = Omniparser({'som_model_path': args.som_model_path, 'caption_model_name': args.caption_model_name,
+                                 'caption_model_path': args.caption_model_path, 'caption_cache_size': 0,
+                                 'caption_batch_window_ms': window, 'yolo_batch_window_ms': window if args.yolo else 0})
+        # warm up (ocr engine, model kernels, batcher exploration)
+        run_clients(omniparser, screenshots, args.clients, 1)
+        latencies, seconds = run_clients(omniparser, screenshots, args.clients, args.requests)
+        stats = omniparser.micro_batch_stats()
+        rows[window] = {'p50_s': float(np.percentile(latencies, 50)), 'p99_s': float(np.percentile(latencies, 99)),
+                        'parses_per_s': len(latencies) / seconds, 'micro_batch': stats}
+        r, caption = rows[window], stats['caption']
+        print(f"{window:>9g} {r['p50_s']:>7.2f} {r['p99_s']:>7.2f} {r['parses_per_s']:>9.2f} {caption['calls'] if caption else '-':>6} {str(caption['requests_per_call']) if caption else '-':>20}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'resolution': args.resolution, 'clients': args.clients, 'requests': args.requests, 'windows': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+'''
+python benchmarks/bench_parse_batch.py --som_model_path weights/icon_detect/model.pt --caption_model_path weights/icon_caption_florence --batch_sizes 1 4 8 16
+
+Throughput (images/s) of Omniparser.parse_batch against the same screenshots sent through Omniparser.parse one by
+one, on synthetic screenshots (different seeds, so captions are not shared between frames by the dedup). The
+caption cache is off. Element counts of both paths are printed as a sanity check: they differ only where the
+batched detector letterboxes frames of different sizes to a common input.
+'''
+
+import os
+import sys
+import time
+import json
+import base64
+import io
+import argparse
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.omniparser import Omniparser
+from util.synthetic import RESOLUTIONS, make_screenshot
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Batch parse throughput benchmark')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--resolution', type=str, default='1080p', choices=list(RESOLUTIONS))
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--profile', type=str, default='balanced')
+    parser.add_argument('--json', type=str, default=None, help='Also write the table to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    omniparser = Omniparser({'som_model_path': args.som_model_path, 'caption_model_name': args.caption_model_name,
+                             'caption_model_path': args.caption_model_path, 'caption_cache_size': 0})
+    screenshots = []
+    for seed in range(max(args.batch_sizes)):
+        image, _ = make_screenshot(*RESOLUTIONS[args.resolution], seed=seed)
+        buffered = io.BytesIO()
+        image.save(buffered, format='PNG')
+        screenshots.append(base64.b64encode(buffered.getvalue()).decode('ascii'))
+    # warm up both paths (ocr engine, model kernels, batcher exploration)
+    omniparser.parse(screenshots[0], profile=args.profile)
+    omniparser.parse_batch(screenshots[:2], profile=args.profile)
+
+    rows = {}
+    print(f"{'batch':>6} {'single img/s':>13} {'batch img/s':>12} {'speedup':>8} {'elements single/batch':>22}")
+    for n in args.batch_sizes:
+        images = screenshots[:n]
+        start = time.perf_counter()
+        single = [omniparser.parse(image_base64, profile=args.profile)[1] for image_base64 in images]
+        single_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        batch = omniparser.parse_batch(images, profile=args.profile)
+        batch_seconds = time.perf_counter() - start
+        rows[n] = {
+            'single_images_per_s': n / single_seconds,
+            'batch_images_per_s': n / batch_seconds,
+            'speedup': single_seconds / batch_seconds,
+            'elements_single': sum(len(p) for p in single),
+            'elements_batch': sum(len(r['parsed_content_list']) for r in batch),
+        }
+        r = rows[n]
+        print(f"{n:>6} {r['single_images_per_s']:>13.2f} {r['batch_images_per_s']:>12.2f} {r['speedup']:>7.2f}x {r['elements_single']:>11}/{r['elements_batch']:<10}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'resolution': args.resolution, 'profile': args.profile, 'batches': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
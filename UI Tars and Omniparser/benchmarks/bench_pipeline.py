@@ -0,0 +1,194 @@
+'''
+python benchmarks/bench_pipeline.py --som_model_path weights/icon_detect/model.pt --caption_model_path weights/icon_caption_florence --json bench.json
+
+Per-stage and end-to-end timing of the parse pipeline on synthetic screenshots (util/synthetic.py, PIL only,
+same seeds every run) over a grid of resolution x icon density x text density. Each stage is timed on its own
+with the outputs of the previous one as input:
+    ocr               check_ocr_box (easyocr)
+    yolo              predict_yolo
+    overlap_legacy    remove_overlap_new
+    overlap_vectorized remove_overlap_vectorized
+    caption           get_parsed_content_icon (caption cache off)
+    annotate          annotate (BoxAnnotator.annotate)
+    encode            PNG + base64 (encode_som_image)
+    parse             Omniparser.parse, the whole request, with its own per-stage timings (util.timing)
+
+--json writes the results with the git commit and environment; --baseline takes such a file from an earlier
+run and prints the per-stage ratio against it, e.g. to compare two commits:
+    git checkout A && python benchmarks/bench_pipeline.py --json a.json
+    git checkout B && python benchmarks/bench_pipeline.py --json b.json --baseline a.json
+'''
+
+import os
+import sys
+import time
+import json
+import base64
+import io
+import argparse
+import platform
+import subprocess
+import numpy as np
+import torch
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from torchvision.ops import box_convert
+from util.omniparser import Omniparser
+from util.utils import check_ocr_box, predict_yolo, remove_overlap_new, remove_overlap_vectorized, get_parsed_content_icon, annotate, encode_som_image, int_box_area
+from util.synthetic import RESOLUTIONS, make_screenshot
+
+STAGES = ('ocr', 'yolo', 'overlap_legacy', 'overlap_vectorized', 'caption', 'annotate', 'encode', 'parse')
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def summarize(seconds):
+    seconds = np.asarray(seconds, dtype=np.float64)
+    return {'mean': float(seconds.mean()), 'p50': float(np.percentile(seconds, 50)), 'p90': float(np.percentile(seconds, 90)),
+            'min': float(seconds.min()), 'runs': int(len(seconds))}
+
+
+def fusion_inputs(text, ocr_bbox, xyxy, w, h):
+    """ the normalized ocr / icon elements get_som_labeled_img hands to the overlap removal """
+    ocr_norm = (np.asarray(ocr_bbox, dtype=np.float64).reshape(-1, 4) / [w, h, w, h]).tolist()
+    icon_norm = (xyxy.cpu().numpy().reshape(-1, 4) / [w, h, w, h]).tolist()
+    ocr_elem = [{'type': 'text', 'bbox': box, 'interactivity': False, 'content': txt, 'source': 'box_ocr_content_ocr'} for box, txt in zip(ocr_norm, text) if int_box_area(box, w, h) > 0]
+    icon_elem = [{'type': 'icon', 'bbox': box, 'interactivity': True, 'content': None} for box in icon_norm if int_box_area(box, w, h) > 0]
+    return ocr_elem, icon_elem
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root_dir, capture_output=True, text=True, check=True)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root_dir, capture_output=True, text=True).stdout.strip()
+        return out.stdout.strip() + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_frame(omniparser, image, image_base64, stages, repeat):
+    """ seconds per stage (repeat runs each) and the element counts of one screenshot """
+    w, h = image.size
+    image_np = np.asarray(image)
+    seconds = {name: [] for name in stages}
+    for _ in range(repeat):
+        ((text, ocr_bbox), _), t = timed(check_ocr_box, image, display_img=False, output_bb_format='xyxy', easyocr_args={'text_threshold': 0.8}, use_paddleocr=False)
+        seconds.get('ocr', []).append(t)
+        (xyxy, logits, _), t = timed(predict_yolo, model=omniparser.som_model, image=image, box_threshold=0.05, imgsz=None, scale_img=False, iou_threshold=0.1)
+        seconds.get('yolo', []).append(t)
+        ocr_elem, icon_elem = fusion_inputs(text, ocr_bbox, xyxy, w, h)
+        filtered, t = timed(remove_overlap_new, boxes=icon_elem, iou_threshold=0.7, ocr_bbox=[dict(e) for e in ocr_elem])
+        seconds.get('overlap_legacy', []).append(t)
+        if 'overlap_vectorized' in seconds:
+            _, t = timed(remove_overlap_vectorized, boxes=icon_elem, iou_threshold=0.7, ocr_bbox=[dict(e) for e in ocr_elem])
+            seconds['overlap_vectorized'].append(t)
+        filtered = sorted(filtered, key=lambda x: x['content'] is None)
+        starting_idx = next((i for i, e in enumerate(filtered) if e['content'] is None), len(filtered))
+        boxes = torch.tensor([e['bbox'] for e in filtered]).reshape(-1, 4)
+        if 'caption' in seconds:
+            _, t = timed(get_parsed_content_icon, boxes, starting_idx, image_np, omniparser.caption_model_processor, caption_cache=None)
+            seconds['caption'].append(t)
+        (frame, _), t = timed(annotate, image_source=image_np, boxes=box_convert(boxes, in_fmt='xyxy', out_fmt='cxcywh'), logits=logits, phrases=list(range(len(boxes))), text_scale=0.8 * max(w, h) / 3200)
+        seconds.get('annotate', []).append(t)
+        _, t = timed(encode_som_image, frame, image_format='png')
+        seconds.get('encode', []).append(t)
+    parse_stages = {}
+    if 'parse' in seconds:
+        for _ in range(repeat):
+            (_, _, timings), t = timed(omniparser.parse, image_base64, return_timings=True)
+            seconds['parse'].append(t)
+            for name, stage in timings['stages'].items():
+                parse_stages.setdefault(name, []).append(stage['wall'])
+    counts = {'ocr': len(ocr_bbox), 'yolo': len(xyxy), 'fused': len(filtered), 'icons_captioned': len(filtered) - starting_idx}
+    return seconds, parse_stages, counts
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Parse pipeline benchmark on synthetic screenshots')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--som_backend', type=str, default='torch')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--resolutions', type=str, nargs='+', default=['1080p'], choices=list(RESOLUTIONS))
+    parser.add_argument('--n_icons', type=int, nargs='+', default=[40, 120], help='Icon densities (icons per screenshot)')
+    parser.add_argument('--n_text', type=int, nargs='+', default=[60, 200], help='Text densities (text lines per screenshot)')
+    parser.add_argument('--frames', type=int, default=3, help='Screenshots (seeds) per scenario')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs of every stage per screenshot')
+    parser.add_argument('--stages', type=str, nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--json', type=str, default=None, help='Write the results to this file')
+    parser.add_argument('--baseline', type=str, default=None, help='Results of an earlier run (--json) to compare against')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    # caption cache off so repeated runs and parses measure the caption model every time
+    omniparser = Omniparser({'som_model_path': args.som_model_path, 'som_backend': args.som_backend, 'caption_model_name': args.caption_model_name,
+                             'caption_model_path': args.caption_model_path, 'caption_cache_size': 0})
+    warmup, _ = make_screenshot(*RESOLUTIONS[args.resolutions[0]], seed=0)
+    buffered = io.BytesIO()
+    warmup.save(buffered, format='PNG')
+    omniparser.parse(base64.b64encode(buffered.getvalue()).decode('ascii'))  # ocr engine, model kernels
+
+    scenarios = []
+    for res in args.resolutions:
+        for n_icons in args.n_icons:
+            for n_text in args.n_text:
+                seconds = {name: [] for name in args.stages}
+                parse_stages, counts = {}, []
+                for seed in range(args.frames):
+                    image, truth = make_screenshot(*RESOLUTIONS[res], n_icons=n_icons, n_text=n_text, seed=seed)
+                    buffered = io.BytesIO()
+                    image.save(buffered, format='PNG')
+                    frame_seconds, frame_parse_stages, frame_counts = bench_frame(omniparser, image, base64.b64encode(buffered.getvalue()).decode('ascii'), args.stages, args.repeat)
+                    for name, values in frame_seconds.items():
+                        seconds[name].extend(values)
+                    for name, values in frame_parse_stages.items():
+                        parse_stages.setdefault(name, []).extend(values)
+                    counts.append({'truth': len(truth), **frame_counts})
+                scenario = {
+                    'resolution': res, 'width': RESOLUTIONS[res][0], 'height': RESOLUTIONS[res][1], 'n_icons': n_icons, 'n_text': n_text,
+                    'elements': {k: float(np.mean([c[k] for c in counts])) for k in counts[0]},
+                    'stages': {name: summarize(values) for name, values in seconds.items()},
+                    'parse_stages': {name: summarize(values) for name, values in parse_stages.items()},
+                }
+                scenarios.append(scenario)
+                print(f"{res} icons={n_icons} text={n_text}: " + ', '.join(f"{name} {s['p50'] * 1e3:.0f}ms" for name, s in scenario['stages'].items()))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {(s['resolution'], s['n_icons'], s['n_text']): s for s in json.load(f)['scenarios']}
+    print(f"\n{'scenario':>22} {'stage':>19} {'p50 ms':>9} {'p90 ms':>9}" + (f" {'vs base':>8}" if baseline else ''))
+    for s in scenarios:
+        key = (s['resolution'], s['n_icons'], s['n_text'])
+        for name, stat in s['stages'].items():
+            line = f"{'%s/%d/%d' % key:>22} {name:>19} {stat['p50'] * 1e3:>9.1f} {stat['p90'] * 1e3:>9.1f}"
+            base = baseline.get(key, {}).get('stages', {}).get(name) if baseline else None
+            if base:
+                line += f" {stat['p50'] / base['p50']:>7.2f}x"
+            print(line)
+
+    if args.json:
+        meta = {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+            'device': str(omniparser.caption_model_processor['model'].device),
+            'args': vars(args),
+        }
+        with open(args.json, 'w') as f:
+            json.dump({'meta': meta, 'scenarios': scenarios}, f, indent=2)
+        print(f'results written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''
+python benchmarks/bench_profiles.py --som_model_path weights/icon_detect/model.pt --caption_model_path weights/icon_caption_florence
+
+Latency vs element recall of the parse profiles (util/profiles.py) on a fixed set of synthetic screenshots
+(same seeds every run). An element counts as found when a parsed box of the same type overlaps it with
+IoU >= --match_iou; recall is reported for text, icons and all elements. One Omniparser instance serves
+every profile through the per-request `profile` argument, with the caption cache off.
+'''
+
+import os
+import sys
+import time
+import json
+import base64
+import io
+import argparse
+import numpy as np
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.omniparser import Omniparser
+from util.profiles import PARSE_PROFILES
+from util.spatial_index import intersection_area
+from util.synthetic import RESOLUTIONS, make_screenshot
+
+
+def iou_matrix(a, b):
+    a, b = np.asarray(a, dtype=np.float64).reshape(-1, 4), np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    inter = intersection_area(a[:, None], b[None, :])
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def found(truth, parsed, kind, match_iou):
+    """ number of ground-truth elements of `kind` matched by a parsed element of the same kind """
+    gt = [e['bbox'] for e in truth if e['type'] == kind]
+    pred = [e['bbox'] for e in parsed if e['type'] == kind]
+    if not gt or not pred:
+        return 0, len(gt)
+    return int((iou_matrix(gt, pred).max(axis=1) >= match_iou).sum()), len(gt)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Parse profile latency / recall benchmark')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--profiles', type=str, nargs='+', default=list(PARSE_PROFILES), choices=list(PARSE_PROFILES))
+    parser.add_argument('--resolutions', type=str, nargs='+', default=['1080p'], choices=list(RESOLUTIONS))
+    parser.add_argument('--frames', type=int, default=5, help='Screenshots per resolution')
+    parser.add_argument('--match_iou', type=float, default=0.5)
+    parser.add_argument('--json', type=str, default=None, help='Also write the table to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    omniparser = Omniparser({'som_model_path': args.som_model_path, 'caption_model_name': args.caption_model_name,
+                             'caption_model_path': args.caption_model_path, 'caption_cache_size': 0})
+    screenshots = []
+    for res in args.resolutions:
+        for seed in range(args.frames):
+            image, elements = make_screenshot(*RESOLUTIONS[res], seed=seed)
+            buffered = io.BytesIO()
+            image.save(buffered, format='PNG')
+            screenshots.append((base64.b64encode(buffered.getvalue()).decode('ascii'), elements))
+    omniparser.parse(screenshots[0][0])  # warm up (ocr engine, model kernels)
+
+    rows = {}
+    for name in args.profiles:
+        latencies, counts = [], {'text': [0, 0], 'icon': [0, 0]}
+        for image_base64, truth in screenshots:
+            start = time.perf_counter()
+            _, parsed = omniparser.parse(image_base64, profile=name)
+            latencies.append(time.perf_counter() - start)
+            for kind in counts:
+                hit, total = found(truth, parsed, kind, args.match_iou)
+                counts[kind][0] += hit
+                counts[kind][1] += total
+        hits, total = sum(c[0] for c in counts.values()), sum(c[1] for c in counts.values())
+        rows[name] = {
+            'latency_mean': float(np.mean(latencies)),
+            'latency_p90': float(np.percentile(latencies, 90)),
+            'recall_text': counts['text'][0] / max(counts['text'][1], 1),
+            'recall_icon': counts['icon'][0] / max(counts['icon'][1], 1),
+            'recall': hits / max(total, 1),
+        }
+
+    print(f"{'profile':>9} {'mean s':>7} {'p90 s':>7} {'text recall':>12} {'icon recall':>12} {'recall':>7}")
+    for name, r in rows.items():
+        print(f"{name:>9} {r['latency_mean']:>7.2f} {r['latency_p90']:>7.2f} {r['recall_text']:>12.3f} {r['recall_icon']:>12.3f} {r['recall']:>7.3f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'frames': len(screenshots), 'match_iou': args.match_iou, 'profiles': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+'''
+python benchmarks/bench_pyramid.py --som_model_path weights/icon_detect/model.pt --caption_model_path weights/icon_caption_florence --max_sides 1920 1280
+
+Native resolution parse vs the resolution pyramid (pyramid_max_side, util/pyramid.py) on synthetic screenshots at
+1440p and 4K. Reports parse latency, the ocr / yolo / refine stage times, the share of the frame read again at full
+resolution, and element recall: against the synthetic ground truth (a parsed box of the same type with IoU >=
+--match_iou) and against the native parse of the same frame. --text_size fixes the font size in px at every
+resolution (e.g. 14 at 4K, small text the downscaled pass misses or misreads), by default it scales with the screen.
+The caption cache is off so every parse captions.
+'''
+
+import os
+import sys
+import time
+import json
+import base64
+import io
+import argparse
+import numpy as np
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.omniparser import Omniparser
+from util.spatial_index import intersection_area
+from util.synthetic import RESOLUTIONS, make_screenshot
+
+
+def box_area(b):
+    return (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+
+
+def recall(reference, parsed, match_iou, kinds=('text', 'icon')):
+    """ share of the reference elements of `kinds` matched by a parsed element of the same type """
+    hits, total = 0, 0
+    for kind in kinds:
+        ref = np.asarray([e['bbox'] for e in reference if e['type'] == kind], dtype=np.float64).reshape(-1, 4)
+        pred = np.asarray([e['bbox'] for e in parsed if e['type'] == kind], dtype=np.float64).reshape(-1, 4)
+        total += len(ref)
+        if not len(ref) or not len(pred):
+            continue
+        inter = intersection_area(ref[:, None], pred[None, :])
+        iou = inter / (box_area(ref)[:, None] + box_area(pred)[None, :] - inter + 1e-9)
+        hits += int((iou.max(axis=1) >= match_iou).sum())
+    return hits / max(total, 1)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Resolution pyramid latency / recall benchmark')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--profile', type=str, default='balanced')
+    parser.add_argument('--resolutions', type=str, nargs='+', default=['1440p', '4k'], choices=list(RESOLUTIONS))
+    parser.add_argument('--max_sides', type=int, nargs='+', default=[1920, 1280], help='pyramid_max_side values to compare with the native parse')
+    parser.add_argument('--frames', type=int, default=3, help='Screenshots per resolution')
+    parser.add_argument('--text_size', type=int, default=None, help='Font size in px, default scales with the resolution')
+    parser.add_argument('--min_text_height', type=int, default=12)
+    parser.add_argument('--min_conf', type=float, default=0.5)
+    parser.add_argument('--match_iou', type=float, default=0.5)
+    parser.add_argument('--json', type=str, default=None, help='Also write the table to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    omniparser = Omniparser({'som_model_path': args.som_model_path, 'caption_model_name': args.caption_model_name,
+                             'caption_model_path': args.caption_model_path, 'caption_cache_size': 0, 'profile': args.profile,
+                             'pyramid_min_text_height': args.min_text_height, 'pyramid_min_conf': args.min_conf})
+    omniparser.warmup(resolutions=args.resolutions)
+
+    rows = {}
+    print(f"{'res':>6} {'max side':>8} {'mean s':>7} {'ocr s':>6} {'yolo s':>7} {'refine s':>8} {'refined':>8} {'gt recall':>10} {'vs native':>10}")
+    for res in args.resolutions:
+        width, height = RESOLUTIONS[res]
+        screenshots = []
+        for seed in range(args.frames):
+            image, elements = make_screenshot(width, height, text_size=args.text_size, seed=seed)
+            buffered = io.BytesIO()
+            image.save(buffered, format='PNG')
+            screenshots.append((base64.b64encode(buffered.getvalue()).decode('ascii'), elements))
+        native = []
+        # None first: the native parses are the reference of the pyramid ones
+        for max_side in [None] + args.max_sides:
+            # pyramid_max_side is a profile setting, the config value overrides the profile on every parse
+            omniparser.config['pyramid_max_side'] = max_side
+            latencies, stages, refined, gt_recall, native_recall = [], {'ocr': [], 'yolo': [], 'refine': []}, [], [], []
+            for i, (image_base64, truth) in enumerate(screenshots):
+                start = time.perf_counter()
+                _, parsed, timings = omniparser.parse(image_base64, incremental=False, return_timings=True)
+                latencies.append(time.perf_counter() - start)
+                for name in stages:
+                    stages[name].append(timings['stages'].get(name, {}).get('wall', 0.0))
+                refined.append(timings.get('pyramid_refine_ratio', 0.0))
+                gt_recall.append(recall(truth, parsed, args.match_iou))
+                if max_side is None:
+                    native.append(parsed)
+                native_recall.append(recall(native[i], parsed, args.match_iou))
+            row = {'latency_mean': float(np.mean(latencies)), 'latency_p90': float(np.percentile(latencies, 90)),
+                   **{f'{name}_mean': float(np.mean(v)) for name, v in stages.items()},
+                   'refine_ratio': float(np.mean(refined)), 'recall_gt': float(np.mean(gt_recall)), 'recall_vs_native': float(np.mean(native_recall))}
+            rows.setdefault(res, {})[str(max_side or 'native')] = row
+            print(f"{res:>6} {str(max_side or 'native'):>8} {row['latency_mean']:>7.2f} {row['ocr_mean']:>6.2f} {row['yolo_mean']:>7.2f} "
+                  f"{row['refine_mean']:>8.2f} {row['refine_ratio']:>8.1%} {row['recall_gt']:>10.3f} {row['recall_vs_native']:>10.3f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'frames': args.frames, 'text_size': args.text_size, 'match_iou': args.match_iou, 'profile': args.profile, 'resolutions': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
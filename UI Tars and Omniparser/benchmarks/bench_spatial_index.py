@@ -0,0 +1,77 @@
+'''
+python benchmarks/bench_spatial_index.py --counts 100 300 1000 3000 10000
+
+Scaling of util.spatial_index.GridIndex against the brute-force all-pairs overlap check,
+on random normalized boxes shaped like screen elements (icons queried against ocr lines).
+'''
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.spatial_index import GridIndex, intersection_area
+
+
+def random_boxes(rng, n, width, height):
+    xy = rng.random((n, 2))
+    wh = np.stack([rng.uniform(*width, n), rng.uniform(*height, n)], axis=1)
+    return np.concatenate([xy, np.minimum(xy + wh, 1.0)], axis=1)
+
+
+def brute_force_pairs(icons, ocr, chunk=256):
+    rows, cols = [], []
+    for start in range(0, len(icons), chunk):
+        r, c = np.nonzero(intersection_area(icons[start:start+chunk, None], ocr[None, :]) > 0)
+        rows.append(r + start)
+        cols.append(c)
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def timeit(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='GridIndex micro-benchmark')
+    parser.add_argument('--counts', type=int, nargs='+', default=[100, 300, 1000, 3000, 10000], help='Number of ocr boxes; icons are a third of that')
+    parser.add_argument('--repeat', type=int, default=5, help='Best-of repeats per measurement')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    rng = np.random.default_rng(args.seed)
+    print(f"{'ocr':>7} {'icons':>7} {'pairs':>8} {'brute ms':>10} {'build ms':>10} {'query ms':>10} {'speedup':>8}")
+    for n in args.counts:
+        # text lines are wide and short, icons roughly square; elements shrink as the count grows
+        # so screen coverage stays realistic (a denser screen means smaller text, not more layers)
+        scale = min(1.0, np.sqrt(1000 / n))
+        ocr = random_boxes(rng, n, (0.02 * scale, 0.15 * scale), (0.008 * scale, 0.02 * scale))
+        icons = random_boxes(rng, max(n // 3, 1), (0.01 * scale, 0.03 * scale), (0.01 * scale, 0.03 * scale))
+
+        def brute():
+            return brute_force_pairs(icons, ocr)
+
+        index = GridIndex(ocr)
+        rows, cols = index.query_pairs(icons)
+        brute_rows, brute_cols = brute()
+        assert np.array_equal(rows, brute_rows) and np.array_equal(cols, brute_cols)
+
+        t_brute = timeit(brute, args.repeat)
+        t_build = timeit(lambda: GridIndex(ocr), args.repeat)
+        t_query = timeit(lambda: index.query_pairs(icons), args.repeat)
+        speedup = t_brute / (t_build + t_query)
+        print(f"{n:>7} {len(icons):>7} {len(rows):>8} {t_brute*1e3:>10.2f} {t_build*1e3:>10.2f} {t_query*1e3:>10.2f} {speedup:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
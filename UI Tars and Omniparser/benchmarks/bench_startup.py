@@ -0,0 +1,80 @@
+'''
+python benchmarks/bench_startup.py --repeat 3
+python benchmarks/bench_startup.py --scenarios first_parse --som_model_path weights/icon_detect/model.safetensors --caption_model_path weights/icon_caption_florence
+
+Import / startup cost of util.utils in a fresh interpreter:
+  lazy   - `import util.utils` as it is now (ocr engines are built on first use)
+  easyocr - import + the first get_ocr_engine('easyocr') call, what Omniparser.parse pays once
+  eager  - import + every ocr engine + matplotlib, i.e. what every import used to cost
+  first_parse - Omniparser construction + one parse of a synthetic 1080p screenshot (needs the weights), with the
+           breakdown of Omniparser.startup: imports, detector / caption model load, first parse per stage.
+           Run it on the original weights and on the ones prepared by python -m util.model_cache (--no_fast_load
+           for the plain from_pretrained) to compare the loading paths.
+'''
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'lazy': "import util.utils",
+    'easyocr': "import util.utils; util.utils.get_ocr_engine('easyocr')",
+    'eager': "import util.utils; util.utils.get_ocr_engine('easyocr'); util.utils.get_ocr_engine('paddleocr'); from matplotlib import pyplot",
+    'first_parse': "import io, base64; from util.omniparser import Omniparser; from util.synthetic import make_screenshot; "
+                   "image = make_screenshot(1920, 1080, seed=0)[0]; buffered = io.BytesIO(); image.save(buffered, format='PNG'); "
+                   "omniparser = Omniparser({config!r}); omniparser.parse(base64.b64encode(buffered.getvalue()).decode('ascii')); startup = omniparser.startup",
+}
+
+CHILD = '''
+import json, time
+start = time.perf_counter()
+{stmt}
+seconds = time.perf_counter() - start
+try:
+    import resource
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+except ImportError:  # windows
+    max_rss_mb = None
+print(json.dumps({{'seconds': seconds, 'max_rss_mb': max_rss_mb, 'startup': globals().get('startup')}}))
+'''
+
+
+def run(stmt, config):
+    out = subprocess.run([sys.executable, '-c', CHILD.format(stmt=stmt.format(config=config))], cwd=root_dir, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='util.utils startup benchmark')
+    parser.add_argument('--scenarios', type=str, nargs='+', default=['lazy', 'easyocr', 'eager'], choices=list(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=3, help='Fresh interpreters per scenario, best time is reported')
+    # first_parse
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--no_fast_load', dest='fast_load', action='store_false', help='Plain from_pretrained for the caption model')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    config = {'som_model_path': args.som_model_path, 'caption_model_name': args.caption_model_name, 'caption_model_path': args.caption_model_path,
+              'caption_cache_size': 0, 'fast_load': args.fast_load}
+    print(f"{'scenario':>10} {'seconds':>9} {'max rss MB':>11}")
+    for name in args.scenarios:
+        results = [run(SCENARIOS[name], config) for _ in range(args.repeat)]
+        best = min(results, key=lambda r: r['seconds'])
+        rss = f"{best['max_rss_mb']:.0f}" if best['max_rss_mb'] is not None else 'n/a'
+        print(f"{name:>10} {best['seconds']:>9.2f} {rss:>11}")
+        startup = best['startup']
+        if startup:
+            print(f"{'':>10} imports {startup['import_seconds']:.2f}s, detector load {startup['detector_load_seconds']:.2f}s, "
+                  f"caption model load {startup['caption_load_seconds']:.2f}s, first parse {startup['first_parse_seconds']:.2f}s")
+            print(f"{'':>10} " + ', '.join(f'{stage} {seconds:.2f}s' for stage, seconds in startup['first_parse_stages'].items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+python benchmarks/bench_tiled_ocr.py --tile_size 1280 --tile_overlap 128 --tile_workers 4
+
+Full-frame vs tiled check_ocr_box on synthetic screenshots at 1080p, 1440p and 4K.
+Reports latency, number of text boxes and how many of the full-frame boxes the tiled pass
+recovers (IoU >= 0.5 and identical text).
+'''
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.utils import check_ocr_box, get_ocr_engine
+from util.spatial_index import intersection_area
+from util.synthetic import RESOLUTIONS, make_screenshot
+
+
+def box_area(b):
+    return (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+
+
+def match_rate(reference, candidate, iou_threshold=0.5):
+    (ref_text, ref_bb), (cand_text, cand_bb) = reference, candidate
+    if not ref_bb:
+        return 1.0
+    if not cand_bb:
+        return 0.0
+    ref, cand = np.asarray(ref_bb, dtype=np.float64), np.asarray(cand_bb, dtype=np.float64)
+    inter = intersection_area(ref[:, None], cand[None, :])
+    iou = inter / (box_area(ref)[:, None] + box_area(cand)[None, :] - inter + 1e-6)
+    matched = 0
+    for i, j in enumerate(iou.argmax(axis=1)):
+        matched += iou[i, j] >= iou_threshold and ref_text[i] == cand_text[j]
+    return matched / len(ref_bb)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Tiled OCR benchmark')
+    parser.add_argument('--resolutions', type=str, nargs='+', default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument('--tile_size', type=int, default=1280)
+    parser.add_argument('--tile_overlap', type=int, default=128)
+    parser.add_argument('--tile_workers', type=int, default=4)
+    parser.add_argument('--use_paddleocr', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    get_ocr_engine('paddleocr' if args.use_paddleocr else 'easyocr')  # keep engine start-up out of the timings
+    ocr_kwargs = dict(display_img=False, output_bb_format='xyxy', easyocr_args={'text_threshold': 0.8}, use_paddleocr=args.use_paddleocr)
+    print(f"{'res':>6} {'full s':>8} {'tiled s':>8} {'speedup':>8} {'full n':>7} {'tiled n':>8} {'match':>6}")
+    for name in args.resolutions:
+        width, height = RESOLUTIONS[name]
+        scale = width * height / (1920 * 1080)
+        image, _ = make_screenshot(width, height, n_icons=int(60 * scale), n_text=int(150 * scale), seed=args.seed)
+
+        start = time.perf_counter()
+        full, _ = check_ocr_box(image, **ocr_kwargs)
+        t_full = time.perf_counter() - start
+        start = time.perf_counter()
+        tiled, _ = check_ocr_box(image, tile_size=args.tile_size, tile_overlap=args.tile_overlap, tile_workers=args.tile_workers, **ocr_kwargs)
+        t_tiled = time.perf_counter() - start
+
+        print(f"{name:>6} {t_full:>8.2f} {t_tiled:>8.2f} {t_full/t_tiled:>7.1f}x {len(full[0]):>7} {len(tiled[0]):>8} {match_rate(full, tiled):>6.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''
+python benchmarks/check_detector_parity.py --model_path weights/icon_detect/model.pt --backends onnx openvino
+
+Parity and latency of the exported icon detector backends against the torch (ultralytics) one on synthetic
+screenshots. Boxes are matched greedily by IoU; the script exits with status 1 when a backend misses or adds
+more than --max_mismatch of the torch boxes or a matched confidence differs by more than --max_conf_diff,
+so it can gate an export in CI. Export first with `python -m util.detector_backends`.
+'''
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from torchvision.ops import box_iou
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.detector_backends import get_detector
+from util.synthetic import RESOLUTIONS, make_screenshot
+
+
+def match(reference, candidate, min_iou):
+    """ greedy one-to-one matching by IoU, returns (reference idx, candidate idx) pairs """
+    if len(reference) == 0 or len(candidate) == 0:
+        return []
+    iou = box_iou(reference, candidate)
+    pairs = []
+    while True:
+        best = iou.max()
+        if best < min_iou:
+            return pairs
+        i, j = divmod(int(iou.argmax()), iou.shape[1])
+        pairs.append((i, j))
+        iou[i, :] = -1
+        iou[:, j] = -1
+
+
+def detect_timed(detector, image, args):
+    start = time.perf_counter()
+    xyxy, conf = detector.detect(image, conf=args.box_threshold, iou=args.iou_threshold)
+    return xyxy.float().cpu(), conf.float().cpu(), time.perf_counter() - start
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Icon detector backend parity check')
+    parser.add_argument('--model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--backends', type=str, nargs='+', default=['onnx'], choices=['onnx', 'openvino'])
+    parser.add_argument('--resolutions', type=str, nargs='+', default=['1080p', '1440p'], choices=list(RESOLUTIONS))
+    parser.add_argument('--frames', type=int, default=5, help='Synthetic frames per resolution')
+    parser.add_argument('--box_threshold', type=float, default=0.05)
+    parser.add_argument('--iou_threshold', type=float, default=0.1, help='NMS iou, as Omniparser uses it')
+    parser.add_argument('--min_iou', type=float, default=0.9, help='IoU for two boxes to count as the same detection')
+    parser.add_argument('--max_mismatch', type=float, default=0.02, help='Allowed fraction of unmatched boxes')
+    parser.add_argument('--max_conf_diff', type=float, default=0.02)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    reference = get_detector(args.model_path, 'torch')
+    backends = {name: get_detector(args.model_path, name) for name in args.backends}
+    frames = [make_screenshot(*RESOLUTIONS[res], seed=seed)[0] for res in args.resolutions for seed in range(args.frames)]
+    # warm up every backend once, the first call includes graph compilation / allocation
+    for detector in [reference, *backends.values()]:
+        detector.detect(frames[0], conf=args.box_threshold, iou=args.iou_threshold)
+
+    stats = {name: {'ref': 0, 'cand': 0, 'matched': 0, 'iou': [], 'conf_diff': 0.0, 'seconds': 0.0} for name in backends}
+    ref_seconds = 0.0
+    for image in frames:
+        ref_xyxy, ref_conf, seconds = detect_timed(reference, image, args)
+        ref_seconds += seconds
+        for name, detector in backends.items():
+            xyxy, conf, seconds = detect_timed(detector, image, args)
+            s = stats[name]
+            s['seconds'] += seconds
+            s['ref'] += len(ref_xyxy)
+            s['cand'] += len(xyxy)
+            for i, j in match(ref_xyxy, xyxy, args.min_iou):
+                s['matched'] += 1
+                s['iou'].append(box_iou(ref_xyxy[i:i + 1], xyxy[j:j + 1]).item())
+                s['conf_diff'] = max(s['conf_diff'], abs(ref_conf[i] - conf[j]).item())
+
+    ok = True
+    print(f"{'backend':>9} {'ms/frame':>9} {'speedup':>8} {'boxes':>7} {'recall':>7} {'precision':>9} {'mean IoU':>9} {'max |dconf|':>11}")
+    print(f"{'torch':>9} {ref_seconds / len(frames) * 1e3:>9.1f} {'1.0x':>8} {sum(s['ref'] for s in stats.values()) // max(len(stats), 1):>7}")
+    for name, s in stats.items():
+        recall = s['matched'] / s['ref'] if s['ref'] else 1.0
+        precision = s['matched'] / s['cand'] if s['cand'] else 1.0
+        mean_iou = float(np.mean(s['iou'])) if s['iou'] else float('nan')
+        print(f"{name:>9} {s['seconds'] / len(frames) * 1e3:>9.1f} {ref_seconds / s['seconds']:>7.1f}x {s['cand']:>7} {recall:>7.3f} {precision:>9.3f} {mean_iou:>9.4f} {s['conf_diff']:>11.4f}")
+        if min(recall, precision) < 1 - args.max_mismatch or s['conf_diff'] > args.max_conf_diff:
+            print(f'{name}: parity check FAILED')
+            ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+'''
+python benchmarks/check_golden.py record --golden golden.json
+python benchmarks/check_golden.py compare --golden golden.json --set overlap_method=legacy --ignore_captions
+
+Golden-output regression check of Omniparser.parse. `record` parses a fixed set of screenshots (synthetic ones from
+util/synthetic.py, same seeds every run, plus any --images) and stores parsed_content_list with the config it
+ran with. `compare` parses the same screenshots again with that config (--set key=value overrides single entries,
+e.g. to try an optimized code path) and diffs every element against the golden one:
+    missing / extra     a golden element without a current one of IoU >= --min_iou, or the other way round
+    order               matched elements that changed their relative position in the list
+    type, interactivity, source   must be equal
+    content             text similarity (difflib ratio) >= --min_text_similarity; --ignore_captions skips the
+                        contents produced by the caption model, which change with the backend / precision / batch
+The report lists every difference per screenshot and the script exits with status 1 when there is any, so it can
+gate a change in CI.
+'''
+
+import os
+import sys
+import ast
+import json
+import glob
+import base64
+import io
+import time
+import argparse
+import difflib
+import numpy as np
+from PIL import Image
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+from util.spatial_index import intersection_area
+from util.synthetic import RESOLUTIONS, make_screenshot
+
+# sources whose content comes from the caption model (icons without ocr text inside)
+CAPTION_SOURCES = ('box_yolo_content_yolo',)
+
+
+def iou_matrix(a, b):
+    a, b = np.asarray(a, dtype=np.float64).reshape(-1, 4), np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    inter = intersection_area(a[:, None], b[None, :])
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def match(golden, current, min_iou):
+    """ greedy one-to-one matching by bbox IoU, returns (golden idx, current idx, iou) sorted by golden idx """
+    if not golden or not current:
+        return []
+    iou = iou_matrix([e['bbox'] for e in golden], [e['bbox'] for e in current])
+    pairs = []
+    while True:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < min_iou:
+            return sorted(pairs)
+        pairs.append((int(i), int(j), float(iou[i, j])))
+        iou[i, :] = -1
+        iou[:, j] = -1
+
+
+def describe(elem):
+    x0, y0, x1, y1 = elem['bbox']
+    return f"{elem['type']} [{x0:.3f}, {y0:.3f}, {x1:.3f}, {y1:.3f}] {elem.get('content')!r}"
+
+
+def text_similarity(a, b):
+    if a == b:
+        return 1.0
+    return difflib.SequenceMatcher(None, a or '', b or '').ratio()
+
+
+def diff_elements(golden, current, min_iou=0.9, min_text_similarity=0.9, ignore_captions=False):
+    """ list of readable differences between two parsed_content_lists, empty when they agree within the tolerances """
+    diffs = []
+    pairs = match(golden, current, min_iou)
+    matched_golden, matched_current = {i for i, _, _ in pairs}, {j for _, j, _ in pairs}
+    diffs += [f'missing #{i}: {describe(e)}' for i, e in enumerate(golden) if i not in matched_golden]
+    diffs += [f'extra   #{j}: {describe(e)}' for j, e in enumerate(current) if j not in matched_current]
+    # pairs are sorted by golden index, any current index lower than one before it moved
+    highest = -1
+    for i, j, iou in pairs:
+        g, c = golden[i], current[j]
+        where = f'#{i}' if i == j else f'#{i} (now #{j})'
+        if j < highest:
+            diffs.append(f'order   {where}: {describe(g)} moved before a preceding element')
+        highest = max(highest, j)
+        for key in ('type', 'interactivity', 'source'):
+            if g.get(key) != c.get(key):
+                diffs.append(f'{key:<7} {where}: {g.get(key)!r} -> {c.get(key)!r} ({describe(g)})')
+        if ignore_captions and g.get('source') in CAPTION_SOURCES:
+            continue
+        similarity = text_similarity(g.get('content'), c.get('content'))
+        if similarity < min_text_similarity:
+            diffs.append(f'content {where}: {g.get("content")!r} -> {c.get("content")!r} (similarity {similarity:.2f}, IoU {iou:.2f})')
+    return diffs
+
+
+def frame_names(resolutions, frames, images):
+    """ names of the fixed screenshot set, the golden file keys frames by them: synthetic:<resolution>:<seed> or a repo relative path """
+    names = [f'synthetic:{res}:{seed}' for res in resolutions for seed in range(frames)]
+    return names + [os.path.relpath(os.path.abspath(p), root_dir) for p in sorted(p for pattern in images for p in glob.glob(pattern))]
+
+
+def frame_base64(name):
+    if name.startswith('synthetic:'):
+        _, res, seed = name.split(':')
+        image = make_screenshot(*RESOLUTIONS[res], seed=int(seed))[0]
+    else:
+        image = Image.open(os.path.join(root_dir, name)).convert('RGB')
+    buffered = io.BytesIO()
+    image.save(buffered, format='PNG')
+    return base64.b64encode(buffered.getvalue()).decode('ascii')
+
+
+def parse_overrides(items):
+    """ --set key=value pairs, values as python literals when they parse as one (0.05, None, True), else strings """
+    overrides = {}
+    for item in items:
+        key, _, value = item.partition('=')
+        try:
+            overrides[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[key] = value
+    return overrides
+
+
+def parse_all(config, names):
+    from util.omniparser import Omniparser
+    omniparser = Omniparser(config)
+    return {name: omniparser.parse(frame_base64(name))[1] for name in names}
+
+
+def record(args):
+    config = {'som_model_path': args.som_model_path, 'caption_model_name': args.caption_model_name, 'caption_model_path': args.caption_model_path,
+              'caption_cache_size': 0, 'incremental': False, **parse_overrides(args.set)}
+    names = frame_names(args.resolutions, args.frames, args.images)
+    parsed = parse_all(config, names)
+    with open(args.golden, 'w') as f:
+        json.dump({'recorded': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'config': config,
+                   'frames': [{'name': name, 'elements': parsed[name]} for name in names]}, f, indent=1)
+    print(f'recorded {sum(len(v) for v in parsed.values())} elements of {len(names)} screenshots to {args.golden}')
+
+
+def compare(args):
+    with open(args.golden) as f:
+        golden = json.load(f)
+    config = {**golden['config'], **parse_overrides(args.set)}
+    parsed = parse_all(config, [frame['name'] for frame in golden['frames']])
+
+    total = 0
+    for frame in golden['frames']:
+        diffs = diff_elements(frame['elements'], parsed[frame['name']], args.min_iou, args.min_text_similarity, args.ignore_captions)
+        total += len(diffs)
+        status = 'ok' if not diffs else f'{len(diffs)} difference(s)'
+        print(f"{frame['name']}: {len(frame['elements'])} golden / {len(parsed[frame['name']])} current elements, {status}")
+        for line in diffs[:args.max_report]:
+            print('    ' + line)
+        if len(diffs) > args.max_report:
+            print(f'    ... {len(diffs) - args.max_report} more')
+    print(f"{'golden check passed' if not total else f'golden check FAILED: {total} difference(s)'}"
+          f" (min IoU {args.min_iou}, min text similarity {args.min_text_similarity}{', captions ignored' if args.ignore_captions else ''})")
+    sys.exit(0 if not total else 1)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Golden parse output regression check')
+    parser.add_argument('command', choices=['record', 'compare'])
+    parser.add_argument('--golden', type=str, default='golden_parse.json')
+    parser.add_argument('--set', type=str, nargs='*', default=[], metavar='KEY=VALUE',
+                        help='Omniparser config entries, on top of the defaults (record) or of the recorded config (compare)')
+    # record
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--caption_model_name', type=str, default='florence2')
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--resolutions', type=str, nargs='+', default=['1080p', '1440p'], choices=list(RESOLUTIONS))
+    parser.add_argument('--frames', type=int, default=3, help='Synthetic screenshots per resolution')
+    parser.add_argument('--images', type=str, nargs='*', default=[], help='Glob patterns of real screenshots to add (paths are stored relative to the repo)')
+    # compare
+    parser.add_argument('--min_iou', type=float, default=0.9, help='IoU for a current element to count as the golden one')
+    parser.add_argument('--min_text_similarity', type=float, default=0.9, help='difflib ratio below which a content counts as changed, 1 for exact')
+    parser.add_argument('--ignore_captions', action='store_true', help='Skip the content of captioned icons')
+    parser.add_argument('--max_report', type=int, default=50, help='Differences printed per screenshot')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    if args.command == 'record':
+        record(args)
+    else:
+        compare(args)
@@ -1,8 +1,12 @@
 import requests
 import base64
+import io
+import numpy as np
+from PIL import Image
 from pathlib import Path
 from tools.screen_capture import get_screenshot
 from agent.llm_utils.utils import encode_image
+from agent.llm_utils.parsed_screen import ParsedScreen
 
 OUTPUT_DIR = "./tmp/outputs"
 
@@ -33,9 +37,11 @@ class OmniParserClient:
             # Create output directory if it doesn't exist
             Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
             
+            if response_json.get('som_image_format') == 'raw':
+                self.raw_to_png(response_json)
             som_image_data = base64.b64decode(response_json['som_image_base64'])
             screenshot_path_uuid = Path(screenshot_path).stem.replace("screenshot_", "")
-            som_screenshot_path = f"{OUTPUT_DIR}/screenshot_som_{screenshot_path_uuid}.png"
+            som_screenshot_path = f"{OUTPUT_DIR}/screenshot_som_{screenshot_path_uuid}.{response_json.get('som_image_format', 'png')}"
             with open(som_screenshot_path, "wb") as f:
                 f.write(som_image_data)
             
@@ -55,13 +61,18 @@ class OmniParserClient:
         except Exception as e:
             raise Exception(f"Error in OmniParser processing: {str(e)}")
     
+    def raw_to_png(self, response_json: dict):
+        # a server started with --som_format raw sends bare RGB bytes, the agents open and forward the image as a file
+        width, height = response_json['som_image_size']
+        pixels = np.frombuffer(base64.b64decode(response_json['som_image_base64']), dtype=np.uint8).reshape(height, width, 3)
+        buffered = io.BytesIO()
+        Image.fromarray(pixels).save(buffered, format='PNG')
+        response_json['som_image_base64'] = base64.b64encode(buffered.getvalue()).decode('ascii')
+        response_json['som_image_format'] = 'png'
+
     def reformat_messages(self, response_json: dict):
-        screen_info = ""
-        for idx, element in enumerate(response_json["parsed_content_list"]):
-            element['idx'] = idx
-            if element['type'] == 'text':
-                screen_info += f'ID: {idx}, Text: {element["content"]}\n'
-            elif element['type'] == 'icon':
-                screen_info += f'ID: {idx}, Icon: {element["content"]}\n'
-        response_json['screen_info'] = screen_info
+        # the element list becomes one columnar ParsedScreen (element id = row), screen.to_dicts() gives it back
+        screen = ParsedScreen.from_dicts(response_json.pop("parsed_content_list"))
+        response_json['screen'] = screen
+        response_json['screen_info'] = screen.to_screen_info()
         return response_json
\ No newline at end of file
@@ -0,0 +1,108 @@
+import numpy as np
+
+# known values first, so the common tables are the same for every screen; unknown values are appended per screen
+TYPES = ('text', 'icon')
+SOURCES = ('box_ocr_content_ocr', 'box_yolo_content_ocr', 'box_yolo_content_yolo')
+
+
+def _encode(values, table):
+    """ codes of values in table (extended in place with unseen values), -1 for None """
+    index = {value: i for i, value in enumerate(table)}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        if value is None:
+            codes[i] = -1
+            continue
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(table)
+            table.append(value)
+        codes[i] = code
+    return codes
+
+
+class ParsedScreen:
+    """
+    Columnar form of an OmniParser parsed_content_list: bboxes as one (N, 4) float32 array of normalized xyxy,
+    types / sources as small integer codes into shared tables, interactivity as a bool array and contents as indices
+    into a string table (repeated captions and labels are stored once).
+
+        screen = ParsedScreen.from_dicts(response_json['parsed_content_list'])
+        screen.to_screen_info()  # 'ID: 0, Text: File\\nID: 1, Icon: Settings\\n...' for the planner prompt
+        screen.centroid(12, width, height)  # pixel point to click for element 12
+
+    The element id is the row index. Dicts are only built again by to_dicts / element, at the JSON boundary.
+    """
+
+    __slots__ = ('bboxes', 'types', 'sources', 'interactivity', 'contents', 'type_table', 'source_table', 'strings')
+
+    def __init__(self, bboxes, types, sources, interactivity, contents, type_table=TYPES, source_table=SOURCES, strings=()):
+        self.bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+        self.types = np.asarray(types, dtype=np.int8)
+        self.sources = np.asarray(sources, dtype=np.int8)
+        self.interactivity = np.asarray(interactivity, dtype=bool)
+        self.contents = np.asarray(contents, dtype=np.int32)
+        self.type_table = tuple(type_table)
+        self.source_table = tuple(source_table)
+        self.strings = tuple(strings)
+
+    @classmethod
+    def from_dicts(cls, elements):
+        type_table, source_table, strings = list(TYPES), list(SOURCES), []
+        return cls(
+            bboxes=[e['bbox'] for e in elements],
+            types=_encode([e.get('type') for e in elements], type_table),
+            sources=_encode([e.get('source') for e in elements], source_table),
+            interactivity=[bool(e.get('interactivity')) for e in elements],
+            contents=_encode([e.get('content') for e in elements], strings),
+            type_table=type_table, source_table=source_table, strings=strings,
+        )
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def _column(self, codes, table):
+        # code -1 (None) picks the trailing None
+        lookup = list(table) + [None]
+        return [lookup[c] for c in codes.tolist()]
+
+    def to_dicts(self, with_idx=False):
+        """ the parsed_content_list layout; sources that were missing stay missing, with_idx adds the element id """
+        # float32 -> float64 digits beyond the 7th are noise, 1e-7 of a normalized coordinate is far below a pixel
+        bboxes = self.bboxes.astype(np.float64).round(7).tolist()
+        types = self._column(self.types, self.type_table)
+        sources = self._column(self.sources, self.source_table)
+        contents = self._column(self.contents, self.strings)
+        interactivity = self.interactivity.tolist()
+        elements = []
+        for i in range(len(bboxes)):
+            elem = {'type': types[i], 'bbox': bboxes[i], 'interactivity': interactivity[i], 'content': contents[i]}
+            if sources[i] is not None:
+                elem['source'] = sources[i]
+            if with_idx:
+                elem['idx'] = i
+            elements.append(elem)
+        return elements
+
+    def element(self, idx):
+        return self[[idx]].to_dicts()[0]
+
+    def __getitem__(self, index):
+        """ row subset (slice, index array or bool mask) sharing the tables """
+        return ParsedScreen(self.bboxes[index], self.types[index], self.sources[index], self.interactivity[index], self.contents[index],
+                            self.type_table, self.source_table, self.strings)
+
+    def to_screen_info(self):
+        """ 'ID: <idx>, Text|Icon: <content>' lines of the planner prompt, elements of other types are left out """
+        labels = {code: label for code, label in ((self.type_table.index('text'), 'Text'), (self.type_table.index('icon'), 'Icon'))}
+        contents = self._column(self.contents, self.strings)
+        return ''.join(f'ID: {idx}, {labels[code]}: {contents[idx]}\n' for idx, code in enumerate(self.types.tolist()) if code in labels)
+
+    def centroids(self, width=1, height=1):
+        """ (N, 2) float centers of every element, scaled from normalized to width x height """
+        return (self.bboxes[:, :2] + self.bboxes[:, 2:]) / 2 * np.array([width, height], dtype=np.float32)
+
+    def centroid(self, idx, width, height):
+        """ integer pixel center of element idx, raises IndexError for an unknown id """
+        x0, y0, x1, y1 = self.bboxes[idx].tolist()
+        return [int((x0 + x1) / 2 * width), int((y0 + y1) / 2 * height)]
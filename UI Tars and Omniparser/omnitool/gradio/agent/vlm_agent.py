@@ -149,8 +149,7 @@ class VLMAgent:
         img_to_show_base64 = parsed_screen["som_image_base64"]
         if "Box ID" in vlm_response_json:
             try:
-                bbox = parsed_screen["parsed_content_list"][int(vlm_response_json["Box ID"])]["bbox"]
-                vlm_response_json["box_centroid_coordinate"] = [int((bbox[0] + bbox[2]) / 2 * screen_width), int((bbox[1] + bbox[3]) / 2 * screen_height)]
+                vlm_response_json["box_centroid_coordinate"] = parsed_screen["screen"].centroid(int(vlm_response_json["Box ID"]), screen_width, screen_height)
                 img_to_show_data = base64.b64decode(img_to_show_base64)
                 img_to_show = Image.open(BytesIO(img_to_show_data))
 
@@ -240,7 +240,9 @@ def valid_params(user_input, state):
             probe_url = f'http://{url}/probe'
             print(f"Checking connectivity to {server_name} at {probe_url}")
             response = requests.get(probe_url, timeout=5)
-            if response.status_code != 200:
+            if response.status_code == 503:
+                errors.append(f"{server_name} at {url} is still warming up, please retry in a moment")
+            elif response.status_code != 200:
                 errors.append(f"{server_name} at {url} is not responding correctly (status: {response.status_code})")
         except requests.exceptions.Timeout:
             errors.append(f"{server_name} at {url} is not responding (timeout)")
@@ -369,6 +371,8 @@ def test_connectivity(state):
         response = requests.get(url, timeout=5)
         if response.status_code == 200:
             results.append("✅ OmniParser Server: Connected")
+        elif response.status_code == 503:
+            results.append("⏳ OmniParser Server: Warming up")
         else:
             results.append(f"❌ OmniParser Server: HTTP {response.status_code}")
     except requests.exceptions.ConnectionError:
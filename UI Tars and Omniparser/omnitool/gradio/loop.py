@@ -122,7 +122,7 @@ def sampling_loop_sync(
                 print(f"Loop iteration {loop_count}")
                 
                 try:
-                    parsed_screen = omniparser_client() # parsed_screen: {"som_image_base64": dino_labled_img, "parsed_content_list": parsed_content_list, "screen_info"}
+                    parsed_screen = omniparser_client() # parsed_screen: {"som_image_base64": dino_labled_img, "screen": ParsedScreen, "screen_info"}
                     screen_info_block = TextBlock(text='Below is the structured accessibility information of the current UI screen, which includes text and icons you can operate on, take these information into account when you are making the prediction for the next action. Note you will still need to take screenshot to get the image: \n' + parsed_screen['screen_info'], type='text')
                     screen_info_dict = {"role": "user", "content": [screen_info_block]}
                     messages.append(screen_info_dict)
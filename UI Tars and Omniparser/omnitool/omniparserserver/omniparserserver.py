@@ -5,21 +5,56 @@ python -m omniparserserver --som_model_path ../../weights/icon_detect/model.pt -
 import sys
 import os
 import time
-from fastapi import FastAPI
+import threading
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import argparse
+from typing import List, Literal, Optional
 import uvicorn
 root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(root_dir)
 from util.omniparser import Omniparser
+from util.utils import check_som_image_options
+from util.synthetic import RESOLUTIONS
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Omniparser API')
     parser.add_argument('--som_model_path', type=str, default='../../weights/icon_detect/model.pt', help='Path to the som model')
-    parser.add_argument('--caption_model_name', type=str, default='florence2', help='Name of the caption model')
+    parser.add_argument('--som_backend', type=str, default='torch', choices=['torch', 'onnx', 'openvino'], help='Icon detector runtime, onnx/openvino load the graph exported next to som_model_path (python -m util.detector_backends)')
+    parser.add_argument('--caption_model_name', type=str, default='florence2', help='Name of the caption model: florence2, blip2, or the cpu backends florence2_int8 / florence2_onnx (caption_model_path = exported onnx dir)')
     parser.add_argument('--caption_model_path', type=str, default='../../weights/icon_caption_florence', help='Path to the caption model')
+    parser.add_argument('--no_fast_load', dest='fast_load', action='store_false', help='Load the caption model with a plain from_pretrained instead of memory-mapped safetensors (python -m util.model_cache)')
     parser.add_argument('--device', type=str, default='cpu', help='Device to run the model')
-    parser.add_argument('--BOX_TRESHOLD', type=float, default=0.05, help='Threshold for box detection')
+    parser.add_argument('--profile', type=str, default='balanced', choices=['fast', 'balanced', 'accurate'], help='Default speed/accuracy profile, see util/profiles.py')
+    parser.add_argument('--BOX_TRESHOLD', type=float, default=None, help='Threshold for box detection, overrides the profile (balanced uses 0.05)')
+    parser.add_argument('--overlap_method', type=str, default='vectorized', choices=['vectorized', 'legacy'], help='Implementation used to resolve overlapping boxes')
+    parser.add_argument('--caption_cache_size', type=int, default=4096, help='Number of icon captions kept in memory, 0 disables the caption cache')
+    parser.add_argument('--caption_cache_path', type=str, default=None, help='Optional sqlite file that persists icon captions across restarts')
+    parser.add_argument('--caption_preprocess', type=str, default='pil', choices=['pil', 'tensor'], help='Per-crop PIL path or the batched tensor crop/normalize for icon captioning (faster, not pixel-identical, see benchmarks/bench_caption_preprocess.py)')
+    parser.add_argument('--caption_batch_size', type=int, default=None, help='Fixed icon caption batch size, by default it is picked from free memory and measured latency')
+    parser.add_argument('--caption_max_batch_size', type=int, default=128, help='Upper bound of the adaptive caption batch size')
+    parser.add_argument('--caption_batch_state_path', type=str, default=None, help='Optional json file that keeps the learned caption batch size per model across restarts')
+    parser.add_argument('--caption_dedup', type=str, default='exact', choices=['exact', 'near', 'none'], help='Caption identical icon crops of a frame once: exact pixels, near (16x16 quantized) or none')
+    parser.add_argument('--no_parallel_detection', dest='parallel_detection', action='store_false', help='Run OCR and icon detection one after the other')
+    parser.add_argument('--ocr_tile_size', type=int, default=None, help='Run OCR on overlapping tiles of this size (px) for larger frames, e.g. 1280 for 4K')
+    parser.add_argument('--ocr_tile_overlap', type=int, default=128, help='Overlap between OCR tiles (px)')
+    parser.add_argument('--ocr_tile_workers', type=int, default=4, help='Threads used for tiled OCR')
+    parser.add_argument('--pyramid_max_side', type=int, default=None, help='Run OCR and icon detection of larger frames downscaled to this longest side (px), e.g. 1920; overrides the profile')
+    parser.add_argument('--pyramid_min_text_height', type=int, default=12, help='Text lower than this (px, downscaled frame) is read again at full resolution')
+    parser.add_argument('--pyramid_min_conf', type=float, default=0.5, help='Text read with a lower OCR confidence is read again at full resolution')
+    parser.add_argument('--incremental', action='store_true', help='Re-parse only the changed regions between consecutive frames of a session by default (requests without a session_id are parsed in full)')
+    parser.add_argument('--incremental_max_changed_ratio', type=float, default=0.3, help='Changed screen fraction above which an incremental parse falls back to a full parse')
+    parser.add_argument('--som_format', type=str, default='png', choices=['png', 'jpeg', 'webp', 'raw'], help='Default encoding of the returned SOM image, raw is uncompressed RGB bytes')
+    parser.add_argument('--som_quality', type=int, default=None, help='Default PNG compress level (0-9), JPEG quality (1-95) or WebP quality (1-100) of the SOM image')
+    parser.add_argument('--som_scale', type=float, default=None, help='Default downscale factor (0, 1] applied to the SOM image before encoding')
+    parser.add_argument('--caption_batch_window_ms', type=float, default=0, help='Merge the icon caption work of concurrent /parse/ requests arriving within this window (ms) into shared batches, 0 disables')
+    parser.add_argument('--caption_batch_max_items', type=int, default=256, help='Icon crops that close a caption micro-batch before its window ends')
+    parser.add_argument('--yolo_batch_window_ms', type=float, default=0, help='Merge the icon detection of concurrent /parse/ requests arriving within this window (ms), 0 disables')
+    parser.add_argument('--yolo_batch_max_images', type=int, default=8, help='Screenshots that close a detection micro-batch before its window ends')
+    parser.add_argument('--max_batch_images', type=int, default=32, help='Most images one /parse/batch request may carry')
+    parser.add_argument('--warmup_resolutions', type=str, nargs='*', default=['1080p', '1440p'], choices=list(RESOLUTIONS), help='Parse a synthetic screenshot at these resolutions on startup, /probe/ answers 503 until done; no value skips the warmup')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='Host for the API')
     parser.add_argument('--port', type=int, default=8000, help='Port for the API')
     args = parser.parse_args()
@@ -27,25 +62,103 @@ def parse_arguments():
 
 args = parse_arguments()
 config = vars(args)
+config['caption_dedup'] = None if args.caption_dedup == 'none' else args.caption_dedup
 
 app = FastAPI()
 omniparser = Omniparser(config)
+warmup_state = {'status': 'warming' if args.warmup_resolutions else 'ready', 'error': None}
+
+def run_warmup():
+    try:
+        omniparser.warmup(args.warmup_resolutions)
+    except Exception as e:
+        # a failed warmup only leaves the first requests slow, serve anyway
+        print(f'warmup failed: {e!r}')
+        warmup_state['error'] = repr(e)
+    warmup_state['status'] = 'ready'
+
+@app.on_event("startup")
+async def start_warmup():
+    # in the background so /probe/ can answer while the models warm up
+    if args.warmup_resolutions:
+        threading.Thread(target=run_warmup, name='warmup', daemon=True).start()
 
 class ParseRequest(BaseModel):
     base64_image: str
+    session_id: Optional[str] = None
+    incremental: Optional[bool] = None
+    # raw is uncompressed RGB bytes of som_image_size, see OmniParserClient for decoding it
+    som_format: Optional[Literal['png', 'jpeg', 'webp', 'raw']] = None
+    som_quality: Optional[int] = None
+    som_scale: Optional[float] = None
+    # util/profiles.py PARSE_PROFILES, unknown names are rejected before parsing
+    profile: Optional[Literal['fast', 'balanced', 'accurate']] = None
+
+def check_som_options(request):
+    """ 400 for a SOM quality / scale the encoder would reject, before any parsing work """
+    try:
+        check_som_image_options(request.som_format or config['som_format'],
+                                request.som_quality if request.som_quality is not None else config['som_quality'],
+                                request.som_scale if request.som_scale is not None else config['som_scale'])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def run_parse(parse_request: ParseRequest):
+    start = time.time()
+    dino_labled_img, parsed_content_list, timings = omniparser.parse(parse_request.base64_image, session_id=parse_request.session_id, incremental=parse_request.incremental,
+                                                                     som_format=parse_request.som_format, som_quality=parse_request.som_quality, som_scale=parse_request.som_scale, profile=parse_request.profile,
+                                                                     return_timings=True)
+    latency = time.time() - start
+    print('time:', latency)
+    # last_som_image is per thread, read it in the thread that parsed
+    som_image = omniparser.last_som_image
+    return {"som_image_base64": dino_labled_img, "som_image_format": som_image['format'], "som_image_size": [som_image['width'], som_image['height']],
+            "parsed_content_list": parsed_content_list, 'latency': latency, 'encode_time': timings['stages']['encode']['wall'], 'timings': timings}
 
 @app.post("/parse/")
 async def parse(parse_request: ParseRequest):
     print('start parsing...')
+    check_som_options(parse_request)
+    if omniparser.micro_batching:
+        # concurrent requests only meet in the micro-batchers if they parse in parallel
+        return await run_in_threadpool(run_parse, parse_request)
+    return run_parse(parse_request)
+
+class BatchParseRequest(BaseModel):
+    base64_images: List[str]
+    som_format: Optional[Literal['png', 'jpeg', 'webp', 'raw']] = None
+    som_quality: Optional[int] = None
+    som_scale: Optional[float] = None
+    profile: Optional[Literal['fast', 'balanced', 'accurate']] = None
+
+@app.post("/parse/batch")
+async def parse_batch(batch_request: BatchParseRequest):
+    if not 0 < len(batch_request.base64_images) <= args.max_batch_images:
+        raise HTTPException(status_code=400, detail=f'a batch takes 1 to {args.max_batch_images} images, got {len(batch_request.base64_images)}')
+    check_som_options(batch_request)
+    print(f'start parsing a batch of {len(batch_request.base64_images)}...')
     start = time.time()
-    dino_labled_img, parsed_content_list = omniparser.parse(parse_request.base64_image)
+    kwargs = dict(som_format=batch_request.som_format, som_quality=batch_request.som_quality, som_scale=batch_request.som_scale, profile=batch_request.profile, return_timings=True)
+    if omniparser.micro_batching:
+        results, timings = await run_in_threadpool(omniparser.parse_batch, batch_request.base64_images, **kwargs)
+    else:
+        results, timings = omniparser.parse_batch(batch_request.base64_images, **kwargs)
     latency = time.time() - start
     print('time:', latency)
-    return {"som_image_base64": dino_labled_img, "parsed_content_list": parsed_content_list, 'latency': latency}
+    return {"results": results, 'latency': latency, 'timings': timings}
+
+@app.get("/metrics/")
+async def metrics():
+    return {"caption_cache": omniparser.caption_cache.stats() if omniparser.caption_cache else None, "caption_batch": omniparser.caption_batcher.stats(),
+            "parse_timings": omniparser.timing_stats.summary(), "parse_batch_timings": omniparser.batch_timing_stats.summary(), "micro_batch": omniparser.micro_batch_stats(),
+            "startup": {**omniparser.startup, 'status': warmup_state['status'], 'warmup_error': warmup_state['error'], 'warmup_timings': omniparser.warmup_timing_stats.summary()}}
 
 @app.get("/probe/")
 async def root():
-    return {"message": "Omniparser API ready"}
+    # clients treat any status but 200 as not ready yet
+    if warmup_state['status'] != 'ready':
+        return JSONResponse(status_code=503, content={"status": "warming", "message": "Omniparser API warming up"})
+    return {"status": "ready", "message": "Omniparser API ready"}
 
 if __name__ == "__main__":
     uvicorn.run("omniparserserver:app", host=args.host, port=args.port, reload=True)
\ No newline at end of file
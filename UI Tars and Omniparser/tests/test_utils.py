@@ -0,0 +1,41 @@
+import os
+import sys
+import base64
+
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util.utils import encode_som_image, _merge_seam_text  # noqa: E402
+
+
+FRAME = np.zeros((40, 60, 3), dtype=np.uint8)
+
+
+def test_encode_som_image_defaults():
+    data, info = encode_som_image(FRAME)
+    assert info == {'format': 'png', 'width': 60, 'height': 40}
+    assert base64.b64decode(data).startswith(b'\x89PNG')
+
+
+@pytest.mark.parametrize('options', [
+    {'image_format': 'gif'},
+    {'scale': 0},
+    {'scale': 1.5},
+    {'image_format': 'png', 'quality': 10},
+    {'image_format': 'jpeg', 'quality': 0},
+    {'image_format': 'webp', 'quality': 101},
+])
+def test_encode_som_image_rejects_bad_options(options):
+    with pytest.raises(ValueError):
+        encode_som_image(FRAME, **options)
+
+
+def test_merge_seam_text_overlap():
+    assert _merge_seam_text('open the fi', 'he file') == 'open the file'
+
+
+@pytest.mark.parametrize('left, right', [('open', 'new'), ('File', 'Edit'), ('ab', 'b')])
+def test_merge_seam_text_short_overlap_is_two_words(left, right):
+    assert _merge_seam_text(left, right) == left + ' ' + right
@@ -0,0 +1,230 @@
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+# rough memory per caption in a generate() batch, refined on cuda from the measured peak and on oom everywhere.
+# florence2: ~4 GB for 128 crops in fp16 on gpu (the old fixed batch_size comment), twice that in fp32 on cpu
+PER_ITEM_BYTES = {
+    ('florence2', 'cuda'): 32 << 20,
+    ('florence2', 'cpu'): 64 << 20,
+    ('blip2', 'cuda'): 256 << 20,
+    ('blip2', 'cpu'): 512 << 20,
+    ('phi3v', 'cuda'): 512 << 20,
+    ('phi3v', 'cpu'): 1024 << 20,
+}
+DEFAULT_PER_ITEM_BYTES = 128 << 20
+
+
+def available_memory(device) -> Optional[int]:
+    """ free bytes on the device: cuda free memory, or the host's available RAM (psutil if installed, /proc/meminfo otherwise) """
+    if torch.device(device).type == 'cuda':
+        free, _ = torch.cuda.mem_get_info(torch.device(device))
+        return free
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def is_oom(error: BaseException) -> bool:
+    return isinstance(error, MemoryError) or (isinstance(error, RuntimeError) and 'out of memory' in str(error).lower())
+
+
+def model_family(model_name_or_path: str) -> str:
+    name = model_name_or_path.lower()
+    for family in ('florence', 'blip2', 'phi'):
+        if family in name:
+            return {'florence': 'florence2', 'phi': 'phi3v'}.get(family, family)
+    return name
+
+
+class AdaptiveBatcher:
+    """
+    Picks the caption batch size per model from free memory and measured per-batch latency.
+
+    The batch size starts from what fits in `memory_fraction` of the free device memory (capped at
+    `max_size`, or the size remembered for the model) and is doubled while the time per caption keeps
+    dropping by at least `min_gain`; the best size seen is remembered per (model, device, torch threads).
+    An out-of-memory error halves the batch, retries the same crops and caps later batches below the
+    failing size. Every decision is printed with the `[caption batch]` prefix.
+
+    Attributes:
+        min_size (int), max_size (int): bounds of the batch size
+        memory_fraction (float): share of the free memory one batch may use
+        path (Optional[str]): json file the learned settings are saved to and loaded from
+    """
+
+    def __init__(self, min_size: int = 1, max_size: int = 128, memory_fraction: float = 0.5, min_gain: float = 0.05, path: Optional[str] = None):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.memory_fraction = memory_fraction
+        self.min_gain = min_gain
+        self.path = path
+        self._lock = threading.Lock()
+        # concurrent run() calls (parses in a thread pool): the cuda peak memory counter and the device are shared,
+        # a batch only adapts the settings when no other batch ran at any point while it did
+        self._inflight = 0
+        self._started = 0
+        self.state: Dict[str, dict] = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+            print(f'[caption batch] loaded settings for {len(self.state)} model(s) from {path}')
+
+    @staticmethod
+    def model_key(model_name_or_path: str, device) -> str:
+        return f'{model_name_or_path}|{torch.device(device).type}|threads={torch.get_num_threads()}'
+
+    def _model_state(self, key, model_name_or_path, device):
+        state = self.state.get(key)
+        if state is None:
+            device_type = torch.device(device).type
+            state = self.state[key] = {
+                'per_item_bytes': PER_ITEM_BYTES.get((model_family(model_name_or_path), device_type), DEFAULT_PER_ITEM_BYTES),
+                'oom_ceiling': None,  # smallest batch size that ran out of memory
+                'seconds_per_item': {},  # batch size -> best measured time per caption
+                'best': None,  # converged batch size
+            }
+        return state
+
+    def memory_cap(self, state, device) -> int:
+        cap = self.max_size
+        free = available_memory(device)
+        if free is not None:
+            cap = min(cap, int(free * self.memory_fraction // state['per_item_bytes']))
+        if state['oom_ceiling']:
+            # halve below the smallest failing size, the failing size was measured under other memory pressure
+            cap = min(cap, state['oom_ceiling'] // 2)
+        return max(cap, self.min_size)
+
+    def _next_size(self, state, cap):
+        if state['best']:
+            return min(state['best'], cap)
+        measured = {int(k): v for k, v in state['seconds_per_item'].items()}
+        if not measured:
+            # explore upwards from a small batch
+            return min(max(self.min_size, 8), cap)
+        size = max(measured, key=lambda k: (-measured[k], k))  # fastest per caption so far
+        larger = size * 2
+        if larger <= cap and (larger not in measured):
+            return larger
+        return size
+
+    def _record(self, state, key, size, seconds, cap):
+        per_item = seconds / size
+        measured = state['seconds_per_item']
+        previous = measured.get(str(size))
+        measured[str(size)] = per_item if previous is None else min(previous, per_item)
+        if state['best'] is None and size * 2 > cap and self._next_size(state, cap) == size:
+            state['best'] = size
+            print(f'[caption batch] {key}: batch {size * 2} exceeds the memory cap {cap}, settling on {size}')
+            self.save()
+        elif state['best'] is None and str(size // 2) in measured:
+            if measured[str(size)] > measured[str(size // 2)] * (1 - self.min_gain):
+                state['best'] = size // 2
+                print(f'[caption batch] {key}: batch {size} is not faster than {size // 2} '
+                      f'({measured[str(size)] * 1e3:.1f} vs {measured[str(size // 2)] * 1e3:.1f} ms/caption), settling on {size // 2}')
+                self.save()
+
+    def _on_oom(self, state, key, size, device, error):
+        state['oom_ceiling'] = size if not state['oom_ceiling'] else min(state['oom_ceiling'], size)
+        state['per_item_bytes'] = max(state['per_item_bytes'], int((available_memory(device) or 0) * self.memory_fraction // max(size, 1)))
+        if state['best'] and state['best'] >= size:
+            state['best'] = None
+        if torch.device(device).type == 'cuda':
+            torch.cuda.empty_cache()
+        print(f'[caption batch] {key}: out of memory at batch {size} ({type(error).__name__}), retrying with {max(size // 2, self.min_size)}')
+        self.save()
+
+    def run(self, model_name_or_path: str, device, items, fn: Callable[[list], List], batch_size: Optional[int] = None, group=None) -> List:
+        """
+        Call fn on consecutive batches of items and concatenate the results.
+        batch_size: fixed batch size (no adaptation except the out-of-memory back-off), None to adapt.
+        group: settings fn depends on besides the model (prompt, generation args), unused here; the MicroBatcher
+            in front of it only merges the items of callers with equal groups
+        """
+        key = self.model_key(model_name_or_path, device)
+        with self._lock:
+            state = self._model_state(key, model_name_or_path, device)
+            cap = self.memory_cap(state, device)
+        results = []
+        i, n = 0, len(items)
+        while i < n:
+            with self._lock:
+                planned = size = min(batch_size, cap) if batch_size else self._next_size(state, cap)
+                exploring = batch_size is None and state['best'] is None
+            remaining = n - i
+            if remaining <= size:
+                size = remaining
+            elif not exploring:
+                # same number of batches, evenly filled: 130 crops at 128 run as 65 + 65 instead of 128 + 2
+                size = math.ceil(remaining / math.ceil(remaining / size))
+            with self._lock:
+                self._inflight += 1
+                self._started += 1
+                ticket, alone = self._started, self._inflight == 1
+                if torch.device(device).type == 'cuda':
+                    torch.cuda.reset_peak_memory_stats(device)
+                    baseline = torch.cuda.memory_allocated(device)
+            start = time.perf_counter()
+            try:
+                batch_results = fn(items[i:i + size])
+            except Exception as e:
+                if not is_oom(e) or size <= self.min_size:
+                    raise
+                with self._lock:
+                    self._on_oom(state, key, size, device, e)
+                    cap = self.memory_cap(state, device)
+                continue
+            finally:
+                with self._lock:
+                    self._inflight -= 1
+                    # another batch started during this one (or was running): its peak / latency are not this batch's
+                    exclusive = alone and self._started == ticket
+                    # read before the next batch can start and reset the counter
+                    peak = torch.cuda.max_memory_allocated(device) - baseline if exclusive and torch.device(device).type == 'cuda' else None
+            seconds = time.perf_counter() - start
+            results.extend(batch_results)
+            i += size
+            with self._lock:
+                if peak is not None:
+                    state['per_item_bytes'] = max(int(peak / size), 1)
+                if exclusive and exploring and size == planned:
+                    self._record(state, key, size, seconds, cap)
+                print(f'[caption batch] {key}: {size} captions in {seconds:.2f}s ({seconds / size * 1e3:.1f} ms/caption, cap {cap}{"" if exclusive else ", concurrent, not measured"})')
+        return results
+
+    def best(self, model_name_or_path: str, device) -> Optional[int]:
+        state = self.state.get(self.model_key(model_name_or_path, device))
+        return state['best'] if state else None
+
+    def save(self):
+        if not self.path:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+
+    def stats(self):
+        with self._lock:
+            return {key: {'best': s['best'], 'oom_ceiling': s['oom_ceiling'], 'per_item_mb': s['per_item_bytes'] / (1 << 20),
+                          'ms_per_caption': {k: v * 1e3 for k, v in sorted(s['seconds_per_item'].items(), key=lambda kv: int(kv[0]))}}
+                    for key, s in self.state.items()}
@@ -6,6 +6,8 @@ import numpy as np
 from supervision.detection.core import Detections
 from supervision.draw.color import Color, ColorPalette
 
+from util.spatial_index import GridIndex
+
 
 class BoxAnnotator:
     """
@@ -85,6 +87,8 @@ class BoxAnnotator:
             ```
         """
         font = cv2.FONT_HERSHEY_SIMPLEX
+        # label placement only needs the boxes a candidate label position can overlap
+        box_index = GridIndex(detections.xyxy.astype(int)) if self.avoid_overlap else None
         for i in range(len(detections)):
             x1, y1, x2, y2 = detections.xyxy[i].astype(int)
             class_id = (
@@ -135,7 +139,7 @@ class BoxAnnotator:
                 # text_background_x2 = x1
                 # text_background_y2 = y1 + 2 * self.text_padding + text_height
             else:
-                text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2 = get_optimal_label_pos(self.text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size)
+                text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2 = get_optimal_label_pos(self.text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size, box_index)
 
             cv2.rectangle(
                 img=scene,
@@ -186,15 +190,21 @@ def IoU(box1, box2, return_max=True):
         return intersection / union
 
 
-def get_optimal_label_pos(text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size):
+def get_optimal_label_pos(text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size, box_index=None):
     """ check overlap of text and background detection box, and get_optimal_label_pos, 
         pos: str, position of the text, must be one of 'top left', 'top right', 'outer left', 'outer right' TODO: if all are overlapping, return the last one, i.e. outer right
         Threshold: default to 0.3
+        box_index: optional GridIndex over detections.xyxy.astype(int), limits the overlap check to intersecting boxes
     """
 
     def get_is_overlap(detections, text_background_x1, text_background_y1, text_background_x2, text_background_y2, image_size):
         is_overlap = False
-        for i in range(len(detections)):
+        if box_index is not None:
+            # IoU > 0 needs a positive intersection, so the other boxes cannot change the result
+            candidates = box_index.query([text_background_x1, text_background_y1, text_background_x2, text_background_y2])
+        else:
+            candidates = range(len(detections))
+        for i in candidates:
             detection = detections.xyxy[i].astype(int)
             if IoU([text_background_x1, text_background_y1, text_background_x2, text_background_y2], detection) > 0.3:
                 is_overlap = True
@@ -0,0 +1,251 @@
+'''
+CPU caption backends for Florence-2, selected with caption_model_name in get_caption_model_processor:
+
+    florence2_int8  the torch model with dynamically quantized (int8) nn.Linear layers
+    florence2_onnx  ONNX Runtime graphs: vision + text encoder, decoder, decoder with KV cache
+
+Both return an object get_parsed_content_icon drives like the torch model (config, device, generate), so the
+caption cache, batching and preprocessing paths are shared. The onnx graphs are exported once:
+
+    python -m util.caption_backends --model_path weights/icon_caption_florence --output_dir weights/icon_caption_florence_onnx
+
+and loaded with --caption_model_name florence2_onnx --caption_model_path weights/icon_caption_florence_onnx.
+benchmarks/bench_caption_backends.py reports captions/sec and agreement with the fp32 model.
+'''
+
+import argparse
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+ONNX_CONFIG = 'onnx_config.json'
+ENCODER, DECODER, DECODER_WITH_PAST = 'encoder.onnx', 'decoder.onnx', 'decoder_with_past.onnx'
+KV_NAMES = ('decoder.key', 'decoder.value', 'encoder.key', 'encoder.value')
+
+
+def load_florence2_int8(model_name_or_path):
+    """ fp32 Florence-2 with every nn.Linear dynamically quantized to int8 (cpu only) """
+    from transformers import AutoModelForCausalLM
+    from util.model_cache import pretrained_kwargs
+    model = AutoModelForCausalLM.from_pretrained(model_name_or_path, trust_remote_code=True, **pretrained_kwargs(model_name_or_path, 'cpu', torch.float32)).eval()
+    start = time.time()
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    # separate caption cache namespace / batch size key from the fp32 model
+    model.config.name_or_path = f'{model.config.name_or_path}:int8'
+    print(f'florence2 linear layers quantized to int8 in {time.time()-start:.2f}s')
+    return model
+
+
+class _Encoder(torch.nn.Module):
+    """ pixel_values + prompt ids -> encoder hidden states, the same steps as Florence2ForConditionalGeneration.generate """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values, input_ids):
+        inputs_embeds = self.model.get_input_embeddings()(input_ids)
+        image_features = self.model._encode_image(pixel_values)
+        inputs_embeds, _ = self.model._merge_input_ids_with_image_features(image_features, inputs_embeds)
+        return self.model.language_model.get_encoder()(inputs_embeds=inputs_embeds, return_dict=True).last_hidden_state
+
+
+class _Decoder(torch.nn.Module):
+    """ one decoder step; past / present key values are flattened per layer as KV_NAMES """
+
+    def __init__(self, language_model, num_layers):
+        super().__init__()
+        self.language_model = language_model
+        self.num_layers = num_layers
+
+    def forward(self, input_ids, encoder_hidden_states, *past):
+        past_key_values = tuple(tuple(past[4 * i:4 * i + 4]) for i in range(self.num_layers)) if past else None
+        out = self.language_model(encoder_outputs=(encoder_hidden_states,), decoder_input_ids=input_ids,
+                                  past_key_values=past_key_values, use_cache=True, return_dict=True)
+        presents = out.past_key_values
+        if hasattr(presents, 'to_legacy_cache'):
+            presents = presents.to_legacy_cache()
+        return (out.logits, *[t for layer in presents for t in layer])
+
+
+def export_florence2_onnx(model_path, output_dir, processor_path='microsoft/Florence-2-base', opset=17, quantize=False):
+    from transformers import AutoModelForCausalLM, AutoProcessor
+    from PIL import Image
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32, trust_remote_code=True).eval()
+    processor = AutoProcessor.from_pretrained(processor_path, trust_remote_code=True)
+    language_model = model.language_model
+    num_layers = language_model.config.decoder_layers
+    os.makedirs(output_dir, exist_ok=True)
+
+    inputs = processor(images=[Image.new('RGB', (64, 64))] * 2, text=['<CAPTION>'] * 2, return_tensors='pt')
+    past_names = [f'past_key_values.{i}.{n}' for i in range(num_layers) for n in KV_NAMES]
+    present_names = [f'present.{i}.{n}' for i in range(num_layers) for n in KV_NAMES]
+
+    def kv_axes(name):
+        return {0: 'batch', 2: 'encoder_length' if '.encoder.' in name else ('past_length' if name.startswith('past') else 'total_length')}
+
+    start = time.time()
+    with torch.no_grad():
+        encoder = _Encoder(model)
+        torch.onnx.export(encoder, (inputs['pixel_values'], inputs['input_ids']), os.path.join(output_dir, ENCODER), opset_version=opset,
+                          input_names=['pixel_values', 'input_ids'], output_names=['encoder_hidden_states'],
+                          dynamic_axes={'pixel_values': {0: 'batch'}, 'input_ids': {0: 'batch', 1: 'prompt_length'}, 'encoder_hidden_states': {0: 'batch', 1: 'encoder_length'}})
+        encoder_hidden_states = encoder(inputs['pixel_values'], inputs['input_ids'])
+
+        decoder = _Decoder(language_model, num_layers)
+        start_ids = torch.full((2, 1), language_model.config.decoder_start_token_id, dtype=torch.long)
+        common_axes = {'input_ids': {0: 'batch', 1: 'decoder_length'}, 'encoder_hidden_states': {0: 'batch', 1: 'encoder_length'}, 'logits': {0: 'batch', 1: 'decoder_length'}}
+        torch.onnx.export(decoder, (start_ids, encoder_hidden_states), os.path.join(output_dir, DECODER), opset_version=opset,
+                          input_names=['input_ids', 'encoder_hidden_states'], output_names=['logits', *present_names],
+                          dynamic_axes={**common_axes, **{n: kv_axes(n) for n in present_names}})
+        first = decoder(start_ids, encoder_hidden_states)
+        next_ids = first[0][:, -1:].argmax(-1)
+        torch.onnx.export(decoder, (next_ids, encoder_hidden_states, *first[1:]), os.path.join(output_dir, DECODER_WITH_PAST), opset_version=opset,
+                          input_names=['input_ids', 'encoder_hidden_states', *past_names], output_names=['logits', *present_names],
+                          dynamic_axes={**common_axes, **{n: kv_axes(n) for n in past_names + present_names}})
+    print(f'florence2 exported to {output_dir} in {time.time()-start:.1f}s')
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        for name in (ENCODER, DECODER, DECODER_WITH_PAST):
+            path = os.path.join(output_dir, name)
+            # into a separate file first: a failure part way leaves the fp32 graph intact
+            quantized_path = path[:-len('.onnx')] + '.int8.onnx'
+            try:
+                quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+            except BaseException:
+                if os.path.exists(quantized_path):
+                    os.remove(quantized_path)
+                raise
+            os.replace(quantized_path, path)
+        print('onnx graphs quantized to int8')
+
+    # greedy search settings generate() applies through the language model's generation config
+    generation_config = language_model.generation_config
+    config = {
+        'name_or_path': model.config.name_or_path,
+        'num_layers': num_layers,
+        'decoder_start_token_id': language_model.config.decoder_start_token_id,
+        'eos_token_id': generation_config.eos_token_id,
+        'pad_token_id': generation_config.pad_token_id,
+        'forced_bos_token_id': generation_config.forced_bos_token_id,
+        'forced_eos_token_id': generation_config.forced_eos_token_id,
+        'no_repeat_ngram_size': generation_config.no_repeat_ngram_size or 0,
+        'quantized': quantize,
+    }
+    with open(os.path.join(output_dir, ONNX_CONFIG), 'w') as f:
+        json.dump(config, f, indent=2)
+    # florence2_onnx loads its processor from the graph directory, no hub access at startup
+    processor.save_pretrained(output_dir)
+    return output_dir
+
+
+def _banned_ngram_tokens(tokens: np.ndarray, n: int):
+    """ NoRepeatNGramLogitsProcessor: per row, the tokens that would repeat an n-gram already generated """
+    cur_len = tokens.shape[1]
+    banned = [[] for _ in range(len(tokens))]
+    if n <= 0 or cur_len + 1 < n:
+        return banned
+    for row, seq in enumerate(tokens.tolist()):
+        prefix = tuple(seq[cur_len - n + 1:])
+        banned[row] = [seq[i + n - 1] for i in range(cur_len - n + 1) if tuple(seq[i:i + n - 1]) == prefix]
+    return banned
+
+
+class Florence2OnnxModel:
+    """
+    Greedy search over the exported encoder / decoder graphs with a KV cache, called like the torch model:
+    generate(input_ids=..., pixel_values=..., max_new_tokens=20, num_beams=1, do_sample=False) -> token ids
+    """
+
+    def __init__(self, model_dir, providers=None, num_threads=None):
+        import onnxruntime as ort
+        with open(os.path.join(model_dir, ONNX_CONFIG)) as f:
+            self.onnx_config = json.load(f)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        providers = providers or ['CPUExecutionProvider']
+        start = time.time()
+        self.encoder = ort.InferenceSession(os.path.join(model_dir, ENCODER), options, providers=providers)
+        self.decoder = ort.InferenceSession(os.path.join(model_dir, DECODER), options, providers=providers)
+        self.decoder_with_past = ort.InferenceSession(os.path.join(model_dir, DECODER_WITH_PAST), options, providers=providers)
+        print(f'florence2 onnx graphs loaded from {model_dir} in {time.time()-start:.2f}s')
+        suffix = ':onnx-int8' if self.onnx_config.get('quantized') else ':onnx'
+        self.config = SimpleNamespace(name_or_path=self.onnx_config['name_or_path'] + suffix, model_type='florence2')
+        self.device = torch.device('cpu')
+        self.num_layers = self.onnx_config['num_layers']
+
+    def to(self, device):
+        if torch.device(device).type != 'cpu':
+            print(f'florence2_onnx runs on onnxruntime providers, ignoring device {device}')
+        return self
+
+    def eval(self):
+        return self
+
+    def _logits_processors(self, logits, tokens, max_length):
+        cfg = self.onnx_config
+        cur_len = tokens.shape[1]
+        for row, banned in enumerate(_banned_ngram_tokens(tokens, cfg['no_repeat_ngram_size'])):
+            logits[row, banned] = -np.inf
+        if cfg['forced_bos_token_id'] is not None and cur_len == 1:
+            logits[:] = -np.inf
+            logits[:, cfg['forced_bos_token_id']] = 0
+        if cfg['forced_eos_token_id'] is not None and cur_len == max_length - 1:
+            logits[:] = -np.inf
+            logits[:, cfg['forced_eos_token_id']] = 0
+        return logits
+
+    def generate(self, input_ids, pixel_values, max_new_tokens=20, num_beams=1, do_sample=False, **kwargs):
+        if num_beams != 1 or do_sample:
+            raise ValueError('florence2_onnx only implements greedy search (num_beams=1, do_sample=False)')
+        cfg = self.onnx_config
+        encoder_hidden_states = self.encoder.run(None, {'pixel_values': pixel_values.detach().cpu().float().numpy(),
+                                                        'input_ids': input_ids.detach().cpu().numpy().astype(np.int64)})[0]
+        batch = len(encoder_hidden_states)
+        eos = cfg['eos_token_id'] if isinstance(cfg['eos_token_id'], int) else cfg['eos_token_id'][0]
+        tokens = np.full((batch, 1), cfg['decoder_start_token_id'], dtype=np.int64)
+        finished = np.zeros(batch, dtype=bool)
+        max_length = 1 + max_new_tokens
+        cross, past = None, None
+        for _ in range(max_new_tokens):
+            feed = {'input_ids': tokens[:, -1:], 'encoder_hidden_states': encoder_hidden_states}
+            if past is None:
+                outputs = self.decoder.run(None, feed)
+                # cross attention keys / values only depend on the encoder output, keep the first step's
+                cross = [outputs[1 + 4 * i + j] for i in range(self.num_layers) for j in (2, 3)]
+            else:
+                for i in range(self.num_layers):
+                    feed[f'past_key_values.{i}.decoder.key'], feed[f'past_key_values.{i}.decoder.value'] = past[2 * i], past[2 * i + 1]
+                    feed[f'past_key_values.{i}.encoder.key'], feed[f'past_key_values.{i}.encoder.value'] = cross[2 * i], cross[2 * i + 1]
+                outputs = self.decoder_with_past.run(None, feed)
+            past = [outputs[1 + 4 * i + j] for i in range(self.num_layers) for j in (0, 1)]
+            logits = self._logits_processors(outputs[0][:, -1, :].astype(np.float32), tokens, max_length)
+            next_tokens = logits.argmax(-1)
+            next_tokens = np.where(finished, cfg['pad_token_id'], next_tokens)
+            tokens = np.concatenate([tokens, next_tokens[:, None]], axis=1)
+            finished |= next_tokens == eos
+            if finished.all():
+                break
+        return torch.from_numpy(tokens)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Export Florence-2 to ONNX for the florence2_onnx caption backend')
+    parser.add_argument('--model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--output_dir', type=str, default='weights/icon_caption_florence_onnx')
+    parser.add_argument('--processor_path', type=str, default='microsoft/Florence-2-base')
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--quantize', action='store_true', help='Also quantize the exported graphs to int8 (onnxruntime dynamic quantization)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    export_florence2_onnx(args.model_path, args.output_dir, processor_path=args.processor_path, opset=args.opset, quantize=args.quantize)
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+
+class CaptionCache:
+    """
+    Icon caption cache keyed by a content hash of the resized icon crop.
+
+    Lookups go to an in-memory LRU first and then, if `path` is set, to a sqlite file that
+    survives process restarts. Keys include a namespace (caption model + prompt) so captions
+    from different models never mix.
+
+    Attributes:
+        max_size (int): number of captions kept in the in-memory LRU tier
+        path (Optional[str]): sqlite file for the on-disk tier, None for memory only
+    """
+
+    def __init__(self, max_size: int = 4096, path: Optional[str] = None):
+        self.max_size = max_size
+        self.path = path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS captions (key TEXT PRIMARY KEY, caption TEXT)')
+            self._db.commit()
+
+    @staticmethod
+    def key(crop: np.ndarray, namespace: str = '') -> str:
+        digest = hashlib.blake2b(namespace.encode('utf-8'), digest_size=16)
+        digest.update(str(crop.shape).encode('ascii'))
+        digest.update(np.ascontiguousarray(crop).tobytes())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            caption = self._memory.get(key)
+            if caption is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return caption
+            if self._db is not None:
+                row = self._db.execute('SELECT caption FROM captions WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put_many(self, items):
+        """ items: iterable of (key, caption) """
+        items = list(items)
+        with self._lock:
+            for key, caption in items:
+                self._remember(key, caption)
+            if self._db is not None and items:
+                self._db.executemany('INSERT OR REPLACE INTO captions (key, caption) VALUES (?, ?)', items)
+                self._db.commit()
+
+    def put(self, key: str, caption: str):
+        self.put_many([(key, caption)])
+
+    def _remember(self, key, caption):
+        self._memory[key] = caption
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'memory_size': len(self._memory),
+            }
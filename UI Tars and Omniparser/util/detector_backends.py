@@ -0,0 +1,218 @@
+'''
+Icon detector backends: the ultralytics torch model or a graph exported from it (ONNX Runtime, OpenVINO).
+
+    detector = get_detector('weights/icon_detect/model.pt', backend='onnx')  # loads weights/icon_detect/model.onnx
+    xyxy, conf = detector.detect(image, conf=0.05, iou=0.1)
+
+Exported graphs are post-processed like ultralytics' predictor (letterbox, confidence filter, NMS, rescale)
+so every backend returns the same pixel xyxy / conf tensors as `model.predict(...)[0].boxes`.
+
+One-shot export (writes next to the .pt file):
+    python -m util.detector_backends --model_path weights/icon_detect/model.pt --formats onnx openvino
+
+The runtimes are optional and only imported by their backend: pip install onnxruntime / openvino.
+benchmarks/check_detector_parity.py compares the exported backends with the torch one.
+'''
+
+import argparse
+import ast
+import os
+import time
+from typing import Tuple
+
+import cv2
+import numpy as np
+import torch
+import torchvision
+
+# ultralytics predictor defaults
+MAX_DET = 300
+MAX_NMS = 30000
+PAD_VALUE = 114
+
+
+def _imgsz(imgsz) -> Tuple[int, int]:
+    if isinstance(imgsz, str):
+        imgsz = ast.literal_eval(imgsz)
+    if isinstance(imgsz, int):
+        return imgsz, imgsz
+    return int(imgsz[0]), int(imgsz[1])
+
+
+def letterbox(image: np.ndarray, new_shape, stride=32, auto=False):
+    """ ultralytics LetterBox: aspect preserving resize + centred gray padding, auto pads only to a stride multiple.
+    Returns (padded HWC image, gain, (left, top) padding) """
+    h, w = image.shape[:2]
+    r = min(new_shape[0] / h, new_shape[1] / w)
+    new_unpad = int(round(w * r)), int(round(h * r))
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]
+    if auto:
+        dw, dh = np.mod(dw, stride), np.mod(dh, stride)
+    dw /= 2
+    dh /= 2
+    if (w, h) != new_unpad:
+        image = cv2.resize(image, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(PAD_VALUE,) * 3)
+    return image, r, (left, top)
+
+
+def postprocess(prediction: np.ndarray, conf: float, iou: float, gain: float, pad, orig_shape):
+    """ raw (1, 4 + nc, N) yolov8 output -> (xyxy, conf) tensors in original image pixels, as ultralytics' predictor """
+    pred = torch.from_numpy(np.ascontiguousarray(prediction[0])).float().T  # (N, 4 + nc)
+    scores, cls = pred[:, 4:].max(1)
+    keep = scores > conf
+    pred, scores, cls = pred[keep], scores[keep], cls[keep]
+    if len(pred) > MAX_NMS:
+        order = scores.argsort(descending=True)[:MAX_NMS]
+        pred, scores, cls = pred[order], scores[order], cls[order]
+    boxes = torchvision.ops.box_convert(pred[:, :4], in_fmt='cxcywh', out_fmt='xyxy')
+    # class aware nms, same offset trick as ultralytics
+    keep = torchvision.ops.nms(boxes + cls[:, None].float() * 7680, scores, iou)[:MAX_DET]
+    boxes, scores = boxes[keep], scores[keep]
+    boxes[:, [0, 2]] -= pad[0]
+    boxes[:, [1, 3]] -= pad[1]
+    boxes /= gain
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clamp(0, orig_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clamp(0, orig_shape[0])
+    return boxes, scores
+
+
+class TorchDetector:
+    """ ultralytics YOLO on torch, the reference backend """
+    name = 'torch'
+
+    def __init__(self, model_path):
+        from ultralytics import YOLO
+        self.model = YOLO(model_path)
+        self.model_path = model_path
+
+    def detect(self, image, conf, iou, imgsz=None):
+        kwargs = {'imgsz': imgsz} if imgsz else {}
+        result = self.model.predict(source=image, conf=conf, iou=iou, **kwargs)
+        return result[0].boxes.xyxy, result[0].boxes.conf
+
+    def __getattr__(self, name):
+        # behave like the YOLO object for code that still uses it directly (.predict, .to, ...)
+        if name == 'model':
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+
+class _ExportedDetector:
+    """ shared letterbox / post-processing of exported graphs; subclasses set self.imgsz, self.stride, self.dynamic and implement _run """
+    name = None
+
+    def _run(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def detect(self, image, conf, iou, imgsz=None):
+        image = np.asarray(image.convert('RGB') if hasattr(image, 'convert') else image)
+        # a static graph only takes its export size
+        new_shape = _imgsz(imgsz) if imgsz and self.dynamic else self.imgsz
+        padded, gain, pad = letterbox(image, new_shape, stride=self.stride, auto=self.dynamic)
+        batch = np.ascontiguousarray(padded.transpose(2, 0, 1)[None], dtype=np.float32) / 255
+        return postprocess(self._run(batch), conf, iou, gain, pad, image.shape[:2])
+
+
+class OnnxDetector(_ExportedDetector):
+    name = 'onnx'
+
+    def __init__(self, model_path, providers=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=providers or ort.get_available_providers())
+        self.model_path = model_path
+        self.input_name = self.session.get_inputs()[0].name
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.imgsz = _imgsz(metadata.get('imgsz', '640'))
+        self.stride = int(metadata.get('stride', 32))
+        self.dynamic = any(not isinstance(d, int) for d in self.session.get_inputs()[0].shape[2:])
+
+    def _run(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVINODetector(_ExportedDetector):
+    name = 'openvino'
+
+    def __init__(self, model_path, device='CPU'):
+        import openvino as ov
+        import yaml
+        xml = model_path if model_path.endswith('.xml') else os.path.join(model_path, os.path.basename(model_path.rstrip('/\\')).replace('_openvino_model', '') + '.xml')
+        core = ov.Core()
+        model = core.read_model(xml)
+        self.model_path = xml
+        self.compiled = core.compile_model(model, device, config={'PERFORMANCE_HINT': 'LATENCY'})
+        metadata_path = os.path.join(os.path.dirname(xml), 'metadata.yaml')
+        metadata = {}
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                metadata = yaml.safe_load(f)
+        self.imgsz = _imgsz(metadata.get('imgsz', 640))
+        self.stride = int(metadata.get('stride', 32))
+        self.dynamic = model.inputs[0].get_partial_shape().is_dynamic
+
+    def _run(self, batch):
+        return self.compiled(batch)[0]
+
+
+DETECTOR_BACKENDS = {
+    'torch': TorchDetector,
+    'onnx': OnnxDetector,
+    'openvino': OpenVINODetector,
+}
+
+
+def exported_path(model_path, backend):
+    """ where `export` writes the graph for a .pt checkpoint: model.onnx / model_openvino_model/ next to it """
+    stem, ext = os.path.splitext(model_path)
+    if backend == 'onnx' and ext == '.pt':
+        return stem + '.onnx'
+    if backend == 'openvino' and ext == '.pt':
+        return stem + '_openvino_model'
+    return model_path
+
+
+def get_detector(model_path, backend='torch'):
+    """ model_path: the .pt checkpoint (exported graphs are looked up next to it) or the exported graph itself """
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector backend {backend!r}, expected one of {list(DETECTOR_BACKENDS)}")
+    path = exported_path(model_path, backend)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found, export it first: python -m util.detector_backends --model_path {model_path} --formats {backend}")
+    start = time.time()
+    detector = DETECTOR_BACKENDS[backend](path)
+    print(f'{backend} icon detector loaded from {path} in {time.time()-start:.2f}s')
+    return detector
+
+
+def export(model_path, formats=('onnx',), imgsz=None, dynamic=True, half=False):
+    """ Export the ultralytics checkpoint once per format; dynamic graphs take the same rectangular
+    letterbox as the torch predictor, which keeps the boxes closest to it """
+    from ultralytics import YOLO
+    paths = {}
+    for fmt in formats:
+        model = YOLO(model_path)
+        kwargs = {'imgsz': imgsz} if imgsz else {}
+        start = time.time()
+        paths[fmt] = model.export(format=fmt, dynamic=dynamic, half=half, **kwargs)
+        print(f'exported {model_path} to {paths[fmt]} in {time.time()-start:.1f}s')
+    return paths
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Export the icon detector for the onnx / openvino backends')
+    parser.add_argument('--model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--formats', type=str, nargs='+', default=['onnx'], choices=['onnx', 'openvino'])
+    parser.add_argument('--imgsz', type=int, default=None, help='Export size, defaults to the checkpoint training size')
+    parser.add_argument('--static', dest='dynamic', action='store_false', help='Fixed input shape (square letterbox)')
+    parser.add_argument('--half', action='store_true', help='fp16 weights (openvino)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    export(args.model_path, formats=args.formats, imgsz=args.imgsz, dynamic=args.dynamic, half=args.half)
@@ -0,0 +1,93 @@
+import base64
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+
+class Frame:
+    """
+    One decoded screenshot, shared by every stage of a parse.
+
+    The image is decoded once into a C-contiguous HWC uint8 RGB buffer. `array` hands out read-only views of it to
+    ocr, icon detection and cropping (annotation copies the frame it draws on); other representations are made on
+    first use and kept: `bgr` for the ultralytics predictor, which reads numpy frames as BGR, and `pil`.
+
+        frame = Frame.from_base64(image_base64)
+        frame.size  # (w, h) like PIL
+        frame.array  # (h, w, 3) read-only
+    """
+
+    def __init__(self, pixels: np.ndarray):
+        # slices of another frame (incremental regions) get their own contiguous buffer
+        pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+        if pixels.ndim != 3 or pixels.shape[2] != 3:
+            raise ValueError(f'Frame expects HWC RGB pixels, got shape {pixels.shape}')
+        self._pixels = pixels
+        self._bgr = None
+        self._pil = None
+        # the ocr and yolo threads may ask for the same conversion at once
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_pil(cls, image: Image.Image):
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return cls(np.asarray(image))
+
+    @classmethod
+    def from_base64(cls, image_base64: str):
+        return cls.from_pil(Image.open(io.BytesIO(base64.b64decode(image_base64))))
+
+    @property
+    def width(self) -> int:
+        return self._pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self._pixels.shape[0]
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def shape(self):
+        return self._pixels.shape
+
+    @property
+    def array(self) -> np.ndarray:
+        view = self._pixels.view()
+        view.flags.writeable = False
+        return view
+
+    @property
+    def bgr(self) -> np.ndarray:
+        with self._lock:
+            if self._bgr is None:
+                self._bgr = np.ascontiguousarray(self._pixels[..., ::-1])
+                self._bgr.flags.writeable = False
+            return self._bgr
+
+    @property
+    def pil(self) -> Image.Image:
+        with self._lock:
+            if self._pil is None:
+                self._pil = Image.fromarray(self._pixels)
+            return self._pil
+
+    def crop(self, x0, y0, x1, y1):
+        """ pixel box of the frame as a new Frame """
+        return Frame(self._pixels[y0:y1, x0:x1])
+
+
+def as_frame(image_source) -> Frame:
+    """ Frame of an image path, PIL image, HWC RGB array or Frame (returned as is) """
+    if isinstance(image_source, Frame):
+        return image_source
+    if isinstance(image_source, str):
+        image_source = Image.open(image_source)
+    if isinstance(image_source, Image.Image):
+        return Frame.from_pil(image_source)
+    return Frame(np.asarray(image_source))
@@ -0,0 +1,80 @@
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from util.spatial_index import expand_rect, rects_touch, rect_contains, rect_union, merge_rects
+
+# parsed_content_list order produced by get_som_labeled_img: ocr text, icons labelled by ocr, captioned icons
+SOURCE_ORDER = {'box_ocr_content_ocr': 0, 'box_yolo_content_ocr': 1, 'box_yolo_content_yolo': 2}
+
+
+def _merge_pairs(groups):
+    """ (dirty, parse) rects with overlapping parse rects merged: the parse rects by merge_rects, the dirty rects of
+    each merged parse rect into their bounding rect """
+    parse_rects = merge_rects([parse for _, parse in groups])
+    return [(rect_union([d for d, p in groups if rect_contains(parse, p)]), parse) for parse in parse_rects]
+
+
+def find_dirty_rects(previous: np.ndarray, current: np.ndarray, block=16, pixel_threshold=8, margin=32) -> List[Tuple[tuple, tuple]]:
+    """
+    Changed regions between two HWC frames of the same size.
+
+    Pixels whose max channel difference exceeds pixel_threshold are marked, pooled into block x block
+    cells, and grouped into connected components. Each component is grown by `margin` px so the
+    re-parse sees some context; components whose grown rects overlap are merged.
+
+    Returns:
+        [(dirty_rect, parse_rect)]: pixel xyxy, dirty_rect is the changed area, parse_rect the area to re-parse
+    """
+    h, w = current.shape[:2]
+    changed = cv2.absdiff(previous, current)
+    if changed.ndim == 3:
+        # np.maximum over the channels is >10x faster than .max(axis=2) on an interleaved frame
+        changed = np.maximum(np.maximum(changed[..., 0], changed[..., 1]), changed[..., 2])
+    changed = changed > pixel_threshold
+    if not changed.any():
+        return []
+    hb, wb = -(-h // block), -(-w // block)
+    padded = np.zeros((hb * block, wb * block), dtype=bool)
+    padded[:h, :w] = changed
+    cells = padded.reshape(hb, block, wb, block).any(axis=(1, 3)).astype(np.uint8)
+    n, _, stats, _ = cv2.connectedComponentsWithStats(cells, connectivity=8)
+
+    groups = []
+    for x, y, bw, bh, _ in stats[1:n].tolist():
+        dirty = (x * block, y * block, min((x + bw) * block, w), min((y + bh) * block, h))
+        groups.append((dirty, expand_rect(dirty, margin, w, h)))
+    # merge until no two parse rects overlap
+    return _merge_pairs(groups)
+
+
+def widen_rects(rects, previous_elements, w, h):
+    """
+    (dirty, parse) rects of find_dirty_rects with each parse rect grown to take in the whole of the previous elements
+    touching its dirty rect, the ones merge_elements replaces, so their re-parse is not clipped to the region.
+    Parse rects that overlap after growing are merged.
+    """
+    boxes = [(int(np.floor(x0 * w)), int(np.floor(y0 * h)), int(np.ceil(x1 * w)), int(np.ceil(y1 * h))) for x0, y0, x1, y1 in (e['bbox'] for e in previous_elements)]
+    groups = []
+    for dirty, parse in rects:
+        x0, y0, x1, y1 = rect_union([parse] + [b for b in boxes if rects_touch(b, dirty)])
+        groups.append((dirty, (max(x0, 0), max(y0, 0), min(x1, w), min(y1, h))))
+    return _merge_pairs(groups)
+
+
+def changed_ratio(rects, w, h):
+    """ fraction of the frame covered by the (non overlapping) parse rects """
+    return sum((r[2] - r[0]) * (r[3] - r[1]) for _, r in rects) / float(w * h)
+
+
+def merge_elements(previous_elements, region_elements, rects, w, h):
+    """
+    Previous elements away from every dirty rect are kept, the ones touching a dirty rect are replaced by
+    region_elements (normalized to the full frame) that touch it. The result keeps the
+    parsed_content_list grouping (text, ocr labelled icons, captioned icons), previous elements first.
+    """
+    dirty = [tuple(np.array(d, dtype=np.float64) / [w, h, w, h]) for d, _ in rects]
+    kept = [e for e in previous_elements if not any(rects_touch(e['bbox'], d) for d in dirty)]
+    new = [e for e in region_elements if any(rects_touch(e['bbox'], d) for d in dirty)]
+    return sorted(kept + new, key=lambda e: SOURCE_ORDER.get(e.get('source'), len(SOURCE_ORDER)))
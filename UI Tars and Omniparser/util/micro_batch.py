@@ -0,0 +1,184 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+import numpy as np
+import torch
+
+
+class _Request:
+    __slots__ = ('key', 'items', 'fn', 'batch_size', 'enqueued', 'done', 'results', 'error')
+
+    def __init__(self, key, items, fn, batch_size):
+        self.key = key
+        self.items = items
+        self.fn = fn
+        self.batch_size = batch_size
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+def _concat(chunks):
+    """ one batch from the items of several requests: caption crops are uint8 tensors (tensor preprocess) or lists """
+    if all(isinstance(c, torch.Tensor) for c in chunks):
+        return torch.cat(list(chunks))
+    return [item for c in chunks for item in c]
+
+
+def _bucket(n):
+    """ power of two histogram bucket: 1, 2, 4, 8, ... """
+    return 1 << max(int(n) - 1, 0).bit_length()
+
+
+class MicroBatcher:
+    """
+    Merges the work of concurrent parse requests into shared model calls.
+
+    Requests call run() from their own thread (the server runs /parse/ in its thread pool when micro-batching is on)
+    and block until their results are back. A single worker thread takes the first queued request, keeps collecting
+    for `window` seconds after it arrived or until `max_items` items are queued, then runs the requests of the same
+    model, device and group together: their items are concatenated, passed to the first request's fn (through
+    `inner`, e.g. the AdaptiveBatcher, when given) and the results are split back per request. Requests of different
+    groups (another prompt / generation settings / detector threshold) never share a call.
+
+    run() has the signature of AdaptiveBatcher.run, so it can stand in for the caption batcher.
+
+    Attributes:
+        window (float): seconds the worker waits for more requests after the first one
+        max_items (int): items that end the collection early
+        inner (Optional[AdaptiveBatcher]): runs each merged call, None calls fn on all merged items at once
+    """
+
+    def __init__(self, name: str, window: float = 0.01, max_items: int = 256, inner=None, stats_window: int = 2048):
+        self.name = name
+        self.window = window
+        self.max_items = max_items
+        self.inner = inner
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._depth = 0
+        self._max_depth = 0
+        self._calls = 0
+        self._items_hist = {}
+        self._requests_hist = {}
+        self._waits = deque(maxlen=stats_window)
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            # a worker killed by a BaseException (see _run_group) is replaced by the next caller
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, name=f'micro_batch_{self.name}', daemon=True)
+                self._worker.start()
+
+    def run(self, model_name_or_path: str, device, items, fn: Callable[[list], List], batch_size: Optional[int] = None, group=None) -> List:
+        if len(items) == 0:
+            return []
+        self._ensure_worker()
+        request = _Request((model_name_or_path, str(device), group), items, fn, batch_size)
+        with self._stats_lock:
+            self._depth += 1
+            self._max_depth = max(self._max_depth, self._depth)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _collect(self):
+        pending = [self._queue.get()]
+        count = len(pending[0].items)
+        deadline = pending[0].enqueued + self.window
+        while count < self.max_items:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append(request)
+            count += len(request.items)
+        # anything that arrived meanwhile joins too, it would only wait for the next window otherwise
+        while count < self.max_items:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.append(request)
+            count += len(request.items)
+        return pending
+
+    def _loop(self):
+        while True:
+            pending = self._collect()
+            groups = {}
+            for request in pending:
+                groups.setdefault(request.key, []).append(request)
+            try:
+                for (model_name_or_path, device, _), requests in groups.items():
+                    self._run_group(model_name_or_path, device, requests)
+            finally:
+                # the worker is going down (BaseException): groups it did not get to are released with an error
+                stopped = [request for request in pending if not request.done.is_set()]
+                for request in stopped:
+                    request.error = RuntimeError(f'micro batch worker {self.name} stopped')
+                self._release(stopped)
+
+    def _release(self, requests):
+        """ wake the callers waiting on requests; they leave the queue depth here, whether or not they ran """
+        with self._stats_lock:
+            self._depth -= len(requests)
+        for r in requests:
+            r.done.set()
+
+    def _run_group(self, model_name_or_path, device, requests):
+        start = time.perf_counter()
+        n_items = sum(len(r.items) for r in requests)
+        with self._stats_lock:
+            self._calls += 1
+            self._items_hist[_bucket(n_items)] = self._items_hist.get(_bucket(n_items), 0) + 1
+            self._requests_hist[len(requests)] = self._requests_hist.get(len(requests), 0) + 1
+            self._waits.extend(start - r.enqueued for r in requests)
+        try:
+            items = _concat([r.items for r in requests])
+            if self.inner is not None:
+                results = self.inner.run(model_name_or_path, device, items, requests[0].fn, batch_size=requests[0].batch_size)
+            else:
+                results = requests[0].fn(items)
+            offset = 0
+            for r in requests:
+                r.results = list(results[offset:offset + len(r.items)])
+                offset += len(r.items)
+        except BaseException as e:
+            for r in requests:
+                r.error = e
+            # KeyboardInterrupt / SystemExit end the worker, after the waiting callers got the error
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            # always release the callers, an unset event would block them in run() forever
+            self._release(requests)
+        if len(requests) > 1:
+            print(f'[micro batch {self.name}] {len(requests)} requests, {n_items} items in {time.perf_counter() - start:.2f}s')
+
+    def stats(self):
+        with self._stats_lock:
+            waits = np.fromiter(self._waits, dtype=np.float64)
+            return {
+                'window_ms': self.window * 1e3,
+                'max_items': self.max_items,
+                'queue_depth': self._depth,
+                'max_queue_depth': self._max_depth,
+                'calls': self._calls,
+                # merged items per model call, bucketed by powers of two (key = upper bound)
+                'items_per_call': dict(sorted(self._items_hist.items())),
+                'requests_per_call': dict(sorted(self._requests_hist.items())),
+                'wait_ms_p50': float(np.percentile(waits, 50)) * 1e3 if len(waits) else None,
+                'wait_ms_p99': float(np.percentile(waits, 99)) * 1e3 if len(waits) else None,
+            }
@@ -0,0 +1,182 @@
+'''
+Local loading of the caption and icon detection models from safetensors: no hub access at startup, no pickled
+checkpoints, no random weight init that the checkpoint overwrites right after.
+
+One-shot preparation of the weight directories (needs the hub once, for the processor):
+    python -m util.model_cache --caption_model_name florence2 --caption_model_path weights/icon_caption_florence --som_model_path weights/icon_detect/model.pt
+
+  - the caption processor (tokenizer, image processor and Florence-2's remote code) is saved into the caption model
+    directory, get_caption_model_processor then loads it from there rather than from the hub name
+  - caption weights that are pickled (pytorch_model.bin) or whose remote code lives on the hub are saved again as
+    model.safetensors together with the code
+  - the ultralytics detector checkpoint is written as model.safetensors (state dict; class names, the checkpoint's
+    predict overrides such as imgsz and the weight dtype in the metadata) and model_arch.yaml (architecture) next to
+    it; --som_model_path weights/icon_detect/model.safetensors loads those
+
+Caption safetensors files are memory-mapped: from_pretrained(low_cpu_mem_usage=True) builds the model on the meta
+device and takes the mapped tensors as they are (straight onto the gpu with a device_map), so only one copy of the
+weights is made. The detector is small, its state dict is read from the file and copied into the model built from
+the yaml. The Omniparser startup report (Omniparser.startup) shows what the load costs against the first parse.
+'''
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import torch
+
+PROCESSOR_FILES = ('preprocessor_config.json', 'processor_config.json')
+# where the processors came from before they were saved next to the weights
+HUB_PROCESSORS = {
+    'blip2': 'Salesforce/blip2-opt-2.7b',
+    'florence2': 'microsoft/Florence-2-base',
+    'florence2_int8': 'microsoft/Florence-2-base',
+    'florence2_onnx': 'microsoft/Florence-2-base',
+}
+
+
+def has_processor(model_dir) -> bool:
+    return os.path.isdir(model_dir) and any(os.path.isfile(os.path.join(model_dir, f)) for f in PROCESSOR_FILES)
+
+
+def processor_path(model_name, model_name_or_path):
+    """ the caption model directory when a processor was saved into it, else the hub processor of the model """
+    if has_processor(model_name_or_path):
+        return model_name_or_path
+    print(f'no processor saved in {model_name_or_path}, loading {HUB_PROCESSORS[model_name]} (python -m util.model_cache stores it locally)')
+    return HUB_PROCESSORS[model_name]
+
+
+def has_safetensors(model_dir) -> bool:
+    return any(os.path.isfile(os.path.join(model_dir, f)) for f in ('model.safetensors', 'model.safetensors.index.json'))
+
+
+def pretrained_kwargs(model_name_or_path, device, torch_dtype, fast_load=True):
+    """ from_pretrained kwargs of a caption model; fast_load=False is the plain load (random init, then a copy) """
+    kwargs = {'torch_dtype': torch_dtype}
+    if not fast_load:
+        return kwargs
+    kwargs['low_cpu_mem_usage'] = True
+    if os.path.isdir(model_name_or_path) and has_safetensors(model_name_or_path):
+        kwargs['use_safetensors'] = True
+    if torch.device(device).type == 'cuda':
+        kwargs['device_map'] = {'': device}
+    return kwargs
+
+
+def _hub_code(model_dir) -> bool:
+    """ config.json auto_map entries of the form 'repo--module.Class' load their code from the hub """
+    path = os.path.join(model_dir, 'config.json')
+    if not os.path.isfile(path):
+        return False
+    with open(path) as f:
+        auto_map = json.load(f).get('auto_map', {})
+    return any('--' in str(v) for v in auto_map.values())
+
+
+def prepare_caption_model(model_name, model_dir, processor_source=None):
+    """ save the processor, and the weights as safetensors with their code, into model_dir """
+    from transformers import AutoProcessor
+    source = processor_source or (model_dir if has_processor(model_dir) else HUB_PROCESSORS[model_name])
+    if model_name == 'blip2':
+        from transformers import Blip2Processor
+        processor = Blip2Processor.from_pretrained(source)
+    else:
+        processor = AutoProcessor.from_pretrained(source, trust_remote_code=True)
+    processor.save_pretrained(model_dir)
+    print(f'{source} processor saved to {model_dir}')
+    if model_name == 'florence2_onnx':
+        return
+    if has_safetensors(model_dir) and not _hub_code(model_dir):
+        print(f'{model_dir} already holds safetensors weights and their code')
+        return
+    start = time.time()
+    if model_name == 'blip2':
+        from transformers import Blip2ForConditionalGeneration
+        model = Blip2ForConditionalGeneration.from_pretrained(model_dir, torch_dtype=torch.float32)
+    else:
+        from transformers import AutoModelForCausalLM
+        model = AutoModelForCausalLM.from_pretrained(model_dir, torch_dtype=torch.float32, trust_remote_code=True)
+    # remote code models copy their modeling / configuration files along and point auto_map at them
+    model.save_pretrained(model_dir, safe_serialization=True)
+    print(f'{model_dir} weights saved as safetensors in {time.time()-start:.1f}s')
+
+
+def yolo_paths(model_path):
+    # not model.yaml, the hub download of the detector has a file of that name
+    stem = os.path.splitext(model_path)[0]
+    return stem + '.safetensors', stem + '_arch.yaml'
+
+
+def export_yolo_safetensors(model_path):
+    """ the ultralytics checkpoint as a state dict (.safetensors, class names / overrides / dtype in the metadata)
+    + architecture (.yaml) """
+    from ultralytics import YOLO
+    from ultralytics.utils import yaml_save
+    from safetensors.torch import save_file
+    yolo = YOLO(model_path)
+    model = yolo.model
+    weights_path, yaml_path = yolo_paths(model_path)
+    arch = dict(model.yaml)
+    if arch.get('scales') and arch.get('scale'):
+        # ultralytics guesses the scale from the yaml file name (yolov8m.yaml) when loading, keep only the trained one
+        arch['scales'] = {arch['scale']: arch['scales'][arch['scale']]}
+    yaml_save(yaml_path, arch)
+    state = {k: v.detach().contiguous() for k, v in model.state_dict().items()}
+    # a model built from the yaml only has ultralytics' defaults: predict would run at imgsz 640 rather than the
+    # checkpoint's size when the caller passes no imgsz (scale_img=False)
+    overrides = {k: v for k, v in yolo.overrides.items() if k != 'model'}
+    dtype = str(next(model.parameters()).dtype).replace('torch.', '')
+    save_file(state, weights_path, metadata={'names': json.dumps(model.names), 'overrides': json.dumps(overrides, default=str), 'dtype': dtype})
+    print(f'{model_path} written as {weights_path} + {yaml_path}')
+    return weights_path
+
+
+def load_yolo_safetensors(weights_path):
+    """ ultralytics YOLO built from the .yaml next to weights_path, with the safetensors weights copied into it and the
+    checkpoint's overrides restored, so it predicts like the .pt it was exported from """
+    from ultralytics import YOLO
+    from safetensors import safe_open
+    from safetensors.torch import load_file
+    _, yaml_path = yolo_paths(weights_path)
+    logger = logging.getLogger('ultralytics')
+    level = logger.level
+    # quiet the layer table and the 'no model scale passed' warning of the single-scale architecture
+    logger.setLevel(logging.ERROR)
+    try:
+        model = YOLO(yaml_path, task='detect')
+    finally:
+        logger.setLevel(level)
+    model.model.load_state_dict(load_file(weights_path))
+    with safe_open(weights_path, framework='pt') as f:
+        metadata = f.metadata()
+    model.model.names = {int(k): v for k, v in json.loads(metadata['names']).items()}
+    if 'overrides' in metadata:
+        # what YOLO(model.pt) keeps of the checkpoint's train args (imgsz, task, ...), predict reads them
+        model.overrides.update(json.loads(metadata['overrides']))
+        model.model.args = {**model.model.args, **model.overrides}
+    else:
+        print(f'{weights_path} has no checkpoint overrides, predict uses the ultralytics defaults (export it again with python -m util.model_cache)')
+    if 'dtype' in metadata:
+        model.model.to(getattr(torch, metadata['dtype']))
+    model.model.eval()
+    return model
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Store the caption processor and safetensors weights locally for offline loading without pickles')
+    parser.add_argument('--caption_model_name', type=str, default='florence2', choices=list(HUB_PROCESSORS))
+    parser.add_argument('--caption_model_path', type=str, default='weights/icon_caption_florence')
+    parser.add_argument('--processor_path', type=str, default=None, help='Processor to save, defaults to the hub processor of the model')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt', help='Detector checkpoint to convert, empty to skip')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    if args.caption_model_path:
+        prepare_caption_model(args.caption_model_name, args.caption_model_path, processor_source=args.processor_path)
+    if args.som_model_path:
+        export_yolo_safetensors(args.som_model_path)
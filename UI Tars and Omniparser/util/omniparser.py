@@ -1,32 +1,439 @@
-from util.utils import get_som_labeled_img, get_caption_model_processor, get_yolo_model, check_ocr_box
+import time
+# torch / torchvision / cv2 / supervision come in with util.utils, the first item of the startup report
+_import_start = time.perf_counter()
+from util.utils import get_som_labeled_img, get_caption_model_processor, get_yolo_model, check_ocr_box, predict_yolo, render_som_image, encode_som_image, \
+    predict_yolo_batch, fuse_ocr_icons, fill_icon_contents, crop_icons, caption_icons, get_parsed_content_icon_phi3v
+from util.caption_cache import CaptionCache
+from util.adaptive_batch import AdaptiveBatcher
+from util.micro_batch import MicroBatcher
+from util.profiles import resolve_profile, resolve_easyocr_args, caption_model_family
+from util.incremental import find_dirty_rects, widen_rects, changed_ratio, merge_elements
+from util.pyramid import pyramid_scale, downscale, upscale_boxes, refine_regions, replace_text
+from util.timing import ParseTimer, TimingAggregator, format_timings
+from util.frame import Frame
+from util.synthetic import RESOLUTIONS, make_screenshot
 import torch
-from PIL import Image
 import io
 import base64
-from typing import Dict
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+_IMPORT_SECONDS = time.perf_counter() - _import_start
+
+
+def _timed(timer, name, count, fn, *args, **kwargs):
+    # count: optional function of the result giving the element count of the stage
+    with timer.stage(name) as stage:
+        result = fn(*args, **kwargs)
+        if count is not None:
+            stage['count'] = count(result)
+    return result
+
+
+def _ocr_count(result):
+    (text, ocr_bbox), _ = result
+    return len(ocr_bbox)
+
+
+def _yolo_count(result):
+    xyxy, _, _ = result
+    return len(xyxy)
+
+
+def _draw_bbox_config(size):
+    box_overlay_ratio = max(size) / 3200
+    return {
+        'text_scale': 0.8 * box_overlay_ratio,
+        'text_thickness': max(int(2 * box_overlay_ratio), 1),
+        'text_padding': max(int(3 * box_overlay_ratio), 1),
+        'thickness': max(int(3 * box_overlay_ratio), 1),
+    }
+
+
 class Omniparser(object):
     def __init__(self, config: Dict):
+        start = time.perf_counter()
         self.config = config
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-        self.som_model = get_yolo_model(model_path=config['som_model_path'])
-        self.caption_model_processor = get_caption_model_processor(model_name=config['caption_model_name'], model_name_or_path=config['caption_model_path'], device=device)
+        self.som_model = get_yolo_model(model_path=config['som_model_path'], backend=config.get('som_backend', 'torch'))
+        detector_seconds = time.perf_counter() - start
+        # fast_load: memory-mapped safetensors straight into the model, see util.model_cache
+        self.caption_model_processor = get_caption_model_processor(model_name=config['caption_model_name'], model_name_or_path=config['caption_model_path'], device=device, fast_load=config.get('fast_load', True))
+        caption_seconds = time.perf_counter() - start - detector_seconds
+        # caption_cache_size=0 disables the cache, caption_cache_path adds an on-disk tier that survives restarts
+        cache_size = config.get('caption_cache_size', 4096)
+        self.caption_cache = CaptionCache(max_size=cache_size, path=config.get('caption_cache_path')) if cache_size > 0 else None
+        # caption_batch_size=None sizes caption batches from free memory and measured latency, an int fixes it
+        # (the batcher still halves it on out-of-memory); caption_batch_state_path keeps the learned size per model
+        self.caption_batcher = AdaptiveBatcher(max_size=config.get('caption_max_batch_size', 128), path=config.get('caption_batch_state_path'))
+        # concurrent parses (the server runs them in its thread pool when a window is set): caption_batch_window_ms > 0
+        # merges the caption work of requests arriving within the window into shared generate() calls, up to
+        # caption_batch_max_items crops; yolo_batch_window_ms > 0 does the same for the icon detector
+        caption_window = config.get('caption_batch_window_ms') or 0
+        self.caption_micro_batcher = MicroBatcher('caption', caption_window / 1e3, config.get('caption_batch_max_items', 256), inner=self.caption_batcher) if caption_window > 0 else None
+        yolo_window = config.get('yolo_batch_window_ms') or 0
+        self.yolo_micro_batcher = MicroBatcher('yolo', yolo_window / 1e3, config.get('yolo_batch_max_images', 8)) if yolo_window > 0 else None
+        # ultralytics predictors are not thread safe, without the yolo micro batcher concurrent parses take turns
+        self._yolo_lock = threading.Lock()
+        self._sessions_lock = threading.Lock()
+        # ocr and icon detection are independent until the overlap fusion, run them side by side;
+        # threads rather than processes: the torch / cv2 kernels release the GIL and the models stay shared
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='omniparser') if config.get('parallel_detection', True) else None
+        # last_timings / last_som_image are per thread, concurrent parses each read their own
+        self._local = threading.local()
+        # per-stage timings aggregated over the parses of this process
+        self.timing_stats = TimingAggregator()
+        self.batch_timing_stats = TimingAggregator()
+        # warmup parses (see warmup) are aggregated apart, their one-off set-up costs would skew the request stats
+        self.warmup_timing_stats = TimingAggregator()
+        # incremental mode: last frame + elements per session_id, only changed regions are re-parsed
+        self.sessions = OrderedDict()
+        # where the time to the first parse goes (imports, model loading, the first parse per stage) and the warmup
+        # (see warmup) durations, reported by the server as startup metrics
+        self.startup = {'import_seconds': _IMPORT_SECONDS, 'detector_load_seconds': detector_seconds, 'caption_load_seconds': caption_seconds,
+                        'init_seconds': time.perf_counter() - start, 'first_parse_seconds': None, 'first_parse_stages': None,
+                        'time_to_first_parse_seconds': None, 'warmup_seconds': None, 'warmup_parses': {}}
         print('Omniparser initialized!!!')
 
-    def parse(self, image_base64: str):
-        image_bytes = base64.b64decode(image_base64)
-        image = Image.open(io.BytesIO(image_bytes))
-        print('image size:', image.size)
-        
-        box_overlay_ratio = max(image.size) / 3200
-        draw_bbox_config = {
-            'text_scale': 0.8 * box_overlay_ratio,
-            'text_thickness': max(int(2 * box_overlay_ratio), 1),
-            'text_padding': max(int(3 * box_overlay_ratio), 1),
-            'thickness': max(int(3 * box_overlay_ratio), 1),
-        }
-
-        (text, ocr_bbox), _ = check_ocr_box(image, display_img=False, output_bb_format='xyxy', easyocr_args={'text_threshold': 0.8}, use_paddleocr=False)
-        dino_labled_img, label_coordinates, parsed_content_list = get_som_labeled_img(image, self.som_model, BOX_TRESHOLD = self.config['BOX_TRESHOLD'], output_coord_in_ratio=True, ocr_bbox=ocr_bbox,draw_bbox_config=draw_bbox_config, caption_model_processor=self.caption_model_processor, ocr_text=text,use_local_semantics=True, iou_threshold=0.7, scale_img=False, batch_size=128)
-
-        return dino_labled_img, parsed_content_list
\ No newline at end of file
+    def _record_first_parse(self, timings):
+        startup = self.startup
+        startup['first_parse_seconds'] = timings['total']
+        startup['first_parse_stages'] = {name: stage['wall'] for name, stage in timings['stages'].items()}
+        # busy time only, the process may have idled between startup and the first request
+        startup['time_to_first_parse_seconds'] = startup['import_seconds'] + startup['init_seconds'] + timings['total']
+        stages = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in startup['first_parse_stages'].items())
+        print(f"time to first parse {startup['time_to_first_parse_seconds']:.1f}s: imports {startup['import_seconds']:.1f}s, "
+              f"detector load {startup['detector_load_seconds']:.1f}s, caption model load {startup['caption_load_seconds']:.1f}s, "
+              f"first parse {timings['total']:.1f}s ({stages})")
+
+    def warmup(self, resolutions=('1080p',)) -> Dict:
+        """
+        Parse a synthetic screenshot (util.synthetic) at each of the util.synthetic.RESOLUTIONS names, so the first
+        real request does not pay for the lazy set-up: the ocr engine, the detector predictor, cuda kernels and
+        cudnn autotuning per input shape, the caption batch size exploration and the caption cache.
+        The warmup parses go to self.warmup_timing_stats rather than self.timing_stats: the server keeps answering
+        /parse/ while it warms up, those requests are aggregated as usual. Returns self.startup.
+        """
+        start = time.perf_counter()
+        # per thread, parses of other threads meanwhile are real requests
+        self._local.warming_up = True
+        try:
+            for resolution in resolutions:
+                image, _ = make_screenshot(*RESOLUTIONS[resolution], seed=0)
+                buffered = io.BytesIO()
+                image.save(buffered, format='PNG')
+                parse_start = time.perf_counter()
+                self.parse(base64.b64encode(buffered.getvalue()).decode('ascii'), incremental=False)
+                self.startup['warmup_parses'][resolution] = time.perf_counter() - parse_start
+        finally:
+            self._local.warming_up = False
+        self.startup['warmup_seconds'] = time.perf_counter() - start
+        print(f"warmup done in {self.startup['warmup_seconds']:.1f}s:", ', '.join(f'{r} {s:.1f}s' for r, s in self.startup['warmup_parses'].items()))
+        return self.startup
+
+    @property
+    def last_timings(self) -> Dict:
+        return getattr(self._local, 'timings', {})
+
+    @property
+    def last_som_image(self) -> Dict:
+        return getattr(self._local, 'som_image', {})
+
+    @property
+    def micro_batching(self) -> bool:
+        return self.caption_micro_batcher is not None or self.yolo_micro_batcher is not None
+
+    def micro_batch_stats(self) -> Dict:
+        return {name: batcher.stats() if batcher is not None else None
+                for name, batcher in (('caption', self.caption_micro_batcher), ('yolo', self.yolo_micro_batcher))}
+
+    def parse(self, image_base64: str, session_id: Optional[str] = None, incremental: Optional[bool] = None,
+              som_format: Optional[str] = None, som_quality: Optional[int] = None, som_scale: Optional[float] = None,
+              profile: Optional[str] = None, return_timings: bool = False):
+        """
+        session_id / incremental: incremental=True (or None with config['incremental']) re-parses only the regions
+        that changed since the previous frame of session_id; without a session_id the parse is always full.
+        profile: name of a util.profiles.PARSE_PROFILES entry for this request, None for config['profile'] (default
+        'balanced'); explicit config values such as BOX_TRESHOLD override the profile either way.
+        som_format / som_quality / som_scale choose the encoding of the returned SOM image (see SOM_IMAGE_FORMATS in
+        util.utils), None falls back to the config and then to PNG at the PIL default level, full size.
+        The format and size of the last image of the calling thread are kept in self.last_som_image.
+        return_timings: also return the per-stage timings (util.timing.ParseTimer.to_dict: wall / cpu time and
+        element count of decode, ocr, yolo, fusion, crop, caption, annotate and encode, plus downscale and refine with
+        the resolution pyramid), always kept in self.last_timings and aggregated in self.timing_stats.
+        """
+        timer = ParseTimer()
+        with timer.stage('decode'):
+            # decoded once into one RGB buffer, ocr / yolo / cropping / annotation read views of it
+            frame = Frame.from_base64(image_base64)
+        print('image size:', frame.size)
+        draw_bbox_config = _draw_bbox_config(frame.size)
+
+        settings = resolve_profile(profile or self.config.get('profile', 'balanced'), self.config)
+        timer.info['profile'] = settings['profile']
+        if incremental is None:
+            incremental = self.config.get('incremental', False)
+        if incremental and session_id is None:
+            # no shared anonymous session: callers that do not name their session would diff against each other
+            incremental = False
+        result = None
+        if incremental:
+            with self._sessions_lock:
+                previous = self.sessions.get(session_id)
+            if previous is not None:
+                result = self._parse_incremental(frame, previous, draw_bbox_config, timer, settings)
+        timer.info['mode'] = 'incremental' if result is not None else 'full'
+        if result is None:
+            result = self._parse_full(frame, draw_bbox_config, timer, settings)
+        som_frame, parsed_content_list = result
+        if incremental:
+            # keep copies, callers are free to mutate the returned elements; the annotated frame rather than the
+            # encoded image so later requests of the session may ask for another encoding
+            with self._sessions_lock:
+                self.sessions[session_id] = {'frame': frame.array, 'elements': [dict(e) for e in parsed_content_list], 'som_frame': som_frame}
+                self.sessions.move_to_end(session_id)
+                while len(self.sessions) > self.config.get('incremental_max_sessions', 8):
+                    self.sessions.popitem(last=False)
+        dino_labled_img, self._local.som_image = _timed(timer, 'encode', None, encode_som_image, som_frame,
+                                                        image_format=som_format or self.config.get('som_format', 'png'),
+                                                        quality=som_quality if som_quality is not None else self.config.get('som_quality'),
+                                                        scale=som_scale if som_scale is not None else self.config.get('som_scale'))
+        timings = timer.to_dict()
+        self._local.timings = timings
+        (self.warmup_timing_stats if getattr(self._local, 'warming_up', False) else self.timing_stats).add(timings)
+        print('parse timings:', format_timings(timings))
+        if self.startup['first_parse_seconds'] is None:
+            self._record_first_parse(timings)
+
+        if return_timings:
+            return dino_labled_img, parsed_content_list, timings
+        return dino_labled_img, parsed_content_list
+
+    def _ocr_kwargs(self, frame, settings):
+        return dict(display_img=False, output_bb_format='xyxy', easyocr_args=resolve_easyocr_args(settings['easyocr_args'], frame.size), use_paddleocr=False, tile_size=self.config.get('ocr_tile_size'), tile_overlap=self.config.get('ocr_tile_overlap', 128), tile_workers=self.config.get('ocr_tile_workers', 4))
+
+    @property
+    def _caption_runner(self):
+        return self.caption_micro_batcher or self.caption_batcher
+
+    def _predict_yolo(self, frame, settings):
+        yolo_kwargs = dict(box_threshold=settings['BOX_TRESHOLD'], imgsz=settings['imgsz'], scale_img=settings['scale_img'], iou_threshold=0.1)
+        if self.yolo_micro_batcher is not None:
+            def predict(frames):
+                # the worker shares the predictor with parse_batch, which runs outside the micro batcher
+                with self._yolo_lock:
+                    return predict_yolo_batch(self.som_model, frames, **yolo_kwargs)
+            # frames of concurrent requests with the same size and detector settings go through one predictor call;
+            # frames of other sizes would be letterboxed to a common input and detect differently than alone
+            return self.yolo_micro_batcher.run(self.config['som_model_path'], 'detector', [frame], predict,
+                                               group=(frame.shape, *sorted(yolo_kwargs.items())))[0]
+        with self._yolo_lock:
+            return predict_yolo(model=self.som_model, image=frame, **yolo_kwargs)
+
+    def _detect(self, frame, timer, settings, confidences=None):
+        """ ocr + icon detection of the frame side by side, returns (text, ocr_bbox, yolo_result) in frame pixels """
+        ocr_kwargs = self._ocr_kwargs(frame, settings)
+        if self.executor is not None:
+            ocr_future = self.executor.submit(_timed, timer, 'ocr', _ocr_count, check_ocr_box, frame, confidences=confidences, **ocr_kwargs)
+            yolo_result = _timed(timer, 'yolo', _yolo_count, self._predict_yolo, frame, settings)
+            (text, ocr_bbox), _ = ocr_future.result()
+        else:
+            (text, ocr_bbox), _ = _timed(timer, 'ocr', _ocr_count, check_ocr_box, frame, confidences=confidences, **ocr_kwargs)
+            yolo_result = _timed(timer, 'yolo', _yolo_count, self._predict_yolo, frame, settings)
+        return text, ocr_bbox, yolo_result
+
+    def _detect_pyramid(self, frame, scale, timer, settings):
+        """ _detect on the frame downscaled by `scale`, then the text regions that came out small or with a low
+        confidence are read again from the full resolution frame (util.pyramid); boxes are in full resolution pixels """
+        with timer.stage('downscale'):
+            small, factors = downscale(frame, scale)
+        confidences = []
+        text, ocr_bbox, (xyxy, logits, phrases) = self._detect(small, timer, settings, confidences=confidences)
+        ocr_bbox = upscale_boxes(ocr_bbox, factors)
+        w, h = frame.size
+        with timer.stage('refine') as stage:
+            regions = refine_regions(ocr_bbox, confidences, factors, frame.size, min_text_height=self.config.get('pyramid_min_text_height', 12),
+                                     min_conf=self.config.get('pyramid_min_conf', 0.5))
+            ratio = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions) / float(w * h)
+            if ratio > self.config.get('pyramid_max_refine_ratio', 0.5):
+                # mostly small text, one full resolution pass is cheaper than many overlapping crops
+                regions = [(0, 0, w, h)]
+            stage['count'] = len(regions)
+        if regions:
+            # the full resolution reads are ocr time, side by side like the tiles of ocr_tiled
+            region_results = _timed(timer, 'ocr', lambda results: sum(len(bb) for _, bb in results), self._ocr_regions, frame, regions, settings)
+            region_text = [t for crop_text, _ in region_results for t in crop_text]
+            region_boxes = [b for _, crop_bbox in region_results for b in crop_bbox]
+            text, ocr_bbox = replace_text(text, ocr_bbox, regions, region_text, region_boxes)
+        timer.info.update(pyramid_scale=round(scale, 4), pyramid_refine_ratio=min(ratio, 1.0))
+        return text, ocr_bbox, (upscale_boxes(xyxy, factors), logits, phrases)
+
+    def _ocr_regions(self, frame, regions, settings):
+        """ check_ocr_box of each pixel region of the frame in up to ocr_tile_workers threads,
+        [(text, xyxy boxes in frame pixels)] per region """
+        def ocr_region(region):
+            x0, y0, x1, y1 = region
+            crop = frame.crop(x0, y0, x1, y1)
+            (crop_text, crop_bbox), _ = check_ocr_box(crop, **self._ocr_kwargs(crop, settings))
+            return crop_text, [(bx0 + x0, by0 + y0, bx1 + x0, by1 + y0) for bx0, by0, bx1, by1 in crop_bbox]
+
+        workers = min(self.config.get('ocr_tile_workers', 4), len(regions))
+        if workers <= 1:
+            return [ocr_region(region) for region in regions]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocr_region') as executor:
+            return list(executor.map(ocr_region, regions))
+
+    def _parse_full(self, frame, draw_bbox_config, timer, settings, annotate=True):
+        """ ocr + icon detection (side by side, on a downscaled frame with the resolution pyramid), then fusion,
+        captioning and annotation of the full resolution frame with the profile `settings`.
+        Returns (annotated frame, parsed_content_list), the frame is encoded by parse; annotate=False skips the
+        annotation and returns None for the frame """
+        scale = pyramid_scale(frame.size, settings['pyramid_max_side'])
+        if scale < 1:
+            text, ocr_bbox, yolo_result = self._detect_pyramid(frame, scale, timer, settings)
+        else:
+            text, ocr_bbox, yolo_result = self._detect(frame, timer, settings)
+
+        caption_stats = {}
+        som_frame, label_coordinates, parsed_content_list = get_som_labeled_img(frame, self.som_model, BOX_TRESHOLD = settings['BOX_TRESHOLD'], output_coord_in_ratio=True, ocr_bbox=ocr_bbox,draw_bbox_config=draw_bbox_config, caption_model_processor=self.caption_model_processor, ocr_text=text,use_local_semantics=settings['use_local_semantics'], iou_threshold=settings['iou_threshold'], scale_img=settings['scale_img'], imgsz=settings['imgsz'], batch_size=self.config.get('caption_batch_size'), overlap_method=self.config.get('overlap_method', 'vectorized'), caption_cache=self.caption_cache, caption_preprocess=self.config.get('caption_preprocess', 'pil'), yolo_result=yolo_result, encode_image=False, caption_batcher=self._caption_runner, caption_dedup=self.config.get('caption_dedup', 'exact'), caption_stats=caption_stats, caption_generation_args=settings['caption_generation_args'].get(caption_model_family(self.config['caption_model_name'])), timer=timer, annotate=annotate)
+        timer.info.update({f'caption_{k}': v for k, v in caption_stats.items()})
+        return som_frame, parsed_content_list
+
+    def _parse_incremental(self, frame, previous, draw_bbox_config, timer, settings):
+        """ re-parse only the regions that changed since the previous frame of the session,
+        returns None when a full parse is needed (new resolution or too much of the screen changed) """
+        h, w = frame.shape[:2]
+        if previous['frame'].shape != frame.shape:
+            return None
+        rects = _timed(timer, 'diff', len, find_dirty_rects, previous['frame'], frame.array, margin=self.config.get('incremental_margin', 32))
+        if not rects:
+            return previous['som_frame'], [dict(e) for e in previous['elements']]
+        # the previous elements a change touches are parsed again whole, not clipped to the region
+        rects = widen_rects(rects, previous['elements'], w, h)
+        ratio = changed_ratio(rects, w, h)
+        timer.info['changed_ratio'] = ratio
+        if ratio > self.config.get('incremental_max_changed_ratio', 0.3):
+            print(f'{ratio:.0%} of the screen changed, falling back to a full parse')
+            return None
+
+        # the ocr / yolo / fusion / crop / caption stages of the regions add up in the timer
+        with timer.stage('regions') as stage:
+            region_elements = []
+            for _, (x0, y0, x1, y1) in rects:
+                _, elements = self._parse_full(frame.crop(x0, y0, x1, y1), None, timer, settings, annotate=False)
+                for elem in elements:
+                    bx0, by0, bx1, by1 = elem['bbox']
+                    elem['bbox'] = [(x0 + bx0 * (x1 - x0)) / w, (y0 + by0 * (y1 - y0)) / h, (x0 + bx1 * (x1 - x0)) / w, (y0 + by1 * (y1 - y0)) / h]
+                    region_elements.append(elem)
+            stage['count'] = len(rects)
+        parsed_content_list = merge_elements(previous['elements'], region_elements, rects, w, h)
+        _, _, som_frame = _timed(timer, 'annotate', lambda r: len(r[1]), render_som_image, frame.array, [e['bbox'] for e in parsed_content_list], draw_bbox_config=draw_bbox_config, encode=False)
+        return som_frame, parsed_content_list
+
+    def parse_batch(self, images_base64: List[str], som_format: Optional[str] = None, som_quality: Optional[int] = None,
+                    som_scale: Optional[float] = None, profile: Optional[str] = None, return_timings: bool = False):
+        """
+        Parse several screenshots together: ocr runs per image beside batched icon detection (one call per image size),
+        the icon crops of every image share the caption batches (and the dedup / caption cache), annotation and
+        encoding stay per image. The options are those of parse; sessions / incremental parsing do not apply.
+        Returns one dict per image, {'som_image_base64', 'som_image_format', 'som_image_size', 'parsed_content_list'},
+        and the timings of the whole batch when return_timings (kept in self.last_timings and aggregated in
+        self.batch_timing_stats). An empty list returns an empty list.
+        """
+        timer = ParseTimer()
+        if not images_base64:
+            return ([], timer.to_dict()) if return_timings else []
+        with timer.stage('decode') as stage:
+            frames = [Frame.from_base64(image_base64) for image_base64 in images_base64]
+            stage['count'] = len(frames)
+        settings = resolve_profile(profile or self.config.get('profile', 'balanced'), self.config)
+        timer.info.update(profile=settings['profile'], mode='batch', images=len(frames))
+
+        def ocr_all():
+            return [check_ocr_box(frame, **self._ocr_kwargs(frame, settings)) for frame in frames]
+
+        def ocr_count(results):
+            return sum(_ocr_count(result) for result in results)
+
+        def yolo_count(results):
+            return sum(_yolo_count(result) for result in results)
+
+        def yolo_all():
+            # one predictor call per frame size: frames of other sizes would be letterboxed to a common input and
+            # detect differently than a parse of the frame alone (the settings are the same for the whole batch)
+            groups = {}
+            for i, frame in enumerate(frames):
+                groups.setdefault(frame.shape, []).append(i)
+            results = [None] * len(frames)
+            for indices in groups.values():
+                with self._yolo_lock:
+                    group_results = predict_yolo_batch(self.som_model, [frames[i] for i in indices], box_threshold=settings['BOX_TRESHOLD'], imgsz=settings['imgsz'], scale_img=settings['scale_img'], iou_threshold=0.1)
+                for i, result in zip(indices, group_results):
+                    results[i] = result
+            return results
+
+        if self.executor is not None:
+            ocr_future = self.executor.submit(_timed, timer, 'ocr', ocr_count, ocr_all)
+            yolo_results = _timed(timer, 'yolo', yolo_count, yolo_all)
+            ocr_results = ocr_future.result()
+        else:
+            ocr_results = _timed(timer, 'ocr', ocr_count, ocr_all)
+            yolo_results = _timed(timer, 'yolo', yolo_count, yolo_all)
+
+        fused = []
+        with timer.stage('fusion') as stage:
+            for frame, ((text, ocr_bbox), _), (xyxy, _, _) in zip(frames, ocr_results, yolo_results):
+                fused.append(fuse_ocr_icons(xyxy, ocr_bbox, text, frame.width, frame.height, iou_threshold=settings['iou_threshold'], overlap_method=self.config.get('overlap_method', 'vectorized')))
+            stage['count'] = sum(len(elements) for elements, _, _, _ in fused)
+        if settings['use_local_semantics']:
+            self._caption_pooled(frames, fused, timer, settings)
+
+        results = []
+        for frame, (elements, _, boxes, _), (_, logits, _) in zip(frames, fused, yolo_results):
+            _, _, som_frame = _timed(timer, 'annotate', lambda r: len(r[1]), render_som_image, frame.array, boxes, draw_bbox_config=_draw_bbox_config(frame.size), logits=logits, encode=False)
+            som_image_base64, som_image = _timed(timer, 'encode', None, encode_som_image, som_frame,
+                                                 image_format=som_format or self.config.get('som_format', 'png'),
+                                                 quality=som_quality if som_quality is not None else self.config.get('som_quality'),
+                                                 scale=som_scale if som_scale is not None else self.config.get('som_scale'))
+            results.append({'som_image_base64': som_image_base64, 'som_image_format': som_image['format'],
+                            'som_image_size': [som_image['width'], som_image['height']], 'parsed_content_list': elements})
+        timings = timer.to_dict()
+        self._local.timings = timings
+        self.batch_timing_stats.add(timings)
+        print(f'parse batch of {len(frames)} timings:', format_timings(timings))
+
+        if return_timings:
+            return results, timings
+        return results
+
+    def _caption_pooled(self, frames, fused, timer, settings):
+        """ caption the icons of all frames in shared batches and fill them into the fused elements """
+        model = self.caption_model_processor['model']
+        batch_size = self.config.get('caption_batch_size')
+        if 'phi3_v' in model.config.model_type:
+            # the phi3v prompt collation is per image already, its captions stay per frame
+            for frame, (elements, _, boxes, ocr_bbox) in zip(frames, fused):
+                fill_icon_contents(elements, get_parsed_content_icon_phi3v(boxes, ocr_bbox, frame.array, self.caption_model_processor, batch_size=batch_size, batcher=self._caption_runner, timer=timer))
+            return
+        preprocess = self.config.get('caption_preprocess', 'pil')
+        crops, croped_images, counts = [], [], []
+        with timer.stage('crop') as stage:
+            for frame, (_, starting_idx, boxes, _) in zip(frames, fused):
+                frame_crops, frame_croped_images = crop_icons(frame.array, boxes[starting_idx:], preprocess=preprocess, device=model.device)
+                crops.append(frame_crops)
+                croped_images.extend(frame_croped_images)
+                counts.append(len(frame_croped_images))
+            stage['count'] = len(croped_images)
+        caption_stats = {}
+        texts = caption_icons(croped_images, torch.cat(crops) if preprocess == 'tensor' else None, self.caption_model_processor,
+                              batch_size=batch_size, caption_cache=self.caption_cache, preprocess=preprocess, batcher=self._caption_runner,
+                              dedup=self.config.get('caption_dedup', 'exact'), stats=caption_stats,
+                              generation_args=settings['caption_generation_args'].get(caption_model_family(self.config['caption_model_name'])), timer=timer)
+        timer.info.update({f'caption_{k}': v for k, v in caption_stats.items()})
+        offset = 0
+        for (elements, _, _, _), count in zip(fused, counts):
+            fill_icon_contents(elements, texts[offset:offset + count])
+            offset += count
@@ -0,0 +1,82 @@
+import copy
+
+# Named speed / accuracy settings of the whole parse pipeline, picked per Omniparser instance (config['profile'])
+# or per request. Keys:
+#   BOX_TRESHOLD           icon detector confidence threshold
+#   iou_threshold          overlap threshold of the icon / ocr box fusion (remove_overlap_*)
+#   imgsz, scale_img       icon detector input size, only used when scale_img is True (else the model's own size)
+#   easyocr_args           readtext kwargs; canvas_size 'image' means the frame's longest side
+#   use_local_semantics    caption icons (False leaves icon content None, the largest saving on cpu)
+#   pyramid_max_side       ocr / icon detection of larger frames run downscaled to this longest side, with the small
+#                          or low confidence text read again at full resolution (util/pyramid.py); None is off
+#   caption_generation_args  generate() kwargs per caption model family, also part of the caption cache namespace
+# 'balanced' is what Omniparser always ran with, 'accurate' follows the settings of eval/ss_pro_gpt4o_omniv2.py.
+PARSE_PROFILES = {
+    'fast': {
+        'BOX_TRESHOLD': 0.1,
+        'iou_threshold': 0.7,
+        'imgsz': 640,
+        'scale_img': True,
+        'easyocr_args': {'text_threshold': 0.8, 'decoder': 'greedy', 'canvas_size': 1280},
+        'use_local_semantics': False,
+        'pyramid_max_side': None,
+        'caption_generation_args': {
+            'florence2': {'max_new_tokens': 10},
+            'blip2': {'num_beams': 1, 'max_length': 30},
+        },
+    },
+    'balanced': {
+        'BOX_TRESHOLD': 0.05,
+        'iou_threshold': 0.7,
+        'imgsz': None,
+        'scale_img': False,
+        'easyocr_args': {'text_threshold': 0.8},
+        'use_local_semantics': True,
+        'pyramid_max_side': None,
+        'caption_generation_args': {
+            'florence2': {'max_new_tokens': 20},
+            'blip2': {'num_beams': 5, 'max_length': 100},
+        },
+    },
+    'accurate': {
+        'BOX_TRESHOLD': 0.03,
+        'iou_threshold': 0.7,
+        'imgsz': None,
+        'scale_img': False,
+        'easyocr_args': {'paragraph': False, 'text_threshold': 0.5, 'canvas_size': 'image', 'decoder': 'beamsearch', 'beamWidth': 10, 'batch_size': 256},
+        'use_local_semantics': True,
+        'pyramid_max_side': None,
+        'caption_generation_args': {
+            'florence2': {'max_new_tokens': 30},
+            'blip2': {'num_beams': 5, 'max_length': 100},
+        },
+    },
+}
+
+
+def resolve_profile(name='balanced', overrides=None):
+    """
+    Settings of profile `name`, with every non-None value of `overrides` whose key is a profile setting applied
+    on top (Omniparser passes its config, so e.g. an explicit BOX_TRESHOLD still wins over the profile).
+    """
+    if name not in PARSE_PROFILES:
+        raise ValueError(f"Unknown parse profile {name!r}, expected one of {list(PARSE_PROFILES)}")
+    settings = copy.deepcopy(PARSE_PROFILES[name])
+    for key, value in (overrides or {}).items():
+        if key in settings and value is not None:
+            settings[key] = value
+    settings['profile'] = name
+    return settings
+
+
+def resolve_easyocr_args(easyocr_args, image_size):
+    """ easyocr kwargs for a frame of image_size (w, h) """
+    easyocr_args = dict(easyocr_args)
+    if easyocr_args.get('canvas_size') == 'image':
+        easyocr_args['canvas_size'] = max(image_size)
+    return easyocr_args
+
+
+def caption_model_family(caption_model_name):
+    """ key of caption_generation_args for a caption_model_name: florence2_int8 / florence2_onnx -> florence2 """
+    return caption_model_name.split('_')[0]
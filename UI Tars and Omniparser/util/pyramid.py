@@ -0,0 +1,86 @@
+'''
+Resolution pyramid for large frames: ocr and icon detection run on a copy downscaled so its longest side is at most
+pyramid_max_side, and only the regions around text that came out small or with a low recognition confidence are read
+again from the full resolution frame. Every box is mapped back to full resolution pixels before the fusion, so the
+icon crops, captions and the annotated image are those of the original frame.
+
+    scale = pyramid_scale(frame.size, 1920)  # 0.5 for a 4k frame, 1.0 (no pyramid) at 1080p
+    small, factors = downscale(frame, scale)
+    ... ocr / detect on small ...
+    boxes = upscale_boxes(boxes, factors)
+    regions = refine_regions(boxes, confs, factors, frame.size)
+    ... ocr every frame.crop(*region) ...
+    text, boxes = replace_text(text, boxes, regions, region_text, region_boxes)
+'''
+
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from util.frame import Frame
+from util.spatial_index import intersection_area, expand_rect, rect_contains, merge_rects, grow_rects
+
+
+def pyramid_scale(size, max_side) -> float:
+    """ downscale factor bringing the longest side of a (w, h) frame to max_side, 1.0 when it is not larger """
+    if not max_side:
+        return 1.0
+    return min(1.0, max_side / float(max(size)))
+
+
+def downscale(frame: Frame, scale: float):
+    """ (downscaled Frame, (fx, fy)) with fx / fy the factors from its pixels back to the frame's (after rounding) """
+    w, h = frame.size
+    sw, sh = max(int(round(w * scale)), 1), max(int(round(h * scale)), 1)
+    # INTER_AREA averages the covered pixels, thin strokes of text stay visible where nearest / linear skip them
+    small = Frame(cv2.resize(frame.array, (sw, sh), interpolation=cv2.INTER_AREA))
+    return small, (w / sw, h / sh)
+
+
+def upscale_boxes(boxes, factors):
+    """ xyxy boxes of the downscaled frame in full resolution pixels: a list of ocr boxes (int tuples, like
+    check_ocr_box) stays a list of int tuples, detector boxes (tensor / array) are scaled as they are """
+    fx, fy = factors
+    if isinstance(boxes, list):
+        return [(int(round(x0 * fx)), int(round(y0 * fy)), int(round(x1 * fx)), int(round(y1 * fy))) for x0, y0, x1, y1 in boxes]
+    if hasattr(boxes, 'new_tensor'):
+        return boxes * boxes.new_tensor([fx, fy, fx, fy])
+    return boxes * np.asarray([fx, fy, fx, fy], dtype=boxes.dtype)
+
+
+def refine_regions(boxes, confs, factors, size, min_text_height=12, min_conf=0.5, margin=16) -> List[Tuple[int, int, int, int]]:
+    """
+    Full resolution pixel regions to ocr again: each text box (full resolution xyxy) that was under min_text_height
+    px high in the downscaled frame or read with a confidence under min_conf (None confidences never count as low)
+    is grown by margin px and half its height, overlapping regions are merged, and every region is grown to take in
+    the whole of the boxes it cuts (spatial_index.grow_rects), so the full resolution reads see whole lines; a line a
+    grown region still cuts keeps its downscaled read (see replace_text).
+    """
+    w, h = size
+    fy = factors[1]
+    rects = []
+    for (x0, y0, x1, y1), conf in zip(boxes, confs):
+        if (y1 - y0) / fy < min_text_height or (conf is not None and conf < min_conf):
+            rects.append(expand_rect((x0, y0, x1, y1), margin + (y1 - y0) // 2, w, h))
+    return grow_rects(merge_rects(rects), boxes, w, h)
+
+
+def replace_text(text, boxes, regions, region_text, region_boxes, overlap_threshold=0.5):
+    """
+    Text of the downscaled pass with the refined regions swapped in. Boxes lying inside a region are dropped for the
+    region's full resolution reads (region_boxes in full frame pixels); a read covering more than overlap_threshold
+    of its area with a kept box is the other half of that line and is left out.
+    Returns (text, boxes) in reading order.
+    """
+    kept = [(t, b) for t, b in zip(text, boxes) if not any(rect_contains(r, b) for r in regions)]
+    kept_boxes = np.asarray([b for _, b in kept], dtype=np.float64).reshape(-1, 4)
+    for t, b in zip(region_text, region_boxes):
+        if len(kept_boxes):
+            x0, y0, x1, y1 = b
+            inter = intersection_area(np.asarray(b, dtype=np.float64)[None], kept_boxes)
+            if (inter / max((x1 - x0) * (y1 - y0), 1)).max() > overlap_threshold:
+                continue
+        kept.append((t, b))
+    kept.sort(key=lambda tb: (tb[1][1], tb[1][0]))
+    return [t for t, _ in kept], [b for _, b in kept]
@@ -0,0 +1,157 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def intersection_area(boxes1, boxes2):
+    """ element-wise intersection area of xyxy boxes, boxes1 and boxes2 broadcast against each other
+    """
+    w = np.minimum(boxes1[..., 2], boxes2[..., 2]) - np.maximum(boxes1[..., 0], boxes2[..., 0])
+    h = np.minimum(boxes1[..., 3], boxes2[..., 3]) - np.maximum(boxes1[..., 1], boxes2[..., 1])
+    return np.maximum(0, w) * np.maximum(0, h)
+
+
+def expand_rect(rect, margin, w, h):
+    """ xyxy pixel rect grown by margin on every side, clipped to a w x h frame """
+    x0, y0, x1, y1 = rect
+    return (max(x0 - margin, 0), max(y0 - margin, 0), min(x1 + margin, w), min(y1 + margin, h))
+
+
+def rects_touch(a, b) -> bool:
+    """ True when the xyxy rects a and b overlap with a positive area """
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def rect_contains(rect, box) -> bool:
+    return rect[0] <= box[0] and rect[1] <= box[1] and box[2] <= rect[2] and box[3] <= rect[3]
+
+
+def rect_union(rects):
+    """ bounding xyxy rect of a non-empty list of rects """
+    return (min(r[0] for r in rects), min(r[1] for r in rects), max(r[2] for r in rects), max(r[3] for r in rects))
+
+
+def merge_rects(rects):
+    """ overlapping xyxy rects replaced by their bounding rect, until no two rects of the result overlap """
+    rects = list(rects)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                if rects_touch(rects[i], rects[j]):
+                    rects[i] = rect_union([rects[i], rects[j]])
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+def grow_rects(rects, boxes, w, h):
+    """
+    Each rect grown to take in the whole of every box it cuts, clipped to a w x h frame, then merge_rects.
+    A single pass: a box that a grown / merged rect cuts in turn is not taken in.
+    """
+    grown = []
+    for rect in rects:
+        cut = [box for box in boxes if rects_touch(box, rect)]
+        x0, y0, x1, y1 = rect_union([rect] + cut)
+        grown.append((max(x0, 0), max(y0, 0), min(x1, w), min(y1, h)))
+    return merge_rects(grown)
+
+
+class GridIndex:
+    """
+    Uniform grid over a fixed set of xyxy boxes (normalized or pixel coordinates) for
+    candidate-overlap queries. Every box is registered in each grid cell it touches, so a
+    query only looks at the boxes sharing a cell with it instead of the whole set.
+
+    Attributes:
+        boxes (np.ndarray): (N, 4) indexed boxes, xyxy
+        cell_size (float): side length of one grid cell, in the units of `boxes`
+        max_cells (int): upper bound on the number of cells along each axis
+    """
+
+    def __init__(self, boxes, cell_size: Optional[float] = None, max_cells: int = 256):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if len(self.boxes) == 0:
+            self.origin = np.zeros(2)
+            self.cell_size = 1.0
+            self.n_cols, self.n_rows = 1, 1
+            self._cell_keys = np.zeros(0, dtype=np.int64)
+            self._cell_starts = np.zeros(1, dtype=np.int64)
+            self._cell_boxes = np.zeros(0, dtype=np.int64)
+            return
+
+        self.origin = self.boxes[:, :2].min(axis=0)
+        span = max(float((self.boxes[:, 2:].max(axis=0) - self.origin).max()), 1e-9)
+        if cell_size is None:
+            # a cell about the typical element size keeps most boxes in a handful of cells
+            area = (self.boxes[:, 2] - self.boxes[:, 0]) * (self.boxes[:, 3] - self.boxes[:, 1])
+            cell_size = float(np.sqrt(np.median(np.maximum(area, 0))))
+        self.cell_size = max(cell_size, span / max_cells)
+        self.n_cols = int(span // self.cell_size) + 1
+        self.n_rows = self.n_cols
+
+        # CSR layout: boxes sorted by cell key, one [start, end) slice per occupied cell
+        owner, keys = self._touched_cells(self.boxes)
+        order = np.argsort(keys, kind='stable')
+        keys, self._cell_boxes = keys[order], owner[order]
+        self._cell_keys, starts = np.unique(keys, return_index=True)
+        self._cell_starts = np.append(starts, len(keys))
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _touched_cells(self, boxes) -> Tuple[np.ndarray, np.ndarray]:
+        """ (box index, cell key) for every grid cell touched by each box, clipped to the grid
+        """
+        lo = np.floor((boxes[:, :2] - self.origin) / self.cell_size).astype(np.int64)
+        hi = np.floor((boxes[:, 2:] - self.origin) / self.cell_size).astype(np.int64)
+        lo = np.clip(lo, 0, [self.n_cols - 1, self.n_rows - 1])
+        hi = np.clip(hi, lo, [self.n_cols - 1, self.n_rows - 1])
+        width = hi[:, 0] - lo[:, 0] + 1
+        counts = width * (hi[:, 1] - lo[:, 1] + 1)
+        owner = np.repeat(np.arange(len(boxes)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        col = lo[owner, 0] + offset % width[owner]
+        row = lo[owner, 1] + offset // width[owner]
+        return owner, row * self.n_cols + col
+
+    def query_pairs(self, boxes) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find every (query box, indexed box) pair with a positive intersection area.
+
+        Args:
+            boxes: (M, 4) query boxes, xyxy, same units as the indexed boxes
+        Returns:
+            (query_idx, box_idx): two int arrays, sorted by query_idx then box_idx
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        empty = np.zeros(0, dtype=np.int64)
+        if len(boxes) == 0 or len(self._cell_keys) == 0:
+            return empty, empty
+        query_owner, query_keys = self._touched_cells(boxes)
+        slot = np.searchsorted(self._cell_keys, query_keys)
+        slot = np.minimum(slot, len(self._cell_keys) - 1)
+        hit = self._cell_keys[slot] == query_keys
+        query_owner, slot = query_owner[hit], slot[hit]
+
+        starts = self._cell_starts[slot]
+        counts = self._cell_starts[slot + 1] - starts
+        query_idx = np.repeat(query_owner, counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        box_idx = self._cell_boxes[np.repeat(starts, counts) + offset]
+
+        # a pair sharing several cells shows up once per cell
+        pair_key = np.unique(query_idx * len(self.boxes) + box_idx)
+        query_idx, box_idx = pair_key // len(self.boxes), pair_key % len(self.boxes)
+        overlap = intersection_area(boxes[query_idx], self.boxes[box_idx]) > 0
+        return query_idx[overlap], box_idx[overlap]
+
+    def query(self, box) -> np.ndarray:
+        """ indices (ascending) of the indexed boxes that intersect `box` with a positive area
+        """
+        return self.query_pairs(np.asarray(box, dtype=np.float64).reshape(1, 4))[1]
@@ -0,0 +1,104 @@
+'''
+Synthetic GUI screenshots drawn with PIL only (no network, no model weights), used by the benchmarks and the
+server warmup (Omniparser.warmup).
+
+    image, elements = make_screenshot(1920, 1080, n_icons=80, n_text=150, seed=0)
+
+elements follow the parsed_content_list layout: {'type': 'text' | 'icon', 'bbox': normalized xyxy, 'content': str | None}
+'''
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+RESOLUTIONS = {
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    '4k': (3840, 2160),
+}
+
+WORDS = ('file edit view insert format tools help open save close search settings account share '
+         'export import window terminal debug run build commit push pull branch merge filter sort '
+         'inbox sent drafts archive delete reply forward calendar contacts notes tasks refresh').split()
+
+PALETTE = [(66, 133, 244), (219, 68, 55), (244, 180, 0), (15, 157, 88), (171, 71, 188), (0, 172, 193), (96, 125, 139)]
+
+
+def get_font(size):
+    try:
+        return ImageFont.truetype('DejaVuSans.ttf', size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+def _free(occupied, box):
+    x1, y1, x2, y2 = box
+    return not any(x1 < b[2] and b[0] < x2 and y1 < b[3] and b[1] < y2 for b in occupied)
+
+
+def make_screenshot(width=1920, height=1080, n_icons=80, n_text=150, text_size=None, seed=0, max_tries=50):
+    '''
+    Draw a window-like frame with a title bar, icon buttons and text lines at random non-overlapping positions.
+
+    Args:
+        n_icons: element density, number of icon buttons
+        n_text: text density, number of text lines
+        text_size: font size in px, defaults to scale with the resolution (16px at 1080p)
+    Returns:
+        (PIL RGB image, list of ground-truth elements)
+    '''
+    rng = np.random.default_rng(seed)
+    scale = height / 1080
+    text_size = text_size or max(int(16 * scale), 8)
+    icon_size = max(int(32 * scale), 12)
+    font = get_font(text_size)
+
+    image = Image.new('RGB', (width, height), (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    title_h = int(40 * scale)
+    draw.rectangle([0, 0, width, title_h], fill=(32, 33, 36))
+    occupied = [(0, 0, width, title_h)]
+    elements = []
+
+    for _ in range(n_icons):
+        for _ in range(max_tries):
+            x = int(rng.integers(0, width - icon_size))
+            y = int(rng.integers(0, height - icon_size))
+            box = (x, y, x + icon_size, y + icon_size)
+            if _free(occupied, box):
+                break
+        else:
+            continue
+        color = PALETTE[int(rng.integers(len(PALETTE)))]
+        draw.rounded_rectangle(box, radius=icon_size // 5, fill=color)
+        inset = icon_size // 4
+        glyph = int(rng.integers(3))
+        inner = (x + inset, y + inset, x + icon_size - inset, y + icon_size - inset)
+        if glyph == 0:
+            draw.ellipse(inner, outline=(255, 255, 255), width=max(icon_size // 12, 1))
+        elif glyph == 1:
+            draw.line([inner[:2], inner[2:]], fill=(255, 255, 255), width=max(icon_size // 10, 1))
+            draw.line([(inner[0], inner[3]), (inner[2], inner[1])], fill=(255, 255, 255), width=max(icon_size // 10, 1))
+        else:
+            draw.polygon([(inner[0], inner[1]), (inner[2], (inner[1] + inner[3]) // 2), (inner[0], inner[3])], fill=(255, 255, 255))
+        occupied.append(box)
+        elements.append({'type': 'icon', 'bbox': [box[0] / width, box[1] / height, box[2] / width, box[3] / height], 'content': None})
+
+    for _ in range(n_text):
+        content = ' '.join(rng.choice(WORDS, size=int(rng.integers(1, 6))))
+        left, top, right, bottom = draw.textbbox((0, 0), content, font=font)
+        tw, th = right - left, bottom - top
+        if tw >= width or th >= height:
+            continue
+        for _ in range(max_tries):
+            x = int(rng.integers(0, width - tw))
+            y = int(rng.integers(0, height - th))
+            box = (x, y, x + tw, y + th)
+            if _free(occupied, box):
+                break
+        else:
+            continue
+        draw.text((x - left, y - top), content, fill=(20, 20, 20), font=font)
+        occupied.append(box)
+        elements.append({'type': 'text', 'bbox': [box[0] / width, box[1] / height, box[2] / width, box[3] / height], 'content': content})
+
+    return image, elements
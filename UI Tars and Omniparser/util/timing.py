@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# pipeline order, used to sort the stages of a parse
+STAGES = ('decode', 'diff', 'downscale', 'ocr', 'yolo', 'refine', 'fusion', 'crop', 'caption', 'annotate', 'encode')
+
+
+class ParseTimer:
+    """
+    Per-stage timing of one parse.
+
+    Every stage records its wall time, the process cpu time spent during it (all threads, so the ocr and yolo
+    stages that run side by side both count the cpu of the other), its start / end offset from the start of the
+    parse and an optional element count. A stage entered several times (e.g. once per re-parsed region) adds up.
+
+        timer = ParseTimer()
+        with timer.stage('ocr') as stage:
+            text, boxes = ...
+            stage['count'] = len(boxes)
+        timer.to_dict()
+    """
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        self.stages = {}
+        self.info = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        record = {}
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            end, cpu_end = time.perf_counter(), time.process_time()
+            with self._lock:
+                stage = self.stages.get(name)
+                if stage is None:
+                    self.stages[name] = {'start': start - self.t0, 'end': end - self.t0, 'wall': end - start, 'cpu': cpu_end - cpu_start, 'calls': 1, **record}
+                else:
+                    stage['end'] = end - self.t0
+                    stage['wall'] += end - start
+                    stage['cpu'] += cpu_end - cpu_start
+                    stage['calls'] += 1
+                    if 'count' in record:
+                        stage['count'] = stage.get('count', 0) + record['count']
+
+    def to_dict(self):
+        order = {name: i for i, name in enumerate(STAGES)}
+        with self._lock:
+            stages = dict(sorted(self.stages.items(), key=lambda kv: (order.get(kv[0], len(order)), kv[1]['start'])))
+            return {'total': time.perf_counter() - self.t0, 'total_cpu': time.process_time() - self.cpu0, 'stages': stages, **self.info}
+
+
+class _NullTimer:
+    """ stand-in when the caller does not time the parse """
+
+    @contextmanager
+    def stage(self, name):
+        yield {}
+
+
+NULL_TIMER = _NullTimer()
+
+
+def format_timings(timings):
+    """ one line summary for the logs: stage wall/cpu ms and counts """
+    parts = [f"total {timings['total'] * 1e3:.0f}ms"]
+    for name, s in timings['stages'].items():
+        count = f" n={s['count']}" if 'count' in s else ''
+        parts.append(f"{name} {s['wall'] * 1e3:.0f}/{s['cpu'] * 1e3:.0f}ms{count}")
+    return ', '.join(parts)
+
+
+class TimingAggregator:
+    """
+    In-process aggregate of ParseTimer.to_dict() results: per stage the number of parses it ran in, mean wall /
+    cpu time, mean element count (stages that count), and p50 / p90 / max wall time over the last `window` parses.
+    """
+
+    def __init__(self, window: int = 512):
+        self.window = window
+        self._lock = threading.Lock()
+        self.parses = 0
+        self._totals = {}
+        self._recent = {}
+
+    def add(self, timings):
+        with self._lock:
+            self.parses += 1
+            for name, s in [('total', {'wall': timings['total'], 'cpu': timings['total_cpu']}), *timings['stages'].items()]:
+                totals = self._totals.setdefault(name, {'parses': 0, 'wall': 0.0, 'cpu': 0.0})
+                totals['parses'] += 1
+                totals['wall'] += s['wall']
+                totals['cpu'] += s['cpu']
+                if 'count' in s:
+                    totals['count'] = totals.get('count', 0) + s['count']
+                self._recent.setdefault(name, deque(maxlen=self.window)).append(s['wall'])
+
+    def summary(self):
+        with self._lock:
+            summary = {}
+            for name, totals in self._totals.items():
+                recent = np.fromiter(self._recent[name], dtype=np.float64)
+                summary[name] = {
+                    'parses': totals['parses'],
+                    'wall_mean': totals['wall'] / totals['parses'],
+                    'cpu_mean': totals['cpu'] / totals['parses'],
+                    'wall_p50': float(np.percentile(recent, 50)),
+                    'wall_p90': float(np.percentile(recent, 90)),
+                    'wall_max': float(recent.max()),
+                }
+                if 'count' in totals:
+                    summary[name]['count_mean'] = totals['count'] / totals['parses']
+            return {'parses': self.parses, 'stages': summary}
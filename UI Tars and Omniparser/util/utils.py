@@ -5,30 +5,18 @@ import base64
 import time
 from PIL import Image, ImageDraw, ImageFont
 import json
-import requests
 # utility function
 import os
-from openai import AzureOpenAI
+import hashlib
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import json
 import sys
 import os
 import cv2
 import numpy as np
-# %matplotlib inline
-from matplotlib import pyplot as plt
-import easyocr
-from paddleocr import PaddleOCR
-reader = easyocr.Reader(['en'])
-paddle_ocr = PaddleOCR(
-    lang='en',  # other lang also available
-    use_angle_cls=False,
-    use_gpu=False,  # using cuda will conflict with pytorch in the same process
-    show_log=False,
-    max_batch_size=1024,
-    use_dilation=True,  # improves accuracy
-    det_db_score_mode='slow',  # improves accuracy
-    rec_batch_num=1024)
 import time
 import base64
 
@@ -36,130 +24,358 @@ import os
 import ast
 import torch
 from typing import Tuple, List, Union
-from torchvision.ops import box_convert
+from torchvision.ops import box_convert, roi_align
+import torch.nn.functional as F
 import re
 from torchvision.transforms import ToPILImage
 import supervision as sv
 import torchvision.transforms as T
 from util.box_annotator import BoxAnnotator 
+from util.spatial_index import GridIndex, intersection_area
+from util.detector_backends import DETECTOR_BACKENDS, get_detector
+from util.timing import NULL_TIMER
+from util.frame import Frame, as_frame
 
 
-def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2-opt-2.7b", device=None):
+def _build_easyocr():
+    import easyocr
+    return easyocr.Reader(['en'])
+
+
+def _build_paddleocr():
+    from paddleocr import PaddleOCR
+    return PaddleOCR(
+        lang='en',  # other lang also available
+        use_angle_cls=False,
+        use_gpu=False,  # using cuda will conflict with pytorch in the same process
+        show_log=False,
+        max_batch_size=1024,
+        use_dilation=True,  # improves accuracy
+        det_db_score_mode='slow',  # improves accuracy
+        rec_batch_num=1024)
+
+
+# OCR engines are built on first use and cached: importing util.utils no longer loads easyocr/paddleocr
+OCR_ENGINE_FACTORIES = {
+    'easyocr': _build_easyocr,
+    'paddleocr': _build_paddleocr,
+}
+_ocr_engines = {}
+_ocr_engines_lock = threading.Lock()
+
+
+def get_ocr_engine(name='easyocr'):
+    engine = _ocr_engines.get(name)
+    if engine is None:
+        with _ocr_engines_lock:
+            engine = _ocr_engines.get(name)
+            if engine is None:
+                start = time.time()
+                engine = OCR_ENGINE_FACTORIES[name]()
+                _ocr_engines[name] = engine
+                print(f'{name} initialized in {time.time()-start:.2f}s')
+    return engine
+
+
+def __getattr__(name):
+    # keep the old module level `reader` / `paddle_ocr` names working, built lazily on access
+    if name == 'reader':
+        return get_ocr_engine('easyocr')
+    if name == 'paddle_ocr':
+        return get_ocr_engine('paddleocr')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2-opt-2.7b", device=None, fast_load=True):
+    # processors load from model_name_or_path when one was saved there (python -m util.model_cache), else from the hub;
+    # fast_load: memory-mapped safetensors without the random init (low_cpu_mem_usage), straight onto the gpu
+    from util.model_cache import processor_path, pretrained_kwargs
     if not device:
         device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = torch.float32 if device == 'cpu' else torch.float16
     if model_name == "blip2":
         from transformers import Blip2Processor, Blip2ForConditionalGeneration
-        processor = Blip2Processor.from_pretrained("Salesforce/blip2-opt-2.7b")
-        if device == 'cpu':
-            model = Blip2ForConditionalGeneration.from_pretrained(
-            model_name_or_path, device_map=None, torch_dtype=torch.float32
-        ) 
-        else:
-            model = Blip2ForConditionalGeneration.from_pretrained(
-            model_name_or_path, device_map=None, torch_dtype=torch.float16
-        ).to(device)
+        processor = Blip2Processor.from_pretrained(processor_path(model_name, model_name_or_path))
+        model = Blip2ForConditionalGeneration.from_pretrained(model_name_or_path, **pretrained_kwargs(model_name_or_path, device, dtype, fast_load))
     elif model_name == "florence2":
         from transformers import AutoProcessor, AutoModelForCausalLM 
-        processor = AutoProcessor.from_pretrained("microsoft/Florence-2-base", trust_remote_code=True)
-        if device == 'cpu':
-            model = AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=torch.float32, trust_remote_code=True)
-        else:
-            model = AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=torch.float16, trust_remote_code=True).to(device)
+        processor = AutoProcessor.from_pretrained(processor_path(model_name, model_name_or_path), trust_remote_code=True)
+        model = AutoModelForCausalLM.from_pretrained(model_name_or_path, trust_remote_code=True, **pretrained_kwargs(model_name_or_path, device, dtype, fast_load))
+    elif model_name in ("florence2_int8", "florence2_onnx"):
+        # cpu caption backends, see util.caption_backends; florence2_onnx takes the exported onnx directory as model_name_or_path
+        from transformers import AutoProcessor
+        from util.caption_backends import load_florence2_int8, Florence2OnnxModel
+        processor = AutoProcessor.from_pretrained(processor_path(model_name, model_name_or_path), trust_remote_code=True)
+        if device != 'cpu':
+            print(f'{model_name} is a cpu backend, ignoring device {device}')
+            device = 'cpu'
+        model = load_florence2_int8(model_name_or_path) if model_name == "florence2_int8" else Florence2OnnxModel(model_name_or_path)
     return {'model': model.to(device), 'processor': processor}
 
 
-def get_yolo_model(model_path):
+def get_yolo_model(model_path, backend='torch'):
+    # backend: 'torch' (ultralytics YOLO object), or 'onnx' / 'openvino' for a graph exported next to model_path,
+    # see util.detector_backends
+    if backend != 'torch':
+        return get_detector(model_path, backend=backend)
+    if model_path.endswith('.safetensors'):
+        # written by python -m util.model_cache: safetensors state dict + architecture yaml instead of the pickle
+        from util.model_cache import load_yolo_safetensors
+        return load_yolo_safetensors(model_path)
     from ultralytics import YOLO
     # Load the model.
     model = YOLO(model_path)
     return model
 
 
-@torch.inference_mode()
-def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=None, batch_size=128):
-    # Number of samples per batch, --> 128 roughly takes 4 GB of GPU memory for florence v2 model
-    to_pil = ToPILImage()
-    if starting_idx:
-        non_ocr_boxes = filtered_boxes[starting_idx:]
-    else:
-        non_ocr_boxes = filtered_boxes
-    croped_pil_image = []
-    for i, coord in enumerate(non_ocr_boxes):
+def icon_dedup_key(crop: np.ndarray, mode='exact'):
+    """ Grouping key of a resized icon crop: 'exact' hashes the pixels, 'near' a 16x16 area-downsampled copy
+    quantized to 16 levels, so anti-aliasing / compression noise between copies of the same icon still matches. """
+    if mode == 'near':
+        crop = cv2.resize(np.ascontiguousarray(crop), (16, 16), interpolation=cv2.INTER_AREA) >> 4
+    elif mode != 'exact':
+        raise ValueError(f"Unknown icon dedup mode {mode!r}, expected 'exact', 'near' or None")
+    digest = hashlib.blake2b(str(crop.shape).encode('ascii'), digest_size=16)
+    digest.update(np.ascontiguousarray(crop).tobytes())
+    return digest.digest()
+
+
+def crop_icons_tensor(image_source: np.ndarray, boxes, size=64, device='cpu'):
+    """ Batched version of slicing every box out of image_source and cv2.resize-ing it to (size, size).
+    Uses roi_align with one bilinear sample per output pixel (same sampling grid as cv2 INTER_LINEAR).
+
+    Args:
+        image_source: HWC uint8 RGB frame
+        boxes: normalized xyxy, tensor or list
+    Returns:
+        (uint8 tensor (K, 3, size, size), indices of the boxes that produced a crop)
+    """
+    h, w = image_source.shape[:2]
+    boxes = torch.as_tensor(boxes, dtype=torch.float32).reshape(-1, 4).cpu()
+    # same integer pixel coordinates (and clamping) as image_source[ymin:ymax, xmin:xmax]
+    pixel_boxes = (boxes * torch.tensor([w, h, w, h], dtype=torch.float32)).trunc()
+    pixel_boxes = torch.minimum(pixel_boxes.clamp(min=0), torch.tensor([w, h, w, h], dtype=torch.float32))
+    # empty slices make cv2.resize raise, the per-crop path skips them
+    keep = torch.nonzero((pixel_boxes[:, 2] > pixel_boxes[:, 0]) & (pixel_boxes[:, 3] > pixel_boxes[:, 1])).flatten()
+    if len(keep) == 0:
+        return torch.zeros((0, 3, size, size), dtype=torch.uint8, device=device), []
+    with warnings.catch_warnings():
+        # read-only Frame views: the uint8 tensor is only read, .float() below copies it
+        warnings.filterwarnings('ignore', message='The given NumPy array is not writable')
+        frame = torch.from_numpy(np.ascontiguousarray(image_source))
+    frame = frame.to(device).permute(2, 0, 1)[None].float()
+    crops = roi_align(frame, [pixel_boxes[keep].to(device)], output_size=size, spatial_scale=1.0, sampling_ratio=1, aligned=True)
+    return crops.round().clamp(0, 255).to(torch.uint8), keep.tolist()
+
+
+def preprocess_icons_tensor(crops, processor, prompt, do_resize=True):
+    """ Tensor equivalent of processor(images=[...], text=[prompt]*len(crops), return_tensors="pt")
+    for (K, 3, H, W) uint8 crops: resize, rescale and normalize run once on the whole batch.
+    Works for the florence2 (CLIPImageProcessor) and blip2 (BlipImageProcessor) processors.
+    """
+    image_processor = processor.image_processor
+    pixel_values = crops.float()
+    if do_resize and image_processor.do_resize:
+        size = image_processor.size
+        target = (size['height'], size['width']) if 'height' in size else (size['shortest_edge'], size['shortest_edge'])
+        # the hf processors resize through PIL and hand back uint8 pixels
+        pixel_values = F.interpolate(pixel_values, size=target, mode='bicubic', align_corners=False).round().clamp(0, 255)
+        if getattr(image_processor, 'do_center_crop', False):
+            crop_h, crop_w = image_processor.crop_size['height'], image_processor.crop_size['width']
+            top, left = (target[0] - crop_h) // 2, (target[1] - crop_w) // 2
+            pixel_values = pixel_values[:, :, top:top+crop_h, left:left+crop_w]
+    if image_processor.do_rescale:
+        pixel_values = pixel_values * image_processor.rescale_factor
+    if image_processor.do_normalize:
+        mean = torch.tensor(image_processor.image_mean, device=pixel_values.device).view(1, -1, 1, 1)
+        std = torch.tensor(image_processor.image_std, device=pixel_values.device).view(1, -1, 1, 1)
+        pixel_values = (pixel_values - mean) / std
+
+    # the text side is the same for every crop: run the processor once on a blank image and repeat it
+    blank = Image.new('RGB', (crops.shape[-1], crops.shape[-2]))
+    text_inputs = processor(images=[blank], text=[prompt], return_tensors="pt", do_resize=do_resize)
+    inputs = {k: v.repeat(len(crops), *([1] * (v.dim() - 1))) for k, v in text_inputs.items() if k != 'pixel_values'}
+    inputs['pixel_values'] = pixel_values
+    return inputs
+
+
+def crop_icons(image_source, boxes, preprocess='pil', device='cpu'):
+    """ 64x64 icon crops of the normalized xyxy boxes for the caption model.
+    Returns (uint8 tensor (K, 3, 64, 64) for preprocess='tensor' else None, list of the K HWC numpy crops) """
+    if preprocess == 'tensor':
+        crops, _ = crop_icons_tensor(image_source, boxes, size=64, device=device)
+        return crops, list(crops.permute(0, 2, 3, 1).cpu().numpy())
+    croped_images = []
+    for i, coord in enumerate(boxes):
         try:
             xmin, xmax = int(coord[0]*image_source.shape[1]), int(coord[2]*image_source.shape[1])
             ymin, ymax = int(coord[1]*image_source.shape[0]), int(coord[3]*image_source.shape[0])
             cropped_image = image_source[ymin:ymax, xmin:xmax, :]
-            cropped_image = cv2.resize(cropped_image, (64, 64))
-            croped_pil_image.append(to_pil(cropped_image))
+            croped_images.append(cv2.resize(cropped_image, (64, 64)))
         except:
             continue
+    return None, croped_images
+
+
+@torch.inference_mode()
+def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=None, batch_size=128, caption_cache=None, preprocess='pil', batcher=None, dedup='exact', stats=None, generation_args=None, timer=None):
+    # Number of samples per batch, --> 128 roughly takes 4 GB of GPU memory for florence v2 model
+    # preprocess: 'pil' (default) is the per-crop cv2/PIL path, 'tensor' crops and normalizes all icons as one batch
+    # (roi_align); faster, but not pixel-identical (crop edge sampling, torch vs PIL bicubic), see bench_caption_preprocess
+    # timer: optional util.timing.ParseTimer, records the 'crop' and 'caption' stages
+    # the other arguments are those of caption_icons
+    timer = timer or NULL_TIMER
+    if starting_idx:
+        non_ocr_boxes = filtered_boxes[starting_idx:]
+    else:
+        non_ocr_boxes = filtered_boxes
+    with timer.stage('crop') as stage:
+        crops, croped_images = crop_icons(image_source, non_ocr_boxes, preprocess=preprocess, device=caption_model_processor['model'].device)
+        stage['count'] = len(croped_images)
+    return caption_icons(croped_images, crops, caption_model_processor, prompt=prompt, batch_size=batch_size, caption_cache=caption_cache, preprocess=preprocess,
+                         batcher=batcher, dedup=dedup, stats=stats, generation_args=generation_args, timer=timer)
+
 
+@torch.inference_mode()
+def caption_icons(croped_images, crops, caption_model_processor, prompt=None, batch_size=128, caption_cache=None, preprocess='pil', batcher=None, dedup='exact', stats=None, generation_args=None, timer=None):
+    # Captions of the crop_icons output, possibly pooled from several frames (Omniparser.parse_batch)
+    # batcher: optional AdaptiveBatcher, picks the batch size (batch_size=None) or only backs off on out-of-memory
+    # dedup: 'exact' / 'near' (see icon_dedup_key) captions one crop per group of identical icons, None captions every crop
+    # stats: optional dict, filled with the crop / cache hit / captioned counts and the dedup ratio
+    # generation_args: optional generate() kwargs overriding the model defaults below (e.g. max_new_tokens, num_beams)
+    # timer: optional util.timing.ParseTimer, records the 'caption' stage
+    timer = timer or NULL_TIMER
+    to_pil = ToPILImage()
     model, processor = caption_model_processor['model'], caption_model_processor['processor']
+    device = model.device
+
     if not prompt:
         if 'florence' in model.config.name_or_path:
             prompt = "<CAPTION>"
         else:
             prompt = "The image shows"
-    
-    generated_texts = []
-    device = model.device
-    for i in range(0, len(croped_pil_image), batch_size):
-        start = time.time()
-        batch = croped_pil_image[i:i+batch_size]
-        t1 = time.time()
-        if model.device.type == 'cuda':
-            inputs = processor(images=batch, text=[prompt]*len(batch), return_tensors="pt", do_resize=False).to(device=device, dtype=torch.float16)
+    if 'florence' in model.config.name_or_path:
+        generation_args = {'max_new_tokens': 20, 'num_beams': 1, 'do_sample': False, **(generation_args or {})}
+    else:
+        generation_args = {'max_length': 100, 'num_beams': 5, 'no_repeat_ngram_size': 2, 'early_stopping': True, 'num_return_sequences': 1, **(generation_args or {})} # temperature=0.01, do_sample=True,
+
+    # captions depend on the generation settings too (profiles change max_new_tokens / num_beams)
+    namespace = f"{model.config.name_or_path}|{prompt}|{json.dumps(generation_args, sort_keys=True)}"
+    with timer.stage('caption') as stage:
+        # only crops missing from the cache go through model.generate
+        if caption_cache is not None:
+            cache_keys = [caption_cache.key(crop, namespace) for crop in croped_images]
+            generated_texts = [caption_cache.get(key) for key in cache_keys]
         else:
-            inputs = processor(images=batch, text=[prompt]*len(batch), return_tensors="pt").to(device=device)
-        if 'florence' in model.config.name_or_path:
-            generated_ids = model.generate(input_ids=inputs["input_ids"],pixel_values=inputs["pixel_values"],max_new_tokens=20,num_beams=1, do_sample=False)
+            generated_texts = [None] * len(croped_images)
+        miss_idx = [i for i, text in enumerate(generated_texts) if text is None]
+        # repeated icons (list-row checkboxes, tab close buttons, rating stars) are captioned once and fanned out
+        if dedup:
+            groups, unique_idx, member_group = {}, [], []
+            for i in miss_idx:
+                group = groups.setdefault(icon_dedup_key(croped_images[i], dedup), len(unique_idx))
+                if group == len(unique_idx):
+                    unique_idx.append(i)
+                member_group.append(group)
         else:
-            generated_ids = model.generate(**inputs, max_length=100, num_beams=5, no_repeat_ngram_size=2, early_stopping=True, num_return_sequences=1) # temperature=0.01, do_sample=True,
-        generated_text = processor.batch_decode(generated_ids, skip_special_tokens=True)
-        generated_text = [gen.strip() for gen in generated_text]
-        generated_texts.extend(generated_text)
-    
+            unique_idx, member_group = miss_idx, range(len(miss_idx))
+        if stats is not None:
+            stats.update(crops=len(croped_images), cache_hits=len(croped_images) - len(miss_idx), captioned=len(unique_idx),
+                         dedup_ratio=1 - len(unique_idx) / len(miss_idx) if miss_idx else 0.0)
+        if preprocess == 'tensor':
+            miss_crops = crops[torch.tensor(unique_idx, dtype=torch.long, device=crops.device)]
+        else:
+            miss_crops = [to_pil(croped_images[i]) for i in unique_idx]
+
+        def caption_batch(batch):
+            if preprocess == 'tensor':
+                # the cuda path feeds the 64x64 crops as is (do_resize=False), same as the PIL path below
+                inputs = preprocess_icons_tensor(batch, processor, prompt, do_resize=model.device.type != 'cuda')
+                inputs = {k: v.to(device) for k, v in inputs.items()}
+                inputs['pixel_values'] = inputs['pixel_values'].to(torch.float16 if model.device.type == 'cuda' else torch.float32)
+            elif model.device.type == 'cuda':
+                inputs = processor(images=batch, text=[prompt]*len(batch), return_tensors="pt", do_resize=False).to(device=device, dtype=torch.float16)
+            else:
+                inputs = processor(images=batch, text=[prompt]*len(batch), return_tensors="pt").to(device=device)
+            if 'florence' in model.config.name_or_path:
+                generated_ids = model.generate(input_ids=inputs["input_ids"],pixel_values=inputs["pixel_values"], **generation_args)
+            else:
+                generated_ids = model.generate(**inputs, **generation_args)
+            generated_text = processor.batch_decode(generated_ids, skip_special_tokens=True)
+            return [gen.strip() for gen in generated_text]
+
+        if batcher is not None:
+            new_texts = batcher.run(model.config.name_or_path, device, miss_crops, caption_batch, batch_size=batch_size, group=f'{namespace}|{preprocess}')
+        else:
+            new_texts = []
+            batch_size = batch_size or 128
+            for i in range(0, len(miss_crops), batch_size):
+                new_texts.extend(caption_batch(miss_crops[i:i+batch_size]))
+
+        for i, group in zip(miss_idx, member_group):
+            generated_texts[i] = new_texts[group]
+        if caption_cache is not None:
+            caption_cache.put_many((cache_keys[i], generated_texts[i]) for i in miss_idx)
+        stage['count'] = len(unique_idx)
     return generated_texts
 
 
 
-def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor):
+PHI3V_IMAGE_TAG = re.compile(r"<\|image_\d+\|>")
+
+
+def phi3v_prompt_chunks(processor, prompt):
+    """ token ids of the prompt before / after its single image tag, tokenized the way
+    Phi3VProcessor._convert_images_texts_to_inputs does it, so they can be computed once per prompt """
+    chunks = [processor.tokenizer(chunk).input_ids for chunk in PHI3V_IMAGE_TAG.split(prompt)]
+    assert len(chunks) == 2, 'the phi3v caption prompt takes exactly one image'
+    return chunks
+
+
+def collate_phi3v(processor, images, prompt_chunks):
+    """ Batched equivalent of one image_processor + _convert_images_texts_to_inputs call per image followed by
+    left padding: a single image_processor call for the batch, input ids built with repeat_interleave and left
+    padded with one masked assignment. Image tokens are -1 (image_1), as in the processor. """
+    image_inputs = processor.image_processor(images, return_tensors="pt")
+    num_img_tokens = torch.as_tensor(image_inputs['num_img_tokens'], dtype=torch.long).reshape(-1)
+    before, after = prompt_chunks
+    template = torch.tensor(before + [-1] + after, dtype=torch.long)
+    counts = torch.ones(len(images), len(template), dtype=torch.long)
+    counts[:, len(before)] = num_img_tokens
+    lengths = counts.sum(1)
+    max_len = int(lengths.max())
+    attention_mask = torch.arange(max_len)[None, :] >= (max_len - lengths)[:, None]
+    input_ids = torch.full((len(images), max_len), processor.tokenizer.pad_token_id, dtype=torch.long)
+    input_ids[attention_mask] = template.repeat(len(images)).repeat_interleave(counts.reshape(-1))
+    return {'input_ids': input_ids, 'attention_mask': attention_mask.long(), 'pixel_values': image_inputs['pixel_values'], 'image_sizes': image_inputs['image_sizes']}
+
+
+def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor, batch_size=5, batcher=None, timer=None):
+    # batch_size: images per generate() call, None with a batcher lets the AdaptiveBatcher pick it
+    # timer: optional util.timing.ParseTimer, records the 'crop' and 'caption' stages
+    timer = timer or NULL_TIMER
     to_pil = ToPILImage()
     if ocr_bbox:
         non_ocr_boxes = filtered_boxes[len(ocr_bbox):]
     else:
         non_ocr_boxes = filtered_boxes
-    croped_pil_image = []
-    for i, coord in enumerate(non_ocr_boxes):
-        xmin, xmax = int(coord[0]*image_source.shape[1]), int(coord[2]*image_source.shape[1])
-        ymin, ymax = int(coord[1]*image_source.shape[0]), int(coord[3]*image_source.shape[0])
-        cropped_image = image_source[ymin:ymax, xmin:xmax, :]
-        croped_pil_image.append(to_pil(cropped_image))
+    with timer.stage('crop') as stage:
+        croped_pil_image = []
+        for i, coord in enumerate(non_ocr_boxes):
+            xmin, xmax = int(coord[0]*image_source.shape[1]), int(coord[2]*image_source.shape[1])
+            ymin, ymax = int(coord[1]*image_source.shape[0]), int(coord[3]*image_source.shape[0])
+            cropped_image = image_source[ymin:ymax, xmin:xmax, :]
+            croped_pil_image.append(to_pil(cropped_image))
+        stage['count'] = len(croped_pil_image)
 
     model, processor = caption_model_processor['model'], caption_model_processor['processor']
     device = model.device
     messages = [{"role": "user", "content": "<|image_1|>\ndescribe the icon in one sentence"}] 
     prompt = processor.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    prompt_chunks = phi3v_prompt_chunks(processor, prompt)
 
-    batch_size = 5  # Number of samples per batch
-    generated_texts = []
-
-    for i in range(0, len(croped_pil_image), batch_size):
-        images = croped_pil_image[i:i+batch_size]
-        image_inputs = [processor.image_processor(x, return_tensors="pt") for x in images]
-        inputs ={'input_ids': [], 'attention_mask': [], 'pixel_values': [], 'image_sizes': []}
-        texts = [prompt] * len(images)
-        for i, txt in enumerate(texts):
-            input = processor._convert_images_texts_to_inputs(image_inputs[i], txt, return_tensors="pt")
-            inputs['input_ids'].append(input['input_ids'])
-            inputs['attention_mask'].append(input['attention_mask'])
-            inputs['pixel_values'].append(input['pixel_values'])
-            inputs['image_sizes'].append(input['image_sizes'])
-        max_len = max([x.shape[1] for x in inputs['input_ids']])
-        for i, v in enumerate(inputs['input_ids']):
-            inputs['input_ids'][i] = torch.cat([processor.tokenizer.pad_token_id * torch.ones(1, max_len - v.shape[1], dtype=torch.long), v], dim=1)
-            inputs['attention_mask'][i] = torch.cat([torch.zeros(1, max_len - v.shape[1], dtype=torch.long), inputs['attention_mask'][i]], dim=1)
-        inputs_cat = {k: torch.concatenate(v).to(device) for k, v in inputs.items()}
+    def caption_batch(images):
+        inputs_cat = {k: v.to(device) for k, v in collate_phi3v(processor, images, prompt_chunks).items()}
 
         generation_args = { 
             "max_new_tokens": 25, 
@@ -170,10 +386,17 @@ def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, captio
         # # remove input tokens 
         generate_ids = generate_ids[:, inputs_cat['input_ids'].shape[1]:]
         response = processor.batch_decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
-        response = [res.strip('\n').strip() for res in response]
-        generated_texts.extend(response)
+        return [res.strip('\n').strip() for res in response]
 
-    return generated_texts
+    with timer.stage('caption') as stage:
+        stage['count'] = len(croped_pil_image)
+        if batcher is not None:
+            return batcher.run(model.config.name_or_path, device, croped_pil_image, caption_batch, batch_size=batch_size, group=prompt)
+        batch_size = batch_size or 5
+        generated_texts = []
+        for i in range(0, len(croped_pil_image), batch_size):
+            generated_texts.extend(caption_batch(croped_pil_image[i:i+batch_size]))
+        return generated_texts
 
 def remove_overlap(boxes, iou_threshold, ocr_bbox=None):
     assert ocr_bbox is None or isinstance(ocr_bbox, List)
@@ -305,10 +528,81 @@ def remove_overlap_new(boxes, iou_threshold, ocr_bbox=None):
                     else:
                         filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
             else:
-                filtered_boxes.append(box1)
+                filtered_boxes.append({'type': 'icon', 'bbox': box1_elem['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
     return filtered_boxes # torch.tensor(filtered_boxes)
 
 
+def remove_overlap_vectorized(boxes, iou_threshold, ocr_bbox=None):
+    '''
+    Same inputs and outputs as remove_overlap_new, but the pairwise icon IoU and area matrices are
+    computed in one pass with numpy instead of nested python loops + list.remove, and the ocr/icon
+    containment is only evaluated on the intersecting pairs returned by a GridIndex over the ocr boxes.
+    Element types, 'source' tags, merged ocr labels and ordering match remove_overlap_new.
+    '''
+    assert ocr_bbox is None or isinstance(ocr_bbox, List)
+    if len(boxes) == 0:
+        return list(ocr_bbox) if ocr_bbox else []
+
+    # same float64 arithmetic (and order of operations) as the python IoU() so thresholds agree exactly
+    yolo_xyxy = np.asarray([elem['bbox'] for elem in boxes], dtype=np.float64).reshape(-1, 4)
+    yolo_area = (yolo_xyxy[:, 2] - yolo_xyxy[:, 0]) * (yolo_xyxy[:, 3] - yolo_xyxy[:, 1])
+    inter = intersection_area(yolo_xyxy[:, None], yolo_xyxy[None, :])
+    union = yolo_area[:, None] + yolo_area[None, :] - inter + 1e-6
+    positive = (yolo_area[:, None] > 0) & (yolo_area[None, :] > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio1 = np.where(positive, inter / yolo_area[:, None], 0)
+        ratio2 = np.where(positive, inter / yolo_area[None, :], 0)
+    iou = np.maximum(np.maximum(inter / union, ratio1), ratio2)
+    # keep the smaller box: drop box i if it overlaps any smaller box j (i != j is implied by the strict area check)
+    suppressed = ((iou > iou_threshold) & (yolo_area[:, None] > yolo_area[None, :])).any(axis=1)
+    keep_idx = np.flatnonzero(~suppressed)
+
+    if not ocr_bbox:
+        return [{'type': 'icon', 'bbox': boxes[i]['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'} for i in keep_idx]
+
+    icon_xyxy = yolo_xyxy[keep_idx]
+    icon_area = yolo_area[keep_idx]
+    ocr_xyxy = np.asarray([elem['bbox'] for elem in ocr_bbox], dtype=np.float64).reshape(-1, 4)
+    ocr_area = (ocr_xyxy[:, 2] - ocr_xyxy[:, 0]) * (ocr_xyxy[:, 3] - ocr_xyxy[:, 1])
+    # only (icon, ocr) pairs that actually intersect can be inside one another
+    rows, cols = GridIndex(ocr_xyxy).query_pairs(icon_xyxy)
+    inter = intersection_area(icon_xyxy[rows], ocr_xyxy[cols])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ocr_in_icon = inter / ocr_area[cols] > 0.80
+        icon_in_ocr = inter / icon_area[rows] > 0.80
+
+    # the python loop stops at the first ocr box that contains the icon (and is not itself inside the icon);
+    # ocr boxes seen before that point are still merged into the icon label and removed
+    stop = icon_in_ocr & ~ocr_in_icon
+    first_stop = np.full(len(keep_idx), len(ocr_bbox))
+    np.minimum.at(first_stop, rows[stop], cols[stop])
+    icon_dropped = first_stop < len(ocr_bbox)
+    merged = ocr_in_icon & (cols < first_stop[rows])
+    ocr_removed = np.zeros(len(ocr_bbox), dtype=bool)
+    ocr_removed[cols[merged]] = True
+    ocr_labels_per_icon = [''] * len(keep_idx)
+    for row, k in zip(rows[merged], cols[merged]):  # pairs come sorted by icon then ocr index
+        ocr_labels_per_icon[row] += ocr_bbox[k]['content'] + ' '
+
+    filtered_boxes = [elem for elem, removed in zip(ocr_bbox, ocr_removed) if not removed]
+    for row, i in enumerate(keep_idx):
+        if icon_dropped[row]:
+            continue
+        ocr_labels = ocr_labels_per_icon[row]
+        if ocr_labels:
+            filtered_boxes.append({'type': 'icon', 'bbox': boxes[i]['bbox'], 'interactivity': True, 'content': ocr_labels, 'source':'box_yolo_content_ocr'})
+        else:
+            filtered_boxes.append({'type': 'icon', 'bbox': boxes[i]['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
+    return filtered_boxes
+
+
+# 'legacy' keeps the original python implementation available so outputs can be compared
+OVERLAP_METHODS = {
+    'legacy': remove_overlap_new,
+    'vectorized': remove_overlap_vectorized,
+}
+
+
 def load_image(image_path: str) -> Tuple[np.array, torch.Tensor]:
     transform = T.Compose(
         [
@@ -347,7 +641,7 @@ def annotate(image_source: np.ndarray, boxes: torch.Tensor, logits: torch.Tensor
     labels = [f"{phrase}" for phrase in range(boxes.shape[0])]
 
     box_annotator = BoxAnnotator(text_scale=text_scale, text_padding=text_padding,text_thickness=text_thickness,thickness=thickness) # 0.8 for mobile/web, 0.3 for desktop # 0.4 for mind2web
-    annotated_frame = image_source.copy()
+    annotated_frame = image_source.copy()  # the only copy of the frame, image_source may be a read-only Frame view
     annotated_frame = box_annotator.annotate(scene=annotated_frame, detections=detections, labels=labels, image_size=(w,h))
 
     label_coordinates = {f"{phrase}": v for phrase, v in zip(phrases, xywh)}
@@ -379,6 +673,14 @@ def predict_yolo(model, image, box_threshold, imgsz, scale_img, iou_threshold=0.
     """ Use huggingface model to replace the original model
     """
     # model = model['model']
+    if isinstance(image, Frame):
+        # ultralytics reads numpy frames as BGR (a PIL image it would flip into a new BGR array itself),
+        # the exported graphs read them as RGB
+        exported = isinstance(model, tuple(DETECTOR_BACKENDS.values())) and not isinstance(model, DETECTOR_BACKENDS['torch'])
+        image = image.array if exported else image.bgr
+    if isinstance(model, tuple(DETECTOR_BACKENDS.values())):
+        boxes, conf = model.detect(image, conf=box_threshold, iou=iou_threshold, imgsz=imgsz if scale_img else None)
+        return boxes, conf, [str(i) for i in range(len(boxes))]
     if scale_img:
         result = model.predict(
         source=image,
@@ -398,48 +700,157 @@ def predict_yolo(model, image, box_threshold, imgsz, scale_img, iou_threshold=0.
 
     return boxes, conf, phrases
 
+def predict_yolo_batch(model, images, box_threshold, imgsz, scale_img, iou_threshold=0.7):
+    """ predict_yolo for a list of Frames / PIL images, returns one (boxes, conf, phrases) per image.
+    The ultralytics model runs the list as one batch; the exported graphs (util.detector_backends) are run per image """
+    if isinstance(model, tuple(DETECTOR_BACKENDS.values())) and not isinstance(model, DETECTOR_BACKENDS['torch']):
+        return [predict_yolo(model, image, box_threshold, imgsz, scale_img, iou_threshold=iou_threshold) for image in images]
+    # ultralytics reads numpy frames as BGR; frames of different sizes are letterboxed to a common square input
+    source = [image.bgr if isinstance(image, Frame) else image for image in images]
+    kwargs = {'imgsz': imgsz} if scale_img else {}
+    results = model.predict(source=source, conf=box_threshold, iou=iou_threshold, **kwargs)
+    return [(result.boxes.xyxy, result.boxes.conf, [str(i) for i in range(len(result.boxes))]) for result in results]
+
 def int_box_area(box, w, h):
     x1, y1, x2, y2 = box
     int_box = [int(x1*w), int(y1*h), int(x2*w), int(y2*h)]
     area = (int_box[2] - int_box[0]) * (int_box[3] - int_box[1])
     return area
 
-def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_TRESHOLD=0.01, output_coord_in_ratio=False, ocr_bbox=None, text_scale=0.4, text_padding=5, draw_bbox_config=None, caption_model_processor=None, ocr_text=[], use_local_semantics=True, iou_threshold=0.9,prompt=None, scale_img=False, imgsz=None, batch_size=128):
-    """Process either an image path or Image object
-    
-    Args:
-        image_source: Either a file path (str) or PIL Image object
-        ...
+SOM_IMAGE_FORMATS = {
+    # format: (PIL format, option the quality argument maps to, accepted quality range)
+    'png': ('PNG', 'compress_level', (0, 9)),  # quality = zlib level 0-9, lower is faster and larger
+    'jpeg': ('JPEG', 'quality', (1, 95)),  # quality = 1-95
+    'webp': ('WEBP', 'quality', (1, 100)),  # quality = 1-100
+    'raw': (None, None, None),  # uncompressed HWC RGB uint8 bytes, the caller needs the size to decode; no quality
+}
+
+
+def check_som_image_options(image_format='png', quality=None, scale=None):
+    """ raise ValueError for SOM image options encode_som_image would reject (quality is ignored for raw) """
+    if image_format not in SOM_IMAGE_FORMATS:
+        raise ValueError(f"Unknown SOM image format {image_format!r}, expected one of {list(SOM_IMAGE_FORMATS)}")
+    if scale is not None and not 0 < scale <= 1:
+        raise ValueError(f"SOM image scale must be in (0, 1], got {scale}")
+    quality_range = SOM_IMAGE_FORMATS[image_format][2]
+    if quality is not None and quality_range is not None and not quality_range[0] <= quality <= quality_range[1]:
+        raise ValueError(f"{image_format} SOM image quality must be in {quality_range[0]}-{quality_range[1]}, got {quality}")
+
+
+def encode_som_image(annotated_frame: np.ndarray, image_format='png', quality=None, scale=None):
+    """ base64 encode the annotated frame.
+    image_format: key of SOM_IMAGE_FORMATS; quality: png compress level or jpeg/webp quality, None for the PIL default;
+    scale: optional downscale factor in (0, 1] applied before encoding.
+    Returns (encoded_image, {'format', 'width', 'height'})
     """
-    if isinstance(image_source, str):
-        image_source = Image.open(image_source)
-    image_source = image_source.convert("RGB") # for CLIP
-    w, h = image_source.size
-    if not imgsz:
-        imgsz = (h, w)
-    # print('image size:', w, h)
-    xyxy, logits, phrases = predict_yolo(model=model, image=image_source, box_threshold=BOX_TRESHOLD, imgsz=imgsz, scale_img=scale_img, iou_threshold=0.1)
-    xyxy = xyxy / torch.Tensor([w, h, w, h]).to(xyxy.device)
-    image_source = np.asarray(image_source)
-    phrases = [str(i) for i in range(len(phrases))]
+    check_som_image_options(image_format, quality, scale)
+    if scale is not None and scale < 1:
+        h, w = annotated_frame.shape[:2]
+        annotated_frame = cv2.resize(annotated_frame, (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1)), interpolation=cv2.INTER_AREA)
+    h, w = annotated_frame.shape[:2]
+    pil_format, quality_option, _ = SOM_IMAGE_FORMATS[image_format]
+    if pil_format is None:
+        data = np.ascontiguousarray(annotated_frame, dtype=np.uint8).tobytes()
+    else:
+        buffered = io.BytesIO()
+        options = {quality_option: quality} if quality is not None else {}
+        Image.fromarray(annotated_frame).save(buffered, format=pil_format, **options)
+        data = buffered.getvalue()
+    return base64.b64encode(data).decode('ascii'), {'format': image_format, 'width': w, 'height': h}
+
 
-    # annotate the image with labels
+def render_som_image(image_source: np.ndarray, boxes, draw_bbox_config=None, text_scale=0.4, text_padding=5, logits=None, encode=True):
+    """ Draw the numbered set-of-mark boxes on the frame and base64 encode it as PNG.
+    boxes: normalized xyxy (N, 4), in parsed_content_list order.
+    encode: False skips the PNG encoding (encoded_image is None), for callers that encode with encode_som_image themselves.
+    Returns (encoded_image, label_coordinates in pixel xywh, annotated_frame)
+    """
+    boxes = box_convert(boxes=torch.as_tensor(boxes, dtype=torch.float32).reshape(-1, 4), in_fmt="xyxy", out_fmt="cxcywh")
+    phrases = [i for i in range(len(boxes))]
+
+    # draw boxes
+    if draw_bbox_config:
+        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=boxes, logits=logits, phrases=phrases, **draw_bbox_config)
+    else:
+        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=boxes, logits=logits, phrases=phrases, text_scale=text_scale, text_padding=text_padding)
+
+    encoded_image = encode_som_image(annotated_frame)[0] if encode else None
+    return encoded_image, label_coordinates, annotated_frame
+
+
+def fuse_ocr_icons(xyxy, ocr_bbox, ocr_text, w, h, iou_threshold=0.9, overlap_method='vectorized'):
+    """ Merge the icon boxes (pixel xyxy tensor) with the ocr boxes (pixel xyxy list) of a w x h frame.
+    Returns (elements with the icons to caption last, index of the first of them, their normalized xyxy as an (N, 4)
+    tensor, normalized ocr boxes) """
+    xyxy = xyxy / torch.Tensor([w, h, w, h]).to(xyxy.device)
     if ocr_bbox:
         ocr_bbox = torch.tensor(ocr_bbox) / torch.Tensor([w, h, w, h])
         ocr_bbox=ocr_bbox.tolist()
     else:
         print('no ocr bbox!!!')
-        ocr_bbox = None
+        ocr_bbox = []
 
     ocr_bbox_elem = [{'type': 'text', 'bbox':box, 'interactivity':False, 'content':txt, 'source': 'box_ocr_content_ocr'} for box, txt in zip(ocr_bbox, ocr_text) if int_box_area(box, w, h) > 0] 
     xyxy_elem = [{'type': 'icon', 'bbox':box, 'interactivity':True, 'content':None} for box in xyxy.tolist() if int_box_area(box, w, h) > 0]
-    filtered_boxes = remove_overlap_new(boxes=xyxy_elem, iou_threshold=iou_threshold, ocr_bbox=ocr_bbox_elem)
+    filtered_boxes = OVERLAP_METHODS[overlap_method](boxes=xyxy_elem, iou_threshold=iou_threshold, ocr_bbox=ocr_bbox_elem)
     
     # sort the filtered_boxes so that the one with 'content': None is at the end, and get the index of the first 'content': None
     filtered_boxes_elem = sorted(filtered_boxes, key=lambda x: x['content'] is None)
     # get the index of the first 'content': None
-    starting_idx = next((i for i, box in enumerate(filtered_boxes_elem) if box['content'] is None), -1)
-    filtered_boxes = torch.tensor([box['bbox'] for box in filtered_boxes_elem])
+    starting_idx = next((i for i, box in enumerate(filtered_boxes_elem) if box['content'] is None), len(filtered_boxes_elem))
+    filtered_boxes = torch.tensor([box['bbox'] for box in filtered_boxes_elem]).reshape(-1, 4)
+    return filtered_boxes_elem, starting_idx, filtered_boxes, ocr_bbox
+
+
+def fill_icon_contents(filtered_boxes_elem, parsed_content_icon):
+    """ fill the filtered_boxes_elem None content with parsed_content_icon in order (pops the used captions) """
+    for i, box in enumerate(filtered_boxes_elem):
+        if box['content'] is None:
+            box['content'] = parsed_content_icon.pop(0)
+
+
+def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_TRESHOLD=0.01, output_coord_in_ratio=False, ocr_bbox=None, text_scale=0.4, text_padding=5, draw_bbox_config=None, caption_model_processor=None, ocr_text=[], use_local_semantics=True, iou_threshold=0.9,prompt=None, scale_img=False, imgsz=None, batch_size=None, overlap_method='vectorized', caption_cache=None, caption_preprocess='pil', yolo_result=None, encode_image=True, caption_batcher=None, caption_dedup='exact', caption_stats=None, caption_generation_args=None, timer=None, annotate=True):
+    """Process either an image path or Image object
+    
+    Args:
+        image_source: A file path (str), PIL Image object or util.frame.Frame (decoded once, shared with ocr / yolo)
+        overlap_method: 'vectorized' (default) or 'legacy', see OVERLAP_METHODS
+        caption_cache: optional CaptionCache, icon crops already captioned are not sent to the caption model
+        caption_preprocess: 'pil' (per-crop cv2/PIL path, default) or 'tensor' (batched roi_align crop + normalize,
+            faster but not pixel-identical to 'pil')
+        batch_size: icons per caption generate() call, None for the model default (128, phi3v 5) or, with a
+            caption_batcher, the adaptive size
+        caption_batcher: optional AdaptiveBatcher sizing the caption batches, batch_size=None lets it pick the size
+        caption_dedup: 'exact' (default), 'near' or None, identical icon crops in the frame are captioned once
+        caption_stats: optional dict filled with the caption counts and dedup ratio of get_parsed_content_icon
+        caption_generation_args: optional generate() kwargs for the icon captions, see util.profiles
+        yolo_result: optional (xyxy, logits, phrases) from predict_yolo computed by the caller (e.g. concurrently with ocr)
+        encode_image: False returns the annotated frame (HWC uint8) in place of the base64 PNG, for callers that pick
+            the output encoding themselves with encode_som_image
+        timer: optional util.timing.ParseTimer, records the yolo (unless yolo_result is given), fusion, crop, caption
+            and annotate stages with their element counts
+        annotate: False skips drawing the SOM image (encoded image and label coordinates are None), for callers that
+            only need the elements
+        ...
+    """
+    timer = timer or NULL_TIMER
+    frame = as_frame(image_source) # RGB for CLIP
+    w, h = frame.size
+    if not imgsz:
+        imgsz = (h, w)
+    # print('image size:', w, h)
+    if yolo_result is None:
+        with timer.stage('yolo') as stage:
+            xyxy, logits, phrases = predict_yolo(model=model, image=frame, box_threshold=BOX_TRESHOLD, imgsz=imgsz, scale_img=scale_img, iou_threshold=0.1)
+            stage['count'] = len(xyxy)
+    else:
+        xyxy, logits, phrases = yolo_result
+    image_source = frame.array
+    phrases = [str(i) for i in range(len(phrases))]
+
+    with timer.stage('fusion') as stage:
+        filtered_boxes_elem, starting_idx, filtered_boxes, ocr_bbox = fuse_ocr_icons(xyxy, ocr_bbox, ocr_text, w, h, iou_threshold=iou_threshold, overlap_method=overlap_method)
+        stage['count'] = len(filtered_boxes_elem)
     print('len(filtered_boxes):', len(filtered_boxes), starting_idx)
 
     # get parsed icon local semantics
@@ -447,16 +858,13 @@ def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_T
     if use_local_semantics:
         caption_model = caption_model_processor['model']
         if 'phi3_v' in caption_model.config.model_type: 
-            parsed_content_icon = get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor)
+            parsed_content_icon = get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor, batch_size=batch_size, batcher=caption_batcher, timer=timer)
         else:
-            parsed_content_icon = get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=prompt,batch_size=batch_size)
+            parsed_content_icon = get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=prompt,batch_size=batch_size, caption_cache=caption_cache, preprocess=caption_preprocess, batcher=caption_batcher, dedup=caption_dedup, stats=caption_stats, generation_args=caption_generation_args, timer=timer)
         ocr_text = [f"Text Box ID {i}: {txt}" for i, txt in enumerate(ocr_text)]
         icon_start = len(ocr_text)
         parsed_content_icon_ls = []
-        # fill the filtered_boxes_elem None content with parsed_content_icon in order
-        for i, box in enumerate(filtered_boxes_elem):
-            if box['content'] is None:
-                box['content'] = parsed_content_icon.pop(0)
+        fill_icon_contents(filtered_boxes_elem, parsed_content_icon)
         for i, txt in enumerate(parsed_content_icon):
             parsed_content_icon_ls.append(f"Icon Box ID {str(i+icon_start)}: {txt}")
         parsed_content_merged = ocr_text + parsed_content_icon_ls
@@ -465,20 +873,13 @@ def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_T
         parsed_content_merged = ocr_text
     print('time to get parsed content:', time.time()-time1)
 
-    filtered_boxes = box_convert(boxes=filtered_boxes, in_fmt="xyxy", out_fmt="cxcywh")
-
-    phrases = [i for i in range(len(filtered_boxes))]
-    
-    # draw boxes
-    if draw_bbox_config:
-        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=logits, phrases=phrases, **draw_bbox_config)
-    else:
-        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=logits, phrases=phrases, text_scale=text_scale, text_padding=text_padding)
-    
-    pil_img = Image.fromarray(annotated_frame)
-    buffered = io.BytesIO()
-    pil_img.save(buffered, format="PNG")
-    encoded_image = base64.b64encode(buffered.getvalue()).decode('ascii')
+    if not annotate:
+        return None, None, filtered_boxes_elem
+    with timer.stage('annotate') as stage:
+        encoded_image, label_coordinates, annotated_frame = render_som_image(image_source, filtered_boxes, draw_bbox_config=draw_bbox_config, text_scale=text_scale, text_padding=text_padding, logits=logits, encode=encode_image)
+        stage['count'] = len(label_coordinates)
+    if not encode_image:
+        encoded_image = annotated_frame
     if output_coord_in_ratio:
         label_coordinates = {k: [v[0]/w, v[1]/h, v[2]/w, v[3]/h] for k, v in label_coordinates.items()}
         assert w == annotated_frame.shape[1] and h == annotated_frame.shape[0]
@@ -501,28 +902,142 @@ def get_xywh_yolo(input):
     x, y, w, h = int(x), int(y), int(w), int(h)
     return x, y, w, h
 
-def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, output_bb_format='xywh', goal_filtering=None, easyocr_args=None, use_paddleocr=False):
-    if isinstance(image_source, str):
-        image_source = Image.open(image_source)
-    if image_source.mode == 'RGBA':
-        # Convert RGBA to RGB to avoid alpha channel issues
-        image_source = image_source.convert('RGB')
-    image_np = np.array(image_source)
-    w, h = image_source.size
+def get_ocr_tiles(w, h, tile_size, tile_overlap):
+    """ overlapping (x0, y0, x1, y1) pixel tiles covering a w x h frame, the last row/column is aligned to the frame edge
+    """
+    step = max(tile_size - tile_overlap, 1)
+
+    def starts(length):
+        pos = list(range(0, max(length - tile_size, 0) + 1, step))
+        if pos[-1] + tile_size < length:
+            pos.append(length - tile_size)
+        return pos
+
+    return [(x, y, min(x + tile_size, w), min(y + tile_size, h)) for y in starts(h) for x in starts(w)]
+
+
+def _ocr_tile(image_np, tile, use_paddleocr, easyocr_args):
+    """ ocr one tile, returns [(points, text, conf)] with points in full-frame pixel coordinates """
+    x0, y0, x1, y1 = tile
+    crop = np.ascontiguousarray(image_np[y0:y1, x0:x1])
+    if use_paddleocr:
+        result = get_ocr_engine('paddleocr').ocr(crop, cls=False)[0] or []
+        result = [(item[0], item[1][0], item[1][1]) for item in result]
+    else:
+        # paragraph=True results have no confidence
+        result = [(item[0], item[1], item[2] if len(item) > 2 else None) for item in get_ocr_engine('easyocr').readtext(crop, **easyocr_args)]
+    return [([[p[0] + x0, p[1] + y0] for p in points], text, conf) for points, text, conf in result]
+
+
+def _merge_seam_text(left, right, min_overlap=3):
+    # a line cut by a seam is read twice around the overlap: "open the fi" + "he file" -> "open the file";
+    # a shorter shared end is chance ("open" + "new"), those are two words
+    for k in range(min(len(left), len(right)), min_overlap - 1, -1):
+        if left.endswith(right[:k]):
+            return left + right[k:]
+    return left + ' ' + right
+
+
+def dedup_tiled_ocr(detections, tiles, contain_threshold=0.7, same_line_threshold=0.6):
+    """
+    Merge the ocr results of overlapping tiles.
+    detections: [(points, text, conf, tile_idx)], ordered by tile
+    - a box (mostly) inside a box from another tile is the same text read twice: keep the larger one
+    - boxes from different tiles on the same line that overlap horizontally are one line cut by a seam: join them
+    Only boxes reaching into another tile can have a duplicate, everything else is passed through.
+    """
+    tiles_np = np.asarray(tiles, dtype=np.float64)
+    kept = []  # [xyxy, text, conf, set of tile_idx]
+    for points, text, conf, tile_idx in detections:
+        pts = np.asarray(points, dtype=np.float64)
+        box = np.array([pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max()])
+        in_other_tile = intersection_area(box[None], tiles_np) > 0
+        in_other_tile[tile_idx] = False
+        merged = False
+        if in_other_tile.any():
+            for other in kept:
+                if tile_idx in other[3]:
+                    continue
+                inter = intersection_area(box, other[0])
+                if inter <= 0:
+                    continue
+                area, other_area = (box[2] - box[0]) * (box[3] - box[1]), (other[0][2] - other[0][0]) * (other[0][3] - other[0][1])
+                union_w = max(box[2], other[0][2]) - min(box[0], other[0][0])
+                larger_w = max(box[2] - box[0], other[0][2] - other[0][0])
+                slack = 0.5 * min(box[3] - box[1], other[0][3] - other[0][1])
+                # a piece reaching past the larger box is the other half of a cut line, not a duplicate
+                if inter / max(min(area, other_area), 1e-6) > contain_threshold and union_w <= larger_w + slack:
+                    if area > other_area:
+                        other[0], other[1], other[2] = box, text, conf
+                    other[3].add(tile_idx)
+                    merged = True
+                    break
+                v_overlap = min(box[3], other[0][3]) - max(box[1], other[0][1])
+                if v_overlap / max(min(box[3] - box[1], other[0][3] - other[0][1]), 1e-6) > same_line_threshold:
+                    left, right = (other[1], text) if other[0][0] <= box[0] else (text, other[1])
+                    other[0] = np.concatenate([np.minimum(box[:2], other[0][:2]), np.maximum(box[2:], other[0][2:])])
+                    other[1] = _merge_seam_text(left, right)
+                    other[2] = None if conf is None or other[2] is None else min(conf, other[2])
+                    other[3].add(tile_idx)
+                    merged = True
+                    break
+        if not merged:
+            kept.append([box, text, conf, {tile_idx}])
+    # reading order, roughly what a single full-frame pass returns
+    kept.sort(key=lambda k: (k[0][1], k[0][0]))
+    return [([[b[0], b[1]], [b[2], b[1]], [b[2], b[3]], [b[0], b[3]]], text, conf) for b, text, conf, _ in kept]
+
+
+def ocr_tiled(image_np, use_paddleocr=False, easyocr_args=None, tile_size=1280, tile_overlap=128, tile_workers=4):
+    """ Split the frame into overlapping tiles, ocr them in a thread pool and map the results back.
+    Returns [(points, text, conf)] like easyocr's readtext.
+    """
+    h, w = image_np.shape[:2]
+    tiles = get_ocr_tiles(w, h, tile_size, tile_overlap)
+    # paddle predictors are not safe to share between threads
+    workers = 1 if use_paddleocr else min(tile_workers, len(tiles))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocr_tile') as executor:
+        results = list(executor.map(lambda tile: _ocr_tile(image_np, tile, use_paddleocr, easyocr_args or {}), tiles))
+    detections = [(points, text, conf, tile_idx) for tile_idx, result in enumerate(results) for points, text, conf in result]
+    return dedup_tiled_ocr(detections, tiles)
+
+
+def check_ocr_box(image_source: Union[str, Image.Image, Frame], display_img = True, output_bb_format='xywh', goal_filtering=None, easyocr_args=None, use_paddleocr=False, tile_size=None, tile_overlap=128, tile_workers=4, confidences=None):
+    """ tile_size: if set and the frame is larger than one tile, ocr runs on overlapping tile_size x tile_size tiles
+        (tile_overlap px overlap) in tile_workers threads, see ocr_tiled
+        confidences: optional list, extended with the recognition confidence of every returned box (None where the
+        engine gives none, easyocr with paragraph=True)
+    """
+    # RGBA / palette / grayscale images are converted to RGB once, a Frame is read in place
+    frame = as_frame(image_source)
+    image_np = frame.array
+    w, h = frame.size
+    tiled = tile_size is not None and (w > tile_size or h > tile_size)
     if use_paddleocr:
         if easyocr_args is None:
             text_threshold = 0.5
         else:
             text_threshold = easyocr_args['text_threshold']
-        result = paddle_ocr.ocr(image_np, cls=False)[0]
+        if tiled:
+            result = ocr_tiled(image_np, use_paddleocr=True, tile_size=tile_size, tile_overlap=tile_overlap, tile_workers=tile_workers)
+            result = [(points, (txt, conf)) for points, txt, conf in result]
+        else:
+            result = get_ocr_engine('paddleocr').ocr(image_np, cls=False)[0]
         coord = [item[0] for item in result if item[1][1] > text_threshold]
         text = [item[1][0] for item in result if item[1][1] > text_threshold]
+        conf = [item[1][1] for item in result if item[1][1] > text_threshold]
     else:  # EasyOCR
         if easyocr_args is None:
             easyocr_args = {}
-        result = reader.readtext(image_np, **easyocr_args)
+        if tiled:
+            result = ocr_tiled(image_np, easyocr_args=easyocr_args, tile_size=tile_size, tile_overlap=tile_overlap, tile_workers=tile_workers)
+        else:
+            result = get_ocr_engine('easyocr').readtext(image_np, **easyocr_args)
         coord = [item[0] for item in result]
         text = [item[1] for item in result]
+        conf = [item[2] if len(item) > 2 else None for item in result]
+    if confidences is not None:
+        confidences.extend(conf)
     if display_img:
         opencv_img = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
         bb = []
@@ -531,6 +1046,7 @@ def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, out
             bb.append((x, y, a, b))
             cv2.rectangle(opencv_img, (x, y), (x+a, y+b), (0, 255, 0), 2)
         #  matplotlib expects RGB
+        from matplotlib import pyplot as plt
         plt.imshow(cv2.cvtColor(opencv_img, cv2.COLOR_BGR2RGB))
     else:
         if output_bb_format == 'xywh':